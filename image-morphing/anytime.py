@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Anytime search helpers - wall-clock deadlines, target fitness and best-so-far snapshots written in the background
+"""
+
+import os
+import time
+import threading
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#stopping rule of a search: a deadline in seconds from now and/or a fitness good enough to stop at (minimization)
+#either can be None, the budget is a dict so that it can be passed down to the inner loops of the search
+def make_budget(deadline=None,target_fitness=None):
+	return {"deadline":None if deadline is None else time.time()+deadline,"target_fitness":target_fitness}
+
+#True when the deadline has passed or the given fitness reached the target
+def budget_exhausted(budget,fitness):
+	if budget is None:
+		return False
+	if budget["target_fitness"] is not None and fitness<=budget["target_fitness"]:
+		return True
+	return budget["deadline"] is not None and time.time()>=budget["deadline"]
+
+#starts a thread that writes the best-so-far solution to filename at most every interval seconds
+#the search only hands over a copy of its state, building and encoding the image happens in the thread
+#save(data,path) writes data to path, the file is written to a temporary name and renamed so it is never half-written
+def start_snapshot_writer(filename,interval,save):
+	writer={"filename":filename,"interval":interval,"save":save,"last":time.time(),"pending":None,
+		"lock":threading.Lock(),"wake":threading.Event(),"stop":False,"written":0}
+	writer["thread"]=threading.Thread(target=snapshot_loop,args=(writer,))
+	writer["thread"].daemon=True
+	writer["thread"].start()
+	return writer
+
+#True when the writer is waiting for a new snapshot, lets the search skip copying its state the rest of the time
+def snapshot_due(writer):
+	return writer is not None and time.time()-writer["last"]>=writer["interval"]
+
+#hands a snapshot over to the writer, an older snapshot that was not written yet is simply replaced
+def submit_snapshot(writer,data):
+	writer["last"]=time.time()
+	with writer["lock"]:
+		writer["pending"]=data
+	writer["wake"].set()
+
+#writes the pending snapshot (if any) and waits for the thread to finish
+def stop_snapshot_writer(writer):
+	if writer is None:
+		return
+	writer["stop"]=True
+	writer["wake"].set()
+	writer["thread"].join()
+
+#body of the writer thread
+def snapshot_loop(writer):
+	name,extension=os.path.splitext(writer["filename"])
+	tmp_path=name+".tmp"+extension
+
+	while not writer["stop"]:
+		writer["wake"].wait()
+		writer["wake"].clear()
+		write_pending(writer,tmp_path)
+	write_pending(writer,tmp_path)
+
+#writes the latest snapshot handed over by the search, if it has not been written yet
+def write_pending(writer,tmp_path):
+	with writer["lock"]:
+		data=writer["pending"]
+		writer["pending"]=None
+
+	if data is not None:
+		writer["save"](data,tmp_path)
+		os.rename(tmp_path,writer["filename"])
+		writer["written"]+=1
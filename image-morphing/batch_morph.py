@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Batch morphing - runs many (source, palette, solver) jobs in a pool of processes sharing the decoded images
+"""
+
+import os
+import json
+import time
+import ctypes
+import shutil
+import tempfile
+import threading
+from Queue import Queue
+from multiprocessing import Pool,cpu_count
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from PIL import Image
+import source_palette_ea
+import source_palette_ils
+import source_palette_sa
+import source_palette_sort
+import hungarian_palette
+import pyramid_palette
+import sliced_palette
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#a job is a dict with the source and palette paths, the solver name, its params and the output path (optional)
+#the manifest is a JSON lines file with one job per line
+def read_manifest(path):
+	with open(path) as f:
+		return [json.loads(line) for line in f if line.strip()]
+
+#one job per (source, palette) pair of the cross product, pairs of an image with itself are skipped
+def cross_product_jobs(sources,palettes,solver,params):
+	return [{"source":source,"palette":palette,"solver":solver,"params":params}
+		for source in sources for palette in palettes if source!=palette]
+
+#output path of a job, like the palette.split(".")[0]+"_rearranged.png" of the single runs but unique per job
+def output_path(job,output_dir):
+	if job.get("output"):
+		return job["output"]
+	source_name=os.path.splitext(os.path.basename(job["source"]))[0]
+	palette_name=os.path.splitext(os.path.basename(job["palette"]))[0]
+	return os.path.join(output_dir,palette_name+"_to_"+source_name+"_"+job["solver"]+".png")
+
+#each solver takes the source and palette pixels as (rows,columns,3) uint8 arrays and the params of the job, and
+#returns new_palette_order, new_palette_order[i] being the palette pixel placed at the ith position of the source
+def solve_rank(source_pixels,palette_pixels,params):
+	key_func=source_palette_sort.rank_keys[params.get("key","hilbert")]
+	return source_palette_sort.rank_order(source_pixels.reshape(-1,3),palette_pixels.reshape(-1,3),key_func)
+
+def solve_pyramid(source_pixels,palette_pixels,params):
+	return pyramid_palette.pyramid_order(source_pixels.astype(np.int64),palette_pixels.reshape(-1,3).astype(np.int64),
+		params.get("max_coarse",1024),params.get("window",8))
+
+def solve_tiled(source_pixels,palette_pixels,params):
+	return hungarian_palette.tiled_assignment(to_image(source_pixels),to_image(palette_pixels),params.get("tile_size",32),
+		lab=params.get("lab",False))
+
+#the sparse assignment starts from the sliced transport solution and can only improve it
+def solve_sparse(source_pixels,palette_pixels,params):
+	initial_order=solve_sliced(source_pixels,palette_pixels,params)
+	return hungarian_palette.sparse_assignment(to_image(source_pixels),to_image(palette_pixels),params.get("k",8),
+		params.get("lab",False),initial_order)
+
+def solve_sliced(source_pixels,palette_pixels,params):
+	return sliced_palette.sliced_order(source_pixels.reshape(-1,3),palette_pixels.reshape(-1,3),params.get("n_iterations",256),
+		params.get("lab",False),params.get("step",0.1),seed=params.get("seed"))
+
+def solve_sa(source_pixels,palette_pixels,params):
+	order,best_fitness=source_palette_sa.sa(to_image(source_pixels),to_image(palette_pixels),params.get("n_steps"),
+		params.get("batch_size",4096),seed=params.get("seed"),deadline=params.get("deadline",60))
+	return order
+
+def solve_ea(source_pixels,palette_pixels,params):
+	population,fitnesses=source_palette_ea.ea_array(to_image(source_pixels),to_image(palette_pixels),params.get("n_generations"),
+		params.get("size_pop",20),params.get("tournament_size",3),source_palette_ea.crossovers[params.get("crossover","uniform_order")],
+		params.get("prob_cross",0.9),source_palette_ea.swap_mutation,params.get("prob_mut",0.0005),source_palette_ea.fitness_rgb_batch,
+		params.get("elite_size",0.05),seed=params.get("seed"),deadline=params.get("deadline",60))
+	return population[0]
+
+#the ils works on pixel lists, it is started from the rank order and its result is mapped back to palette indices
+def solve_ils(source_pixels,palette_pixels,params):
+	initial_order=solve_rank(source_pixels,palette_pixels,params)
+	best=source_palette_ils.ils(to_image(source_pixels),to_image(palette_pixels),params.get("iterations"),
+		params.get("convergence_width",1000),initial_order=initial_order,deadline=params.get("deadline",60),guided=params.get("guided",0.0))
+	return pixels_to_order(palette_pixels.reshape(-1,3),np.array(best[0],dtype=np.uint8))
+
+solvers={"rank":solve_rank,"pyramid":solve_pyramid,"tiled":solve_tiled,"sliced":solve_sliced,"sparse":solve_sparse,"sa":solve_sa,"ea":solve_ea,"ils":solve_ils}
+
+#decoded images of the batch, path -> (shared buffer, shape), each image is decoded once whatever the number of jobs
+#using it and the buffers are inherited by the workers without being copied or pickled
+def build_cache(jobs):
+	cache={}
+	for job in jobs:
+		for path in (job["source"],job["palette"]):
+			if path not in cache:
+				pixels=np.asarray(Image.open(path).convert("RGB"),dtype=np.uint8)
+				raw=RawArray(ctypes.c_uint8,pixels.size)
+				np.frombuffer(raw,dtype=np.uint8)[:]=pixels.ravel()
+				cache[path]=(raw,pixels.shape)
+	return cache
+
+#shared images of a batch worker, set once by init_batch_worker
+worker_state={}
+
+#wraps the shared buffers inherited from the parent process into read-only numpy arrays
+def init_batch_worker(cache):
+	for path,(raw,shape) in cache.iteritems():
+		pixels=np.frombuffer(raw,dtype=np.uint8).reshape(shape)
+		pixels.flags.writeable=False
+		worker_state[path]=pixels
+
+#runs one job in a temporary directory, the solvers that write best_palette.png do not overwrite each other's
+#returns the job, its output path and either the rearranged pixels or the error
+def run_job(args):
+	job,output=args
+	work_dir=tempfile.mkdtemp(prefix="batch_morph_")
+	cwd=os.getcwd()
+	os.chdir(work_dir)
+	start=time.time()
+	try:
+		source_pixels=worker_state[job["source"]]
+		palette_pixels=worker_state[job["palette"]]
+		assert source_pixels.shape[0]*source_pixels.shape[1]==palette_pixels.shape[0]*palette_pixels.shape[1], "source and palette must have the same number of pixels"
+
+		new_palette_order=solvers[job["solver"]](source_pixels,palette_pixels,job.get("params",{}))
+		new_palette_pixels=palette_pixels.reshape(-1,3)[new_palette_order].reshape(source_pixels.shape)
+		return job,output,new_palette_pixels,None,time.time()-start
+	except Exception as e:
+		return job,output,None,repr(e),time.time()-start
+	finally:
+		os.chdir(cwd)
+		shutil.rmtree(work_dir)
+
+#runs the jobs in a pool of n_workers processes and writes each result as soon as it arrives
+#the PNG encoding happens in a writer thread, so the parent keeps collecting results while the previous ones are saved
+#returns one record per job with its output, time and error (if any)
+def batch(jobs,n_workers=None,output_dir="."):
+	if n_workers is None:
+		n_workers=cpu_count()
+	if not os.path.exists(output_dir):
+		os.makedirs(output_dir)
+
+	start=time.time()
+	cache=build_cache(jobs)
+	print "decoded %d images for %d jobs in %.2fs" % (len(cache),len(jobs),time.time()-start)
+
+	writer=start_writer()
+	records=[]
+	pool=Pool(n_workers,init_batch_worker,(cache,))
+	try:
+		for job,output,new_palette_pixels,error,seconds in pool.imap_unordered(run_job,[(job,output_path(job,output_dir)) for job in jobs]):
+			if error is None:
+				writer["queue"].put((new_palette_pixels,output))
+				print "%s <- %s (%s) done in %.2fs" % (job["source"],job["palette"],job["solver"],seconds)
+			else:
+				print "%s <- %s (%s) failed: %s" % (job["source"],job["palette"],job["solver"],error)
+			records.append({"source":job["source"],"palette":job["palette"],"solver":job["solver"],"output":output,
+				"seconds":round(seconds,3),"error":error})
+	finally:
+		pool.close()
+		pool.join()
+		stop_writer(writer)
+
+	print "%d jobs in %.2fs, %d failed" % (len(jobs),time.time()-start,sum(record["error"] is not None for record in records))
+	return records
+
+#starts the thread that saves the results, the queue is bounded so that at most a few results wait in memory
+def start_writer(max_pending=8):
+	writer={"queue":Queue(max_pending),"written":0}
+	writer["thread"]=threading.Thread(target=writer_loop,args=(writer,))
+	writer["thread"].daemon=True
+	writer["thread"].start()
+	return writer
+
+#saves the queued images until stop_writer sends None
+def writer_loop(writer):
+	while True:
+		item=writer["queue"].get()
+		if item is None:
+			break
+		pixels,output=item
+		Image.fromarray(pixels,"RGB").save(output)
+		writer["written"]+=1
+
+#waits for the queued images to be written
+def stop_writer(writer):
+	writer["queue"].put(None)
+	writer["thread"].join()
+
+#image from a (rows,columns,3) array, for the solvers that work on PIL images
+def to_image(pixels):
+	return Image.fromarray(np.ascontiguousarray(pixels),"RGB")
+
+#palette indices of a permutation given as pixels, repeated colours are assigned to their positions in order
+def pixels_to_order(palette_pixels,new_palette_pixels):
+	palette_keys=palette_pixels.astype(np.int64).dot([65536,256,1])
+	new_keys=new_palette_pixels.astype(np.int64).dot([65536,256,1])
+	palette_sorted=np.argsort(palette_keys,kind="mergesort")
+	new_sorted=np.argsort(new_keys,kind="mergesort")
+
+	new_palette_order=np.empty(len(palette_pixels),dtype=np.int64)
+	new_palette_order[new_sorted]=palette_sorted
+	return new_palette_order
+
+if __name__ == '__main__':
+	sources=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
+	palettes=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
+
+	#batch parameters
+	manifest=None		#JSON lines file of jobs, None runs every pair of the cross product with the solver below
+	solver="pyramid"
+	params={}
+	n_workers=None		#one process per core
+	output_dir="batch"
+
+	if manifest is not None:
+		jobs=read_manifest(manifest)
+	else:
+		#only pairs with the same number of pixels can be morphed
+		sizes=dict((path,Image.open(path).size) for path in set(sources+palettes))
+		jobs=[job for job in cross_product_jobs(sources,palettes,solver,params)
+			if sizes[job["source"]][0]*sizes[job["source"]][1]==sizes[job["palette"]][0]*sizes[job["palette"]][1]]
+
+	records=batch(jobs,n_workers,output_dir)
+	with open(os.path.join(output_dir,"batch_results.jsonl"),"a") as f:
+		for record in records:
+			f.write(json.dumps(record)+"\n")
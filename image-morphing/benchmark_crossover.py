@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Crossover benchmark - fitness reached per CPU-second by each permutation crossover of the genetic algorithm
+"""
+
+import time
+import numpy as np
+from PIL import Image
+from source_palette_ea import crossovers,ea_generation,image_to_array,sort_population,swap_mutation,fitness_rgb_batch
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#runs the array engine with the given crossover until cpu_budget seconds of CPU time have been used
+#returns the (cpu seconds, best fitness) reached after each generation
+def run(source_pixels,palette_pixels,crossover,cpu_budget,size_pop,tournament_size,prob_cross,prob_mut,elite_size,seed):
+	rng=np.random.RandomState(seed)
+	start=time.clock()
+
+	population=np.array([rng.permutation(len(palette_pixels)) for j in xrange(size_pop)],dtype=np.int32)
+	fitnesses=fitness_rgb_batch(source_pixels,palette_pixels,population)
+	population,fitnesses=sort_population(population,fitnesses)
+
+	history=[(time.clock()-start,fitnesses[0])]
+	while history[-1][0]<cpu_budget:
+		population,fitnesses=ea_generation(source_pixels,palette_pixels,population,fitnesses,tournament_size,crossover,prob_cross,swap_mutation,prob_mut,fitness_rgb_batch,elite_size,rng)
+		history.append((time.clock()-start,fitnesses[0]))
+
+	return history
+
+#every crossover on every (source,palette) pair, with the same seed so they all start from the same population
+def benchmark(pairs,cpu_budget,size_pop,tournament_size,prob_cross,prob_mut,elite_size,seed):
+	results=[]
+	for source,palette in pairs:
+		source_pixels=image_to_array(Image.open(source))
+		palette_pixels=image_to_array(Image.open(palette))
+
+		print "\n"+source+" <- "+palette
+		for name in sorted(crossovers):
+			history=run(source_pixels,palette_pixels,crossovers[name],cpu_budget,size_pop,tournament_size,prob_cross,prob_mut,elite_size,seed)
+			cpu_seconds=history[-1][0]
+			improvement=(history[0][1]-history[-1][1])/cpu_seconds
+
+			print "%-14s generations: %5d   best fitness: %14.0f   improvement per cpu-second: %12.0f" % (name,len(history)-1,history[-1][1],improvement)
+			results.append({"source":source,"palette":palette,"crossover":name,"generations":len(history)-1,
+				"cpu_seconds":cpu_seconds,"best_fitness":history[-1][1],"improvement_per_cpu_second":improvement})
+
+	return results
+
+if __name__ == '__main__':
+	pairs=[("images/american_gothic_small.png","images/mona_lisa_small.png"),("images/mona_lisa_small.png","images/american_gothic_small.png")]
+
+	#algorithm parameters
+	cpu_budget=60.0		#CPU seconds per crossover and pair
+	size_pop=100
+	tournament_size=3
+	prob_cross=0.9
+	prob_mut=0.0005
+	elite_size=0.05
+	seed=0
+
+	benchmark(pairs,cpu_budget,size_pop,tournament_size,prob_cross,prob_mut,elite_size,seed)
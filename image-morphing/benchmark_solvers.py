@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Solver benchmark - fitness over time, peak memory and throughput of every morphing solver on synthetic images
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+from Queue import Empty
+from multiprocessing import Process,Queue
+import numpy as np
+from scipy.spatial import cKDTree
+from PIL import Image
+import source_palette as hybrid_palette
+import source_palette_bf
+import source_palette_ea
+import source_palette_ils
+import source_palette_sa
+import source_palette_sort
+import hungarian_palette
+import histogram_palette
+import pyramid_palette
+import sliced_palette
+from kernels import pixel_errors,report_backend
+from progress import make_progress
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#synthetic images, the same (kind,size,seed) always gives the same image
+#gradient: linear ramps between random colours, noise: uniform random pixels, flat: a few regions of constant colour,
+#photo: 1/f noise with correlated channels, which has the spectrum and the colour statistics of natural images
+def synthetic_image(kind,size,seed):
+	rng=np.random.RandomState(seed)
+	ys,xs=np.mgrid[0:size,0:size]/float(size)
+
+	if kind=="gradient":
+		corners=rng.randint(0,256,(3,3))
+		pixels=corners[0]+(corners[1]-corners[0])*xs[...,np.newaxis]+(corners[2]-corners[0])*ys[...,np.newaxis]
+	elif kind=="noise":
+		pixels=rng.randint(0,256,(size,size,3))
+	elif kind=="flat":
+		centres=rng.rand(16,2)
+		colors=rng.randint(0,256,(16,3))
+		_,labels=cKDTree(centres).query(np.column_stack((ys.ravel(),xs.ravel())))
+		pixels=colors[labels].reshape(size,size,3)
+	elif kind=="photo":
+		frequencies=np.sqrt(np.fft.fftfreq(size)[:,np.newaxis]**2+np.fft.fftfreq(size)[np.newaxis,:]**2)
+		frequencies[0,0]=1.0
+		channels=[np.real(np.fft.ifft2(np.fft.fft2(rng.randn(size,size))/frequencies)) for k in xrange(3)]
+		channels=np.dstack([(c-c.mean())/c.std() for c in channels])
+		mixing=np.eye(3)+0.6*rng.rand(3,3)
+		pixels=128+40*channels.dot(mixing.T)+4*rng.randn(size,size,3)
+	else:
+		raise ValueError("unknown image kind: "+kind)
+
+	return Image.fromarray(np.clip(np.rint(pixels),0,255).astype(np.uint8),"RGB")
+
+#sum of the squared RGB differences, the same measure for every solver whatever it optimizes internally
+def fitness(source_im,new_palette_pixels):
+	return int(pixel_errors(np.asarray(source_im.convert("RGB")),np.asarray(new_palette_pixels).reshape(-1,3)).sum())
+
+#pixels of an image written by a solver
+def read_pixels(filename):
+	return np.asarray(Image.open(filename).convert("RGB")).reshape(-1,3)
+
+#each runner solves one morph and returns the rearranged palette pixels, iterative solvers stop after budget seconds
+def run_bf(source_im,palette_im,budget,progress):
+	source_palette_bf.search_index(source_im,palette_im,source_palette_bf.colordiff_rgb,"bf.png",progress)
+	return read_pixels("bf.png")
+
+def run_sort(source_im,palette_im,budget,progress):
+	source_palette_sort.search(source_im,palette_im,"sort.png")
+	return read_pixels("sort.png")
+
+def run_rank(source_im,palette_im,budget,progress):
+	order=source_palette_sort.search_rank(source_im,palette_im,source_palette_sort.hilbert_key,"rank.png")
+	return np.asarray(palette_im.convert("RGB")).reshape(-1,3)[order]
+
+def run_ils(source_im,palette_im,budget,progress):
+	best=source_palette_ils.ils(source_im,palette_im,None,1000,deadline=budget,progress=progress)
+	return np.array(best[0])[:,:3]
+
+def run_ea(source_im,palette_im,budget,progress):
+	population,fitnesses=source_palette_ea.ea_array(source_im,palette_im,None,20,3,source_palette_ea.crossovers["uniform_order"],0.9,
+		source_palette_ea.swap_mutation,0.0005,source_palette_ea.fitness_rgb_batch,0.05,seed=0,deadline=budget,progress=progress)
+	return source_palette_ea.image_to_array(palette_im)[population[0]]
+
+def run_sa(source_im,palette_im,budget,progress):
+	order,best_fitness=source_palette_sa.sa(source_im,palette_im,None,4096,seed=0,deadline=budget,progress=progress)
+	return source_palette_ea.image_to_array(palette_im)[order]
+
+def run_hybrid(source_im,palette_im,budget,progress):
+	#the greedy phase reports the pixels placed
+	progress["total"]=source_im.size[0]*source_im.size[1]
+	best=hybrid_palette.search(source_im,palette_im,hybrid_palette.colordiff_rgb,0,1.1,1,progress,deadline=budget)
+	return np.array(best[0])[:,:3]
+
+def run_hungarian(source_im,palette_im,budget,progress):
+	palette_im=hungarian_palette.generate_palette(source_im,palette_im)
+	cost_matrix=hungarian_palette.generate_cost_matrix_np(source_im,palette_im)
+	columns=[column for row,column in sorted(hungarian_palette.solve_assignment(cost_matrix))]
+	return hungarian_palette.image_to_array(palette_im)[columns]
+
+def run_tiled(source_im,palette_im,budget,progress):
+	palette_im=hungarian_palette.generate_palette(source_im,palette_im)
+	order=hungarian_palette.tiled_assignment(source_im,palette_im,32)
+	return hungarian_palette.image_to_array(palette_im)[order]
+
+def run_sparse(source_im,palette_im,budget,progress):
+	palette_im=hungarian_palette.generate_palette(source_im,palette_im)
+	palette_pixels=hungarian_palette.image_to_array(palette_im)
+	initial_order=sliced_palette.sliced_order(hungarian_palette.image_to_array(source_im),palette_pixels,seed=0)
+	order=hungarian_palette.sparse_assignment(source_im,palette_im,8,initial_order=initial_order)
+	return palette_pixels[order]
+
+def run_histogram(source_im,palette_im,budget,progress):
+	histogram_palette.search(source_im,palette_im,4,"histogram.png")
+	return read_pixels("histogram.png")
+
+def run_pyramid(source_im,palette_im,budget,progress):
+	pyramid_palette.search(source_im,palette_im,1024,8,"pyramid.png")
+	return read_pixels("pyramid.png")
+
+def run_sliced(source_im,palette_im,budget,progress):
+	#the transport reports the directions done
+	progress["total"]=256
+	sliced_palette.search(source_im,palette_im,256,0.1,False,"sliced.png",seed=0,progress=progress)
+	return read_pixels("sliced.png")
+
+#name -> (runner, largest number of pixels it is run on), the one-shot solvers ignore the time budget so the slow
+#ones are only run on the sizes they finish in reasonable time (or fit in memory, for the full hungarian cost matrix)
+solvers={"bf":(run_bf,1024*1024),"sort":(run_sort,2048*2048),"rank":(run_rank,2048*2048),"ils":(run_ils,512*512),
+	"ea":(run_ea,1024*1024),"sa":(run_sa,2048*2048),"hybrid":(run_hybrid,32*32),"hungarian":(run_hungarian,64*64),"tiled":(run_tiled,512*512),"sparse":(run_sparse,256*256),
+	"histogram":(run_histogram,2048*2048),"pyramid":(run_pyramid,2048*2048),"sliced":(run_sliced,2048*2048)}
+
+#runs one solver in its own process, so that its peak memory is measured alone and a crash does not stop the benchmark
+#the process works in a temporary directory, where the solvers write their images
+def measure(name,source_im,palette_im,budget,results):
+	work_dir=tempfile.mkdtemp(prefix="benchmark_")
+	os.chdir(work_dir)
+	random.seed(0)
+	baseline=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	progress=make_progress(name,interval=max(0.5,budget/100.0))
+
+	start=time.time()
+	try:
+		new_palette_pixels=solvers[name][0](source_im,palette_im,budget,progress)
+	except Exception as e:
+		results.put({"solver":name,"error":repr(e)})
+		return
+	finally:
+		shutil.rmtree(work_dir)
+	seconds=time.time()-start
+
+	final_fitness=fitness(source_im,new_palette_pixels)
+	n_pixels=source_im.size[0]*source_im.size[1]
+	results.put({"solver":name,"seconds":round(seconds,3),"fitness":final_fitness,"kernels":report_backend(),
+		"history":progress["history"]+[(round(seconds,3),final_fitness)],
+		"evaluations":progress["evaluations"],"evaluations_per_second":round(progress["evaluations"]/seconds,1),
+		"pixels_per_second":round(n_pixels/seconds,1),
+		#ru_maxrss is in kilobytes on linux
+		"peak_memory_mb":round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0,1),
+		"baseline_memory_mb":round(baseline/1024.0,1)})
+
+#result of a measure process, or an error record if the process died without sending one (killed, out of memory)
+def wait_result(name,process,results):
+	while True:
+		try:
+			return results.get(timeout=1)
+		except Empty:
+			if not process.is_alive() and results.empty():
+				return {"solver":name,"error":"process exited with code "+str(process.exitcode)}
+
+#every solver on every (source kind, palette kind) pair and size, one JSON line per run appended to results_path
+def benchmark(names,pairs,sizes,budget,seed,results_path):
+	records=[]
+	for source_kind,palette_kind in pairs:
+		for size in sizes:
+			source_im=synthetic_image(source_kind,size,seed)
+			palette_im=synthetic_image(palette_kind,size,seed+1)
+
+			for name in names:
+				if size*size>solvers[name][1]:
+					continue
+
+				#the images are inherited by the forked process, nothing is pickled
+				results=Queue()
+				process=Process(target=measure,args=(name,source_im,palette_im,budget,results))
+				process.start()
+				record=wait_result(name,process,results)
+				process.join()
+
+				record.update({"source":source_kind,"palette":palette_kind,"size":size,"seed":seed,"budget":budget})
+				records.append(record)
+				with open(results_path,"a") as f:
+					f.write(json.dumps(record)+"\n")
+
+				if "error" in record:
+					print "%-10s %-9s <- %-9s %5d  failed: %s" % (name,source_kind,palette_kind,size,record["error"])
+				else:
+					print "%-10s %-9s <- %-9s %5d  %8.2fs  fitness %15d  peak memory %8.1fMB" % (name,source_kind,palette_kind,size,record["seconds"],record["fitness"],record["peak_memory_mb"])
+
+	return records
+
+if __name__ == '__main__':
+	names=["bf","sort","rank","ils","ea","sa","hybrid","hungarian","tiled","histogram","pyramid","sliced","sparse"]
+	#(source kind, palette kind), a flat palette has only a few distinct colours repeated over every pixel
+	pairs=[("photo","photo"),("gradient","noise"),("flat","photo"),("photo","flat"),("noise","gradient")]
+	sizes=[32,64,128,256,512,1024,2048]
+
+	#benchmark parameters
+	budget=30.0		#seconds for the iterative solvers (ils, ea, sa, hybrid)
+	seed=0
+	results_path="benchmark_results.jsonl"
+
+	report_backend()
+	benchmark(names,pairs,sizes,budget,seed,os.path.abspath(results_path))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoints - saving and resuming long morph and mosaic searches
+"""
+
+import os
+import time
+import shutil
+import pickle
+import numpy as np
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#a checkpoint is a directory with one .npy file per array (permutations, populations, ...) and a pickled dict with
+#the small state (fitness, counters, random generator state)
+#the checkpointer is a dict with the directory, the interval in seconds between checkpoints and the last one written
+def make_checkpointer(path,interval):
+	if path is None:
+		return None
+	return {"path":path,"interval":interval,"last":time.time()}
+
+#True when the last checkpoint is older than the interval
+def checkpoint_due(checkpointer):
+	return checkpointer is not None and time.time()-checkpointer["last"]>=checkpointer["interval"]
+
+#writes the checkpoint to a temporary directory and swaps it with the previous one, a run killed at any point leaves
+#either the previous or the new checkpoint on disk, never a mix of both
+def save_checkpoint(checkpointer,arrays,state):
+	path=checkpointer["path"]
+	tmp_path=path+".tmp"
+	old_path=path+".old"
+
+	if os.path.exists(tmp_path):
+		shutil.rmtree(tmp_path)
+	os.makedirs(tmp_path)
+
+	for name,array in arrays.iteritems():
+		with open(os.path.join(tmp_path,name+".npy"),"wb") as f:
+			np.save(f,np.asarray(array))
+			f.flush()
+			os.fsync(f.fileno())
+
+	with open(os.path.join(tmp_path,"state.pkl"),"wb") as f:
+		pickle.dump(state,f,pickle.HIGHEST_PROTOCOL)
+		f.flush()
+		os.fsync(f.fileno())
+
+	if os.path.exists(path):
+		os.rename(path,old_path)
+	os.rename(tmp_path,path)
+	if os.path.exists(old_path):
+		shutil.rmtree(old_path)
+
+	checkpointer["last"]=time.time()
+
+#returns (arrays,state) of the checkpoint in path, or None if there is none
+#the arrays are memory-mapped copy-on-write, so nothing is read until the search touches them and writing to them
+#never modifies the checkpoint
+def load_checkpoint(path):
+	if path is None:
+		return None
+	if not os.path.exists(path):
+		#killed between the two renames of save_checkpoint
+		if not os.path.exists(path+".old"):
+			return None
+		path=path+".old"
+
+	arrays={}
+	for filename in os.listdir(path):
+		if filename.endswith(".npy"):
+			arrays[filename[:-4]]=np.load(os.path.join(path,filename),mmap_mode="c")
+
+	with open(os.path.join(path,"state.pkl"),"rb") as f:
+		state=pickle.load(f)
+
+	return arrays,state
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Nearest colour index with deletion - k-d tree over the palette colours for greedy matching
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#builds the index over an (n,3) array of colours (RGB, L*ab, ...)
+#the k-d tree is built over the distinct colours only, a colour shared by many pixels is a single point with a count
+#of the pixels still available: k-d trees slow down badly on repeated points, and flat images repeat a few colours
+#the k-d tree is never modified, a colour is flagged as taken when its last pixel is, and skipped by the queries
+#the index is a dict so that it can be passed around and updated like the rest of the search state
+def build_color_index(colors):
+	colors=np.ascontiguousarray(colors,dtype=np.float64)
+	keys=colors.view([("",colors.dtype)]*3).ravel()
+	_,first,labels,counts=np.unique(keys,return_index=True,return_inverse=True,return_counts=True)
+	distinct=colors[first]
+	#the pixels of each colour, in increasing order, and the next one to hand out
+	members=np.argsort(labels,kind="mergesort")
+	starts=np.concatenate(([0],np.cumsum(counts)[:-1]))
+	return {"colors":distinct,"tree":cKDTree(distinct),"alive":bytearray([1])*len(distinct),"size":len(distinct),
+		"counts":counts.tolist(),"members":members.tolist(),"next":starts.tolist(),
+		"remaining":None,"remaining_tree":None,"remaining_dead":0}
+
+#takes one pixel of the colour with the given index, the colour is flagged as taken with its last pixel
+#returns the index of the pixel in the colours the index was built from
+def index_take(index,i):
+	pixel=index["members"][index["next"][i]]
+	index["next"][i]+=1
+	index["counts"][i]-=1
+	if index["counts"][i]==0:
+		index_remove(index,i)
+	return pixel
+
+#flags the colour with the given index as taken
+def index_remove(index,i):
+	index["alive"][i]=0
+	index["size"]-=1
+	index["remaining_dead"]+=1
+
+#first colour still available in a list of candidates sorted by distance, None if they have all been taken
+def first_alive(index,candidates):
+	alive=index["alive"]
+	for i in candidates:
+		if alive[i]:
+			return i
+	return None
+
+#index of the remaining colour closest to the given colour, None if the index is empty
+#the k nearest colours of the full tree are tried first, when they have all been taken the search moves to the tree
+#built over the remaining colours only
+def index_nearest(index,color,k=16):
+	if index["size"]==0:
+		return None
+
+	_,candidates=index["tree"].query(color,min(k,len(index["colors"])))
+	i=first_alive(index,np.atleast_1d(candidates).tolist())
+	if i is not None:
+		return i
+
+	return remaining_nearest(index,color)
+
+#nearest remaining colour using the tree built over the remaining colours
+#at most "remaining_dead" of its colours have been taken since it was built, so asking for one more neighbour
+#always finds an available colour; the tree is rebuilt when that number grows past ~sqrt(n), which balances
+#the cost of the rebuilds against the length of the queries
+def remaining_nearest(index,color):
+	remaining=index["remaining"]
+	if remaining is None or index["remaining_dead"]>2*int(len(remaining)**0.5):
+		remaining=index["remaining"]=np.flatnonzero(np.frombuffer(bytes(index["alive"]),dtype=np.uint8))
+		index["remaining_tree"]=cKDTree(index["colors"][remaining])
+		index["remaining_dead"]=0
+
+	k=min(index["remaining_dead"]+1,len(remaining))
+	_,candidates=index["remaining_tree"].query(color,k)
+	return first_alive(index,remaining[np.atleast_1d(candidates)].tolist())
+
+#greedy matching: each source colour, in order, takes the closest palette colour that has not been taken yet
+#the k nearest candidates of a whole chunk of source colours are queried at once, so python only walks short lists
+#returns the palette index matched to each source colour
+def greedy_match(source_colors,palette_colors,k=16,chunk_size=65536,progress=None):
+	source_colors=np.asarray(source_colors,dtype=np.float64)
+	index=build_color_index(palette_colors)
+	k=min(k,len(index["colors"]))
+
+	order=[]
+	for start in xrange(0,len(source_colors),chunk_size):
+		if progress is not None:
+			progress(start,len(source_colors))
+
+		chunk=source_colors[start:start+chunk_size]
+		_,candidates=index["tree"].query(chunk,k)
+		candidates=candidates.reshape(len(chunk),k).tolist()
+
+		for offset in xrange(len(chunk)):
+			i=first_alive(index,candidates[offset])
+			if i is None:
+				i=remaining_nearest(index,chunk[offset])
+			order.append(index_take(index,i))
+
+	return order
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Incremental fitness evaluation of swap moves - shared by the local searches of the morphing scripts
+"""
+
+import random
+from itertools import izip
+import numpy as np
+from scipy.spatial import cKDTree
+from permutation import state_swap
+from kernels import colordiff_rgb
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#the palette is an immutable list of pixels and the solution an order over it (see permutation.make_state), the pixel
+#at position i is palette[order[i]]
+
+#squared RGB error of each position between the source and the current order of the palette
+#the fitness of the order is the sum of this list
+def pixel_errors(source_pixels,palette,order):
+	return [colordiff_rgb(source_pixel,palette[index]) for source_pixel,index in izip(source_pixels,order)]
+
+#picks two different random positions to swap
+def random_swap(size):
+	pos1=random.randint(0,size-1)
+	pos2=pos1
+
+	while pos1==pos2:
+		pos2=random.randint(0,size-1)
+
+	return pos1,pos2
+
+#change in fitness if the pixels at positions i and j were swapped, only the two affected terms are recomputed
+#nothing is modified, so a rejected move costs no rollback
+def swap_delta(source_pixels,palette,order,errors,i,j):
+	new_error_i=colordiff_rgb(source_pixels[i],palette[order[j]])
+	new_error_j=colordiff_rgb(source_pixels[j],palette[order[i]])
+	return new_error_i+new_error_j-errors[i]-errors[j]
+
+#swaps the pixels at positions i and j of the state in place and updates their errors and the fitness
+def apply_swap(source_pixels,palette,state,errors,i,j,delta):
+	order=state["order"]
+	state_swap(state,i,j)
+	state["fitness"]+=delta
+	errors[i]=colordiff_rgb(source_pixels[i],palette[order[i]])
+	errors[j]=colordiff_rgb(source_pixels[j],palette[order[j]])
+
+#index of the palette colours for the guided moves: the n_candidates distinct palette colours nearest to each source
+#pixel, found once with a kd-tree, and for each colour the positions that currently hold it (slots) with the place of
+#each position in its colour's list (slot_of)
+#the colours never change, only their positions, so apply_guided_swap keeps the index valid in O(1) per swap
+#after a rollback the positions are rebuilt with colour_slots, the colours and their neighbours do not change
+def make_colour_index(source_pixels,palette,order,n_candidates=8):
+	index=colour_slots(palette,order)
+	colours=index["slots"].keys()
+	n_candidates=min(n_candidates,len(colours))
+	_,nearest=cKDTree(colours).query(np.array(source_pixels),n_candidates)
+	index.update({"colours":colours,"nearest":nearest.reshape(len(source_pixels),n_candidates)})
+	return index
+
+#positions holding each colour and place of each position in its colour's list
+def colour_slots(palette,order):
+	slots={}
+	slot_of=[0]*len(order)
+	for position,index in enumerate(order):
+		positions=slots.setdefault(palette[index],[])
+		slot_of[position]=len(positions)
+		positions.append(position)
+	return {"slots":slots,"slot_of":slot_of}
+
+#guided move: the worst fitted of n_worst random positions i and a position j holding one of the palette colours
+#nearest to the source colour at i, so the swap fixes i and only has to not break j too much to be accepted
+#returns i, j and the delta of their swap
+def guided_swap(source_pixels,palette,order,errors,index,n_worst=2):
+	size=len(order)
+	i=max([int(random.random()*size) for k in xrange(n_worst)],key=errors.__getitem__)
+
+	nearest=index["nearest"]
+	colour=index["colours"][nearest[i,int(random.random()*nearest.shape[1])]]
+	j=random.choice(index["slots"][colour])
+	return i,j,swap_delta(source_pixels,palette,order,errors,i,j)
+
+#apply_swap for a palette with a colour index, the positions of the two colours are updated too
+def apply_guided_swap(source_pixels,palette,state,errors,index,i,j,delta):
+	order=state["order"]
+	slots=index["slots"]
+	slot_of=index["slot_of"]
+	slots[palette[order[i]]][slot_of[i]]=j
+	slots[palette[order[j]]][slot_of[j]]=i
+	slot_of[i],slot_of[j]=slot_of[j],slot_of[i]
+	apply_swap(source_pixels,palette,state,errors,i,j,delta)
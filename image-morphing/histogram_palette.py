@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Colour histogram transportation - Morphing an image into another with the same color palette - Just for fun
+"""
+
+import time
+import numpy as np
+from PIL import Image
+from kernels import pixel_errors
+from utils import check
+
+#POT provides the compiled network simplex that solves the transportation problem, see solve_transport
+try:
+	import ot
+except ImportError:
+	ot=None
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#solves the morph as a transportation problem between the colour histograms of both images
+#instead of one item per pixel, the problem size is the number of occupied colour bins
+def search(source_im,palette_im,bits,new_filename):
+
+	source_pixels=image_to_array(source_im)
+	palette_pixels=image_to_array(palette_im)
+	assert len(source_pixels)==len(palette_pixels), "source and palette must have the same number of pixels"
+
+	start=time.time()
+	source_labels,source_counts,source_colors=quantize(source_pixels,bits)
+	palette_labels,palette_counts,palette_colors=quantize(palette_pixels,bits)
+	print "%d source bins, %d palette bins built in %.2fs" % (len(source_counts),len(palette_counts),time.time()-start)
+
+	start=time.time()
+	flow=solve_transport(source_counts,palette_counts,source_colors,palette_colors)
+	print "transportation problem solved in %.2fs" % (time.time()-start)
+
+	start=time.time()
+	new_palette_order=expand_flows(source_pixels,source_labels,palette_pixels,palette_labels,palette_colors,flow)
+	print "pixel permutation built in %.2fs" % (time.time()-start)
+
+	print "Fitness achieved: "+str(fitness(source_pixels,palette_pixels[new_palette_order]))
+	build_final_solution(source_im,palette_im,new_palette_order,new_filename)
+
+#returns the pixels of an image as a (n,3) int32 array
+def image_to_array(im):
+	return np.asarray(im.convert("RGB"),dtype=np.int32).reshape(-1,3)
+
+#groups pixels into colour bins keeping the "bits" most significant bits of each channel (8 deduplicates exact colours)
+#returns the bin of each pixel, the number of pixels in each bin and the mean colour of each bin
+def quantize(pixels,bits):
+	shift=8-bits
+	codes=((pixels[:,0]>>shift)<<(2*bits))|((pixels[:,1]>>shift)<<bits)|(pixels[:,2]>>shift)
+	_,labels,counts=np.unique(codes,return_inverse=True,return_counts=True)
+
+	colors=np.empty((len(counts),3))
+	for channel in xrange(3):
+		colors[:,channel]=np.bincount(labels,weights=pixels[:,channel],minlength=len(counts))/counts
+
+	return labels,counts,colors
+
+#squared RGB distance between the mean colours of every pair of bins, rounded so the flow stays integral
+def bin_cost_matrix(source_colors,palette_colors):
+	cost_matrix=np.zeros((len(source_colors),len(palette_colors)))
+	for channel in xrange(3):
+		delta=source_colors[:,channel,np.newaxis]-palette_colors[np.newaxis,:,channel]
+		cost_matrix+=delta*delta
+
+	return np.rint(cost_matrix)
+
+#min-cost flow between the two histograms, returned as (source bins, palette bins, amounts): amounts[t] pixels move
+#from source bin source_bins[t] to palette bin palette_bins[t], sorted by source bin then palette bin
+#POT solves the problem over the dense cost matrix, which has one cell per pair of bins: above dense_size cells it would
+#not fit in memory, so fewer bits per channel must be used (4 bits give at most 4096 bins per image)
+def solve_transport(source_counts,palette_counts,source_colors,palette_colors,dense_size=1<<24):
+	if ot is None:
+		raise ImportError("the transportation problem needs POT, install it with pip install pot")
+	if len(source_counts)*len(palette_counts)>dense_size:
+		raise ValueError("%d source bins x %d palette bins is above %d cells, use fewer bits per channel" % (len(source_counts),len(palette_counts),dense_size))
+
+	cost_matrix=bin_cost_matrix(source_colors,palette_colors)
+	flow=np.rint(ot.emd(source_counts.astype(np.float64),palette_counts.astype(np.float64),cost_matrix,numItermax=10**8)).astype(np.int64)
+	#network simplex vertices are integral, so the rounded flow keeps the marginals unless the solver stopped early
+	if not ((flow.sum(1)==source_counts).all() and (flow.sum(0)==palette_counts).all()):
+		raise RuntimeError("the transportation flow does not match the histograms")
+
+	source_bins,palette_bins=np.nonzero(flow)
+	return source_bins,palette_bins,flow[source_bins,palette_bins]
+
+#expands the bin to bin flows back into a pixel permutation
+#inside each bin pixels are visited by luminance, so darker source pixels receive darker palette bins and pixels
+def expand_flows(source_pixels,source_labels,palette_pixels,palette_labels,palette_colors,flow):
+	source_order=np.lexsort((luminance(source_pixels),source_labels))
+	palette_order=np.lexsort((luminance(palette_pixels),palette_labels))
+
+	#first position of each palette bin inside palette_order
+	palette_cursor=np.concatenate(([0],np.cumsum(np.bincount(palette_labels))[:-1]))
+
+	source_bins,palette_bins,amounts=flow
+	transfers=np.lexsort((luminance(palette_colors)[palette_bins],source_bins))
+
+	#source_order already lists the source bins in increasing order, so only the palette side needs to be gathered
+	new_palette_order=np.empty(len(source_pixels),dtype=np.int64)
+	received=[]
+	for t in transfers:
+		j=palette_bins[t]
+		amount=amounts[t]
+		received.append(palette_order[palette_cursor[j]:palette_cursor[j]+amount])
+		palette_cursor[j]+=amount
+
+	new_palette_order[source_order]=np.concatenate(received)
+	return new_palette_order
+
+#perceived luminance of each pixel (ITU-R 601), used to order pixels inside a bin
+def luminance(pixels):
+	return 299*pixels[:,0]+587*pixels[:,1]+114*pixels[:,2]
+
+#sum of the squared RGB differences between the source and the rearranged palette
+def fitness(source_pixels,new_palette_pixels):
+	return int(pixel_errors(source_pixels,new_palette_pixels).sum())
+
+#generates the new palette with the same dimensions as the source but with its own colours
+#new_palette_order[i] is the index of the palette pixel placed at the ith position
+def build_final_solution(source_im,palette_im,new_palette_order,new_filename):
+
+	palette_columns=source_im.size[0]
+	palette_rows=source_im.size[1]
+	palette_pixels=np.asarray(palette_im.convert("RGB")).reshape(-1,3)
+
+	new_palette_pixels=palette_pixels[new_palette_order].reshape(palette_rows,palette_columns,3)
+
+	new_palette=Image.fromarray(new_palette_pixels,"RGB")
+	new_palette.save(new_filename)
+
+if __name__ == '__main__':
+	sources=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
+	palettes=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
+	source=sources[0]
+	palette=palettes[2]
+
+	#algorithm parameters
+	source_im=Image.open(source)
+	palette_im=Image.open(palette)
+	bits=4			#bits kept per channel, 8 uses the exact distinct colours
+	new_filename=palette.split(".")[0]+"_rearranged.png"
+
+	search(source_im,palette_im,bits,new_filename)
+	check(palette,new_filename)
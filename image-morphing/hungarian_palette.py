@@ -5,12 +5,29 @@
 Hungarian algorithm - Solving an assignment problem - Morphing an image into another with the same color palette - Just for fun
 """
 
+import time
+import ctypes
 from copy import deepcopy
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
 from PIL import Image
-from colormath.color_diff import delta_e_cie1976
-from colormath.color_conversions import convert_color
-from colormath.color_objects import LabColor,sRGBColor
+from lab_lut import colordiff_lab,rgb_to_lab
 from munkres import Munkres,print_matrix
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+from color_index import greedy_match
+from kernels import colordiff_rgb,pairwise_distances,report_backend
+from source_palette_sort import rank_order,hilbert_key
+from progress import make_progress,progress_update,progress_phase,progress_finish
+
+#lap provides a compiled Jonker-Volgenant solver, much faster than scipy's hungarian implementation
+#lapmod is its sparse version, used on the candidate graphs of sparse_assignment
+try:
+	from lap import lapjv,lapmod
+except ImportError:
+	lapjv=None
+	lapmod=None
 
 __author__ = 'Alexandre Pinto'
 __email__ = "alexandpinto@gmail.com"
@@ -30,49 +47,317 @@ def generate_palette(source_im,palette_im):
 
 	return new_palette
 
-#calculate color difference of two pixels in the RGB space
-#the less the better
-def colordiff_rgb(source_pixel,palette_pixel):
+#compute the cost matrix required for hungarian algorithm
+#each cell represents the cost of placing the jth palette pixel in the ith position, like generate_cost_matrix_np
+def generate_cost_matrix(source_im,palette_im,progress=None):
+	source_pixels=list(source_im.getdata())
+	palette_pixels=list(palette_im.getdata())
+	dim=len(source_pixels)
+	if progress is None:
+		progress=make_progress("cost matrix",dim)
 
-	delta_red=source_pixel[0]-palette_pixel[0]
-	delta_green=source_pixel[1]-palette_pixel[1]
-	delta_blue=source_pixel[2]-palette_pixel[2]
+	#one list per row, [[0]*dim]*dim would make every row the same list
+	cost_matrix=[[0]*dim for i in xrange(dim)]
+	for i in xrange(dim):
+		progress_update(progress,done=i,evaluations=dim)
+		for j in xrange(dim):
+			cost_matrix[i][j]=colordiff_rgb(source_pixels[i],palette_pixels[j])
 
-	fit=delta_red**2+delta_green**2+delta_blue**2
-	return fit
+	return cost_matrix
 
-#http://python-colormath.readthedocs.org/en/latest/index.html
-#calculate color difference of two pixels in the L*ab space
-#the less the better
-#pros: better results, cons: very slow
-def colordiff_lab(source_pixel,palette_pixel):
+#returns the pixels of an image as a (n,3) int32 array
+def image_to_array(im):
+	return np.asarray(im.convert("RGB"),dtype=np.int32).reshape(-1,3)
 
-	#convert rgb values to L*ab values
-	rgb_pixel_source=sRGBColor(source_pixel[0],source_pixel[1],source_pixel[2],True)
-	lab_source= convert_color(rgb_pixel_source, LabColor)
+#vectorized version of generate_cost_matrix, built with numpy broadcasting instead of python loops
+#each cell represents the cost of placing the jth palette pixel in the ith position (rows are source positions)
+#with lab=True the cost is the delta e in the L*ab space, read from the precomputed lookup table
+def generate_cost_matrix_np(source_im,palette_im,lab=False):
+	source_pixels=image_to_array(source_im)
+	palette_pixels=image_to_array(palette_im)
 
-	rgb_pixel_palette=sRGBColor(palette_pixels[0],palette_pixels[1],palette_pixels[2],True)
-	lab_palette= convert_color(rgb_pixel_palette, LabColor)
+	if lab:
+		source_pixels=rgb_to_lab(source_pixels)
+		palette_pixels=rgb_to_lab(palette_pixels)
 
-	#calculate delta e
-	delta_e = delta_e_cie1976(lab_source, lab_palette)
-	return delta_e
+	return pixel_cost_matrix(source_pixels,palette_pixels,lab)
 
-#compute the cost matrix required for hungarian algorithm
-#each cell represents the cost of placing the ith pixel in the jth position
-def generate_cost_matrix(source_im,palette_im):
-	source_pixels=list(source_im.getdata())
-	palette_pixels=list(palette_im.getdata())
-	dim=len(source_pixels)
+#cost matrix between two (n,3) arrays of colours, squared distances or distances (sqrt=True)
+def pixel_cost_matrix(source_pixels,palette_pixels,sqrt=False):
+	cost_matrix=pairwise_distances(source_pixels,palette_pixels)
 
-	cost_matrix=[[0]*dim]*dim
-	for i in xrange(dim):
-		print "%.2f " % (i/float(dim)*100)+"%"
-		for j in xrange(dim):
-			cost_matrix[i][j]=colordiff_rgb(source_pixels[j],palette_pixels[i])
+	if sqrt:
+		np.sqrt(cost_matrix,out=cost_matrix)
 
 	return cost_matrix
 
+#solves the assignment problem with Jonker-Volgenant (lap) when available, scipy otherwise
+#returns a list of (row,column) pairs just like Munkres.compute
+def solve_assignment(cost_matrix):
+	if lapjv is not None:
+		_,columns,_=lapjv(cost_matrix.astype(np.float64))
+		rows=np.arange(len(columns))
+	else:
+		rows,columns=linear_sum_assignment(cost_matrix)
+
+	return zip(rows.tolist(),columns.tolist())
+
+#matrix-free costs: the oracle only keeps the two (n,3) arrays of colours and computes the cost of any list of
+#(source position, palette pixel) pairs on demand, so a problem of n pixels takes O(n) memory instead of n x n
+#with lab=True the cost is the delta e in the L*ab space, like pixel_cost_matrix
+def make_cost_oracle(source_pixels,palette_pixels,lab=False):
+	source_pixels=np.asarray(source_pixels)
+	palette_pixels=np.asarray(palette_pixels)
+	if lab:
+		source_pixels=rgb_to_lab(source_pixels)
+		palette_pixels=rgb_to_lab(palette_pixels)
+	return {"source":source_pixels.astype(np.float64),"palette":palette_pixels.astype(np.float64),"sqrt":lab}
+
+#costs of placing the palette pixels columns[i] at the source positions rows[i]
+def oracle_costs(oracle,rows,columns):
+	delta=oracle["source"][rows]-oracle["palette"][columns]
+	costs=(delta*delta).sum(axis=1)
+	if oracle["sqrt"]:
+		np.sqrt(costs,out=costs)
+	return costs
+
+#for each query colour, k of the nearest distinct colours of colors and one pixel of each of them
+#the pixels of a colour are handed out in turn, so when a colour is shared by many pixels the edges to it are spread
+#over all of them instead of all going to the first one
+def nearest_candidates(queries,colors,k):
+	keys=np.ascontiguousarray(colors).view([("",colors.dtype)]*3).ravel()
+	_,first,labels,counts=np.unique(keys,return_index=True,return_inverse=True,return_counts=True)
+	members=np.argsort(labels,kind="mergesort")
+	starts=np.concatenate(([0],np.cumsum(counts)[:-1]))
+
+	k=min(k,len(first))
+	_,nearest=cKDTree(colors[first]).query(queries,k)
+	nearest=nearest.reshape(len(queries),k)
+	turns=np.arange(len(queries))[:,np.newaxis]
+	return members[starts[nearest]+turns%counts[nearest]]
+
+#sparse candidate graph of the assignment: each source position is linked to k of its nearest palette colours and
+#each palette pixel to k of its nearest source colours, plus the given (row,column) pairs (a full assignment makes
+#the graph always solvable), O(n k) edges
+#returns the graph in compressed rows like lapmod takes it: the costs, the start of each row and the columns, the
+#columns of each row being sorted
+def candidate_graph(oracle,k,extra_rows=(),extra_columns=()):
+	n=len(oracle["source"])
+	forward=nearest_candidates(oracle["source"],oracle["palette"],k)
+	backward=nearest_candidates(oracle["palette"],oracle["source"],k)
+
+	rows=np.concatenate((np.repeat(np.arange(n),forward.shape[1]),backward.ravel(),np.asarray(extra_rows,dtype=np.int64)))
+	columns=np.concatenate((forward.ravel(),np.repeat(np.arange(n),backward.shape[1]),np.asarray(extra_columns,dtype=np.int64)))
+	return compress_edges(oracle,rows,columns)
+
+#the graph of the (row,column) edges in compressed rows, duplicated edges are kept once
+def compress_edges(oracle,rows,columns):
+	n=len(oracle["source"])
+	edges=np.unique(rows.astype(np.int64)*n+columns)
+	rows=edges//n
+	columns=edges%n
+
+	row_starts=np.concatenate(([0],np.cumsum(np.bincount(rows,minlength=n))))
+	return oracle_costs(oracle,rows,columns),row_starts,columns
+
+#dual potentials of new_palette_order, an optimal assignment of graph: the shortest distances from a root linked to
+#every node of its residual graph (the edges from positions to palette pixels, and back from each palette pixel to its
+#position at the opposite cost), found by Bellman-Ford rounds over all the edges at once
+#every edge of the graph has a non-negative reduced cost cost + row potential - column potential
+def assignment_potentials(graph,new_palette_order):
+	costs,row_starts,columns=graph
+	n=len(row_starts)-1
+	rows=np.repeat(np.arange(n),np.diff(row_starts))
+	by_column=np.argsort(columns,kind="mergesort")
+	column_starts=np.searchsorted(columns[by_column],np.arange(n))
+	#edges are sorted by row then column, so the matched ones are found by binary search
+	matched_costs=costs[np.searchsorted(rows*n+columns,np.arange(n)*n+new_palette_order)]
+
+	row_potentials=np.zeros(n)
+	while True:
+		column_potentials=np.minimum(np.minimum.reduceat((row_potentials[rows]+costs)[by_column],column_starts),0)
+		#the palette pixel new_palette_order[i] leads back to position i
+		next_potentials=np.minimum(row_potentials,column_potentials[new_palette_order]-matched_costs)
+		if not (next_potentials<row_potentials-1e-9).any():
+			return row_potentials,column_potentials
+		row_potentials=next_potentials
+
+#edges out of graph that would lower the cost of the assignment: for each position, the palette pixels among its k
+#nearest in the colour space extended with a fourth coordinate sqrt(max column potential - column potential), where
+#the squared distance is the cost minus the column potential plus a constant, that have a negative reduced cost
+#for squared distances the nearest one has the lowest reduced cost of the row, so when no edge is returned the
+#assignment is optimal over all n x n pairs; with lab=True the costs are distances and this is only a good guess
+def priced_edges(oracle,graph,new_palette_order,k):
+	row_potentials,column_potentials=assignment_potentials(graph,new_palette_order)
+	n=len(row_potentials)
+	lift=np.sqrt(column_potentials.max()-column_potentials)
+	_,nearest=cKDTree(np.column_stack((oracle["palette"],lift))).query(np.column_stack((oracle["source"],np.zeros(n))),min(k,n))
+	nearest=nearest.reshape(n,-1)
+
+	rows=np.repeat(np.arange(n),nearest.shape[1])
+	columns=nearest.ravel()
+	reduced=oracle_costs(oracle,rows,columns)+row_potentials[rows]-column_potentials[columns]
+	violated=reduced<-1e-6
+	return rows[violated],columns[violated]
+
+#greedy matching over the edges of the graph, cheapest first, then a fallback pass for the positions whose candidates
+#were all taken: they get the remaining palette pixels by nearest colour (color_index.greedy_match)
+#returns new_palette_order, a full assignment
+def greedy_graph_assignment(oracle,graph):
+	costs,row_starts,columns=graph
+	n=len(row_starts)-1
+	rows=np.repeat(np.arange(n),np.diff(row_starts))
+
+	cheapest=np.argsort(costs,kind="mergesort")
+	new_palette_order=[-1]*n
+	taken=bytearray(n)
+	for row,column in zip(rows[cheapest].tolist(),columns[cheapest].tolist()):
+		if new_palette_order[row]<0 and not taken[column]:
+			new_palette_order[row]=column
+			taken[column]=1
+	new_palette_order=np.array(new_palette_order,dtype=np.int64)
+
+	unmatched=np.flatnonzero(new_palette_order<0)
+	if len(unmatched):
+		free=np.flatnonzero(np.frombuffer(bytes(taken),dtype=np.uint8)==0)
+		new_palette_order[unmatched]=free[greedy_match(oracle["source"][unmatched],oracle["palette"][free])]
+	return new_palette_order
+
+#assignment without any n x n matrix, for images far too large for lapjv
+#up to chunk_size pixels the whole image is solved at once; above, the positions are sorted by the hilbert index of
+#their source colour and cut in chunks of chunk_size positions of similar colours, and a second pass over chunks
+#shifted by half a chunk lets pixels cross the cuts of the first one, so the cost stays linear in the number of pixels
+#each chunk is re-solved by lapmod between its positions and the palette pixels they hold with up to max_rounds rounds
+#of pricing (see solve_chunk): the candidate graph alone leaves the result 15-45% above the optimum, pricing closes
+#the gap (optimal when it stops before max_rounds, squared RGB costs), each round costs one lapmod on a larger graph
+#the current assignment is part of every graph, so each chunk, and the result, is never worse than initial_order
+#(a full assignment, e.g. sliced_palette.sliced_order) or, when it is not given, the greedy matching of the graph
+#without lap the starting assignment is returned
+#returns new_palette_order, new_palette_order[i] is the index of the palette pixel placed at the ith position
+def sparse_assignment(source_im,palette_im,k=8,lab=False,initial_order=None,chunk_size=8192,max_rounds=8,progress=None):
+	source_pixels=image_to_array(source_im)
+	palette_pixels=image_to_array(palette_im)
+	assert len(source_pixels)==len(palette_pixels), "source and palette must have the same number of pixels"
+
+	oracle=make_cost_oracle(source_pixels,palette_pixels,lab)
+	if initial_order is None:
+		if progress is not None:
+			progress_phase(progress,"greedy start")
+		new_palette_order=greedy_graph_assignment(oracle,candidate_graph(oracle,k))
+	else:
+		new_palette_order=np.array(initial_order,dtype=np.int64)
+	if lapmod is None:
+		return new_palette_order
+
+	if progress is not None:
+		progress_phase(progress,"search")
+	positions=np.argsort(hilbert_key(source_pixels),kind="mergesort")
+	offsets=[0,chunk_size/2] if len(positions)>chunk_size else [0]
+	for offset in offsets:
+		start=time.time()
+		bounds=range(0,len(positions),chunk_size) if offset==0 else [0]+range(offset,len(positions),chunk_size)
+		for chunk_start,chunk_end in zip(bounds,bounds[1:]+[len(positions)]):
+			chunk=positions[chunk_start:chunk_end]
+			new_palette_order[chunk]=solve_chunk(oracle,chunk,new_palette_order[chunk],k,max_rounds)
+			if progress is not None:
+				progress_update(progress,done=chunk_end)
+		print "%d chunks solved in %.2fs (offset %d)" % (len(bounds),time.time()-start,offset)
+
+	return new_palette_order
+
+#assignment between the given positions and the palette pixels they hold: lapmod on their candidate graph, which also
+#links each position to the neighbours in colour of the palette pixel it holds, then the edges that price in (see
+#priced_edges) are added and the graph is solved again, until none is left (the assignment is then optimal) or for at
+#most max_rounds solves
+#returns the palette pixels reordered
+def solve_chunk(oracle,positions,buckets,k,max_rounds):
+	chunk_oracle={"source":oracle["source"][positions],"palette":oracle["palette"][buckets],"sqrt":oracle["sqrt"]}
+	identity=np.arange(len(positions))
+	swaps=nearest_candidates(chunk_oracle["palette"],chunk_oracle["palette"],k)
+	graph=candidate_graph(chunk_oracle,k,np.concatenate((identity,np.repeat(identity,swaps.shape[1]))),np.concatenate((identity,swaps.ravel())))
+	for r in xrange(max_rounds):
+		costs,row_starts,columns=graph
+		chunk_columns,_=lapmod(len(positions),costs,row_starts,columns,return_cost=False)
+		if r==max_rounds-1:
+			break
+		rows,new_columns=priced_edges(chunk_oracle,graph,chunk_columns,k)
+		if not len(rows):
+			break
+		rows=np.concatenate((np.repeat(identity,np.diff(row_starts)),rows))
+		graph=compress_edges(chunk_oracle,rows,np.concatenate((columns,new_columns)))
+
+	return buckets[chunk_columns]
+
+#tiled mode for large images, where a single n x n cost matrix does not fit in memory
+#the palette pixels are first spread among the tiles by matching the ranks of both images along a hilbert curve
+#of the colour cube, then each tile solves its own small assignment problem between its positions and the palette
+#pixels it received; a second pass over tiles shifted by half a tile lets pixels cross the seams of the first one
+#returns new_palette_order, new_palette_order[i] is the index of the palette pixel placed at the ith position
+def tiled_assignment(source_im,palette_im,tile_size,n_workers=1,lab=False,boundary_pass=True):
+	columns,rows=source_im.size
+	source_pixels=image_to_array(source_im)
+	palette_pixels=image_to_array(palette_im)
+	assert len(source_pixels)==len(palette_pixels), "source and palette must have the same number of pixels"
+
+	new_palette_order=rank_order(source_pixels,palette_pixels,hilbert_key)
+
+	if lab:
+		source_pixels=rgb_to_lab(source_pixels)
+		palette_pixels=rgb_to_lab(palette_pixels)
+
+	#the pixels are shared with the workers once, only positions and palette indexes go through the pipes
+	source_raw=RawArray(ctypes.c_float,source_pixels.size)
+	palette_raw=RawArray(ctypes.c_float,palette_pixels.size)
+	np.frombuffer(source_raw,dtype=np.float32)[:]=source_pixels.ravel()
+	np.frombuffer(palette_raw,dtype=np.float32)[:]=palette_pixels.ravel()
+
+	if n_workers>1:
+		pool=Pool(n_workers,init_tile_worker,(source_raw,palette_raw,lab))
+		tile_map=pool.imap
+	else:
+		init_tile_worker(source_raw,palette_raw,lab)
+		tile_map=map
+
+	offsets=[0,tile_size/2] if boundary_pass else [0]
+	try:
+		for offset in offsets:
+			start=time.time()
+			tiles=[(positions,new_palette_order[positions]) for positions in tile_positions(rows,columns,tile_size,offset)]
+			for (positions,buckets),tile_columns in zip(tiles,tile_map(solve_tile,tiles)):
+				new_palette_order[positions]=buckets[tile_columns]
+			print "%d tiles solved in %.2fs (offset %d)" % (len(tiles),time.time()-start,offset)
+	finally:
+		if n_workers>1:
+			pool.terminate()
+			pool.join()
+
+	return new_palette_order
+
+#flat positions of each tile_size x tile_size tile, the grid is shifted up and left by offset pixels
+def tile_positions(rows,columns,tile_size,offset):
+	positions=np.arange(rows*columns).reshape(rows,columns)
+	tiles=[]
+	for y in xrange(-offset,rows,tile_size):
+		for x in xrange(-offset,columns,tile_size):
+			tile=positions[max(y,0):y+tile_size,max(x,0):x+tile_size].ravel()
+			if len(tile):
+				tiles.append(tile)
+	return tiles
+
+#pixels shared by the parent process, set once by init_tile_worker
+worker_state={}
+
+#wraps the shared buffers inherited from the parent process into numpy arrays
+def init_tile_worker(source_raw,palette_raw,lab):
+	worker_state["source_pixels"]=np.frombuffer(source_raw,dtype=np.float32).reshape(-1,3)
+	worker_state["palette_pixels"]=np.frombuffer(palette_raw,dtype=np.float32).reshape(-1,3)
+	worker_state["lab"]=lab
+
+#solves the assignment of one tile, returns for each of its positions the index in buckets of the palette pixel it takes
+def solve_tile(tile):
+	positions,buckets=tile
+	cost_matrix=pixel_cost_matrix(worker_state["source_pixels"][positions],worker_state["palette_pixels"][buckets],worker_state["lab"])
+	return np.array([column for row,column in solve_assignment(cost_matrix)])
 
 #generates the final image using the solution to the assignment problem, 
 #i.e, the best matching between the initial and final positions of each pixel that gives the lowest cost
@@ -96,15 +381,39 @@ if __name__ == '__main__':
 	source_im=Image.open(source)
 	palette_im=Image.open(palette)
 
+	#"munkres" (pure python, very slow), "lapjv" (numpy cost matrix + compiled solver),
+	#"tiled" (one small lapjv problem per tile, for images too large for a full cost matrix)
+	#or "sparse" (lapmod on a graph of k nearest candidates, no cost matrix at all)
+	mode="lapjv"
+	lab=False		#L*ab costs for the lapjv, tiled and sparse modes
+	tile_size=32		#side of the tiles of the tiled mode
+	k=8				#nearest candidates per pixel of the sparse mode
+	n_workers=4		#processes solving tiles
+	boundary_pass=True	#second pass over shifted tiles to fix the seams
+
+	report_backend()
 	new_palette=generate_palette(source_im,palette_im)
+	progress=make_progress("hungarian "+mode,source_im.size[0]*source_im.size[1])
+
+	if mode=="tiled":
+		progress_phase(progress,"search")
+		indexes=list(enumerate(tiled_assignment(source_im,new_palette,tile_size,n_workers,lab,boundary_pass).tolist()))
+	elif mode=="sparse":
+		indexes=list(enumerate(sparse_assignment(source_im,new_palette,k,lab,progress=progress).tolist()))
+	else:
+		progress_phase(progress,"cost build")
+		if mode=="munkres":
+			cost_matrix=generate_cost_matrix(source_im,new_palette,progress)
+		else:
+			cost_matrix=generate_cost_matrix_np(source_im,new_palette,lab)
 
-	print "building cost matrix (this may take a while)..."
-	cost_matrix=generate_cost_matrix(source_im,new_palette)
-	
-	print "building indexes (this may take a while)..."
-	m = Munkres()
-	indexes = m.compute(cost_matrix)
+		progress_phase(progress,"search")
+		if mode=="munkres":
+			m = Munkres()
+			indexes = m.compute(cost_matrix)
+		else:
+			indexes = solve_assignment(cost_matrix)
 
-	print "reconstructing the final image (this may take a while) ..."
+	progress_phase(progress,"render")
 	generate_best_palette(palette_im,indexes)
-	print "done!"
\ No newline at end of file
+	progress_finish(progress)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Iterated Local search - the search shared by source_palette.py and source_palette_ils.py
+"""
+
+import random
+import numpy as np
+from PIL import Image
+from lab_lut import colordiff_lab_array
+from delta_fitness import pixel_errors,random_swap,swap_delta,apply_swap,make_colour_index,colour_slots,guided_swap,apply_guided_swap
+from kernels import fitness_rgb
+from permutation import make_state,state_set,mark_best,rollback,best_order
+from anytime import make_budget,budget_exhausted,start_snapshot_writer,snapshot_due,submit_snapshot,stop_snapshot_writer
+from checkpoint import make_checkpointer,checkpoint_due,save_checkpoint,load_checkpoint
+from progress import make_progress,progress_update,progress_phase,progress_finish
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#iterated local search
+#initial_order (e.g. from source_palette_sort.rank_order) starts the search from that permutation instead of a random one
+#anytime: stops after the given iterations (None for no limit), once deadline seconds have passed or when the
+#fitness reaches target_fitness, whichever comes first, and returns the best solution found [pixels,fitness]
+#with snapshot_interval the best-so-far image is written every snapshot_interval seconds by a background thread
+#with checkpoint_path the state is saved there every checkpoint_interval seconds, and resumed from it if it exists
+#progress (see progress.make_progress) receives the rate-limited reports, one is created when it is not given
+#guided is the fraction of colour-guided moves of the local search
+#the solution is an order over the palette pixels (see permutation.make_state), so the best one is never copied while
+#searching and a local search that ends worse than the best is simply rolled back
+def ils(source_im,palette_im,iterations,convergence_width,initial_order=None,deadline=None,target_fitness=None,snapshot_interval=None,checkpoint_path=None,checkpoint_interval=600,progress=None,guided=0.0):
+    source_pixels=list(source_im.getdata())
+    palette=list(palette_im.getdata())
+
+    checkpoint=load_checkpoint(checkpoint_path)
+    if checkpoint is not None:
+        state,i=resume_ils(checkpoint)
+    else:
+        order=generate_order(palette) if initial_order is None else initial_order
+        state=make_state(order,fitness(source_im,[palette[n] for n in order]))
+        i=0
+
+    budget=make_budget(deadline,target_fitness)
+    writer=None
+    if snapshot_interval is not None:
+        writer=start_snapshot_writer("best_palette.png",snapshot_interval,lambda order,path: save_palette(source_im,palette_im,[palette[n] for n in order],path))
+
+    checkpointer=make_checkpointer(checkpoint_path,checkpoint_interval)
+    if progress is None:
+        progress=make_progress("ils",iterations)
+    index=make_colour_index(source_pixels,palette,state["order"]) if guided>0 else None
+    progress_phase(progress,"search")
+
+    while (iterations is None or i<iterations) and not budget_exhausted(budget,state["best_fitness"]):
+        # perturb(source_im,palette,state)
+        local_search(source_pixels,palette,state,convergence_width,budget,progress,guided,index)
+
+        if state["fitness"]>state["best_fitness"]:
+            rollback(state)
+            if index is not None:
+                index.update(colour_slots(palette,state["order"]))
+        progress_update(progress,done=i+1,best=state["best_fitness"])
+
+        if snapshot_due(writer):
+            submit_snapshot(writer,best_order(state))
+        i+=1
+
+        if checkpoint_due(checkpointer):
+            checkpoint_ils(checkpointer,state,i)
+
+    stop_snapshot_writer(writer)
+    if checkpointer is not None:
+        checkpoint_ils(checkpointer,state,i)
+    progress_phase(progress,"render")
+    best=[[palette[n] for n in best_order(state)],state["best_fitness"]]
+    save_palette(source_im,palette_im,best[0],"best_palette.png")
+    progress_finish(progress)
+    return best
+
+#saves the state of the ils: the best order, its fitness, the iteration and the random state
+def checkpoint_ils(checkpointer,state,i):
+    save_checkpoint(checkpointer,{"order":np.frombuffer(best_order(state),dtype=np.int32)},
+        {"fitness":state["best_fitness"],"iteration":i,"random_state":random.getstate()})
+
+#restores the state saved by checkpoint_ils, returns the search state and the iteration
+def resume_ils(checkpoint):
+    arrays,state=checkpoint
+    random.setstate(state["random_state"])
+    print "resuming from iteration "+str(state["iteration"])+": Current Best Fitness: "+str(state["fitness"])
+    return make_state(arrays["order"].tolist(),state["fitness"]),state["iteration"]
+
+#writes a list of palette pixels as an image with the size of the source
+def save_palette(source_im,palette_im,pixels,filename):
+    final_image=Image.new(palette_im.mode,(source_im.size[0],source_im.size[1]))
+    final_image.putdata(pixels)
+    final_image.save(filename)
+
+def double_bridge_move(palette_pixels):
+    size=len(palette_pixels)
+
+    pos1=random.randint(1,size/4)
+    pos2 = pos1 + random.randint(1,size/4)
+    pos3 = pos2 + random.randint(1,size/4)
+    p1 = palette_pixels[0:pos1] + palette_pixels[pos3:size]
+    p2 = palette_pixels[pos2:pos3] + palette_pixels[pos1:pos2]
+
+    assert(len(palette_pixels)==len(p1+p2))
+    return p1 + p2
+
+#double bridge move of the order of the state, every change goes through the undo log
+def perturb(source_im,palette,state):
+    order=state["order"]
+    for position,index in enumerate(double_bridge_move(order)):
+        if order[position]!=index:
+            state_set(state,position,index)
+    state["fitness"]=fitness(source_im,[palette[n] for n in order])
+
+# def permut(palette_pixels):
+#     size=len(palette_pixels)
+#     cut1,cut2=random.randint(size-1),random.randint(size-1)
+#     exclude=[cut1]
+#     if cut1==0:
+#         exclude+=[size-1]
+#     else:
+#         exclude+=[cut1-1]
+
+#     if cut1==size-1:
+#         exclude+=[0]
+#     else:
+#         exclude+=[cut1+1]
+
+#     while(cut2 not in exclude):
+#         cut2=random.randint(size-1)
+
+#     if cut2<cut1:
+#         cut1, cut2 = cut2, cut1
+
+#     first=palette_pixels[0:cut1]
+
+def permut(palette_pixels):
+    random_pixel_pos1=random.randint(0,len(palette_pixels)-1)
+    random_pixel_pos2=random_pixel_pos1
+
+    while random_pixel_pos1==random_pixel_pos2:
+        random_pixel_pos2=random.randint(0,len(palette_pixels)-1)
+
+    tmp=palette_pixels[random_pixel_pos1]
+    palette_pixels[random_pixel_pos1]=palette_pixels[random_pixel_pos2]
+    palette_pixels[random_pixel_pos2]=tmp
+
+    return palette_pixels
+
+#swaps are scored incrementally from the per-pixel errors, so each move costs O(1) instead of a full fitness evaluation
+#the budget of the ils is checked and the moves are counted in progress every 1024 moves, so a deadline also interrupts
+#a long descent and the reports never slow it down
+#a fraction guided of the moves are guided swaps (see delta_fitness.guided_swap), which pick a badly fitted position and
+#a partner holding a colour close to its source colour, the others are uniformly random swaps
+#index is the colour index of the palette (see delta_fitness.make_colour_index), built when it is not given
+#the moves are applied to the state in place and every improvement over its best is marked as the new best
+def local_search(source_pixels,palette,state,convergence_width,budget=None,progress=None,guided=0.0,index=None):
+    order=state["order"]
+    errors=pixel_errors(source_pixels,palette,order)
+    size=len(order)
+    if guided>0 and index is None:
+        index=make_colour_index(source_pixels,palette,order)
+
+    counter=0
+    moves=0
+    accepted=0
+    while counter<convergence_width:
+        if index is not None and random.random()<guided:
+            i,j,delta=guided_swap(source_pixels,palette,order,errors,index)
+        else:
+            i,j=random_swap(size)
+            delta=swap_delta(source_pixels,palette,order,errors,i,j)
+
+        if delta>=0:
+            counter+=1
+        else:
+            if index is not None:
+                apply_guided_swap(source_pixels,palette,state,errors,index,i,j,delta)
+            else:
+                apply_swap(source_pixels,palette,state,errors,i,j,delta)
+            if state["fitness"]<state["best_fitness"]:
+                mark_best(state)
+            counter=0
+            accepted+=1
+
+        moves+=1
+        if moves%1024==0:
+            if progress is not None:
+                progress_update(progress,evaluations=1024,accepted=accepted,rejected=1024-accepted)
+                accepted=0
+            if budget_exhausted(budget,state["fitness"]):
+                break
+
+    if progress is not None:
+        progress_update(progress,evaluations=moves%1024,accepted=accepted,rejected=moves%1024-accepted)
+    return state
+
+
+#generates a new random individual(permutation), an order over the palette pixels
+def generate_order(palette):
+    order=range(len(palette))
+    random.shuffle(order)
+    return order
+
+#calculate the fitness of an individual, based on the color differences in the L*ab space
+#the less the better
+#pros: better results, the L*ab values come from the precomputed lookup table so it is no longer slow
+def fitness_lab(source_im,palette_pixels):
+    return float(colordiff_lab_array(list(source_im.getdata()),palette_pixels).sum())
+
+#calculate the fitness of an individual, based on the color differences in the RGB space
+#the less the better
+#pros: very fast, the sum runs in the kernels of kernels.py
+def fitness(source_im,palette_pixels):
+    return fitness_rgb(np.asarray(source_im),palette_pixels)
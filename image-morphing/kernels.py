@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Colour kernels - fitness, swap deltas, block averages and distances shared by the morphing and photomosaic scripts
+"""
+
+import os
+import numpy as np
+
+#numba compiles the loops of the kernels to native code, numpy is used when it is not installed
+try:
+	from numba import njit
+except ImportError:
+	njit=None
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#every kernel takes pixels as (n,3) arrays or lists of tuples (the alpha channel, if any, is ignored) and returns the
+#same values whatever the backend, up to the rounding of the float averages: "numba", "numpy" or "python" (the
+#original loops, kept as the reference)
+#the fastest available backend is used, KERNELS_BACKEND forces one
+
+#calculate color difference of two pixels in the RGB space
+#the less the better
+#a single difference is cheapest in plain python whatever the backend, the kernels below work on whole images
+def colordiff_rgb(pixel1,pixel2):
+
+	delta_red=pixel1[0]-pixel2[0]
+	delta_green=pixel1[1]-pixel2[1]
+	delta_blue=pixel1[2]-pixel2[2]
+
+	return delta_red*delta_red+delta_green*delta_green+delta_blue*delta_blue
+
+#pixels as an (n,3) array of signed integers (at least 32 bits, so that the squares do not overflow) or floats
+#arrays already in that form are used as they are, not copied
+def as_rgb(pixels):
+	pixels=np.asarray(pixels)
+	pixels=pixels.reshape(-1,pixels.shape[-1])[:,:3]
+	if pixels.dtype.kind=="f" or (pixels.dtype.kind=="i" and pixels.dtype.itemsize>=4):
+		return pixels
+	if pixels.dtype.kind in "iub":
+		return pixels.astype(np.int64)
+	return pixels.astype(np.float64)
+
+#python backend, arrays are turned into lists of python ints first so that uint8 colours do not wrap around
+
+def as_pixels(pixels):
+	if isinstance(pixels,np.ndarray):
+		return as_rgb(pixels).tolist()
+	return pixels
+
+def python_pixel_errors(source_pixels,palette_pixels):
+	source_pixels=as_pixels(source_pixels)
+	palette_pixels=as_pixels(palette_pixels)
+	return np.array([colordiff_rgb(source_pixel,palette_pixel) for source_pixel,palette_pixel in zip(source_pixels,palette_pixels)])
+
+def python_fitness_rgb(source_pixels,palette_pixels):
+	source_pixels=as_pixels(source_pixels)
+	palette_pixels=as_pixels(palette_pixels)
+	fit=0.0
+	for i in xrange(len(palette_pixels)):
+		fit+=colordiff_rgb(source_pixels[i],palette_pixels[i])
+	return fit
+
+def python_swap_deltas(source_pixels,palette_pixels,errors,first,second):
+	source_pixels=as_pixels(source_pixels)
+	palette_pixels=as_pixels(palette_pixels)
+	return np.array([colordiff_rgb(source_pixels[i],palette_pixels[j])+colordiff_rgb(source_pixels[j],palette_pixels[i])-errors[i]-errors[j]
+		for i,j in zip(first,second)])
+
+def python_population_fitness(source_pixels,palette_pixels,population,sqrt):
+	palette_pixels=np.asarray(palette_pixels)
+	fitnesses=[]
+	for individual in population:
+		errors=python_pixel_errors(source_pixels,palette_pixels[np.asarray(individual)])
+		fitnesses.append((np.sqrt(errors) if sqrt else errors).sum())
+	return np.array(fitnesses,dtype=np.float64)
+
+def python_average_color(pixels):
+	pixels=as_pixels(pixels)
+	avg_r=avg_g=avg_b=0.0
+	size=len(pixels)
+	for p in pixels:
+		avg_r+=p[0]/float(size)
+		avg_g+=p[1]/float(size)
+		avg_b+=p[2]/float(size)
+
+	return (avg_r,avg_g,avg_b)
+
+def python_block_averages(pixels,block_width,block_height):
+	pixels=np.asarray(pixels)
+	grid_width=pixels.shape[1]/block_width
+	grid_height=pixels.shape[0]/block_height
+	averages=[]
+	for n in xrange(grid_width*grid_height):
+		i=(n%grid_width)*block_width
+		j=(n/grid_width)*block_height
+		averages.append(python_average_color(pixels[j:j+block_height,i:i+block_width]))
+	return np.array(averages)
+
+def python_pairwise_distances(colors1,colors2):
+	colors1=as_pixels(colors1)
+	colors2=as_pixels(colors2)
+	return np.array([[colordiff_rgb(color1,color2) for color2 in colors2] for color1 in colors1])
+
+#numpy backend
+
+def numpy_pixel_errors(source_pixels,palette_pixels):
+	delta=as_rgb(source_pixels)-as_rgb(palette_pixels)
+	return (delta*delta).sum(axis=1)
+
+def numpy_fitness_rgb(source_pixels,palette_pixels):
+	return float(numpy_pixel_errors(source_pixels,palette_pixels).sum())
+
+def numpy_swap_deltas(source_pixels,palette_pixels,errors,first,second):
+	source_pixels=as_rgb(source_pixels)
+	palette_pixels=as_rgb(palette_pixels)
+	return (numpy_pixel_errors(source_pixels[first],palette_pixels[second])+numpy_pixel_errors(source_pixels[second],palette_pixels[first])
+		-errors[first]-errors[second])
+
+#the individuals are gathered in blocks of rows of about 256K pixels, so the differences stay small enough for the cache
+def numpy_population_fitness(source_pixels,palette_pixels,population,sqrt):
+	source_pixels=as_rgb(source_pixels)
+	palette_pixels=as_rgb(palette_pixels)
+	population=np.asarray(population)
+	fitnesses=np.empty(len(population))
+	rows=max(1,(1<<18)/max(1,population.shape[1]))
+	for start in xrange(0,len(population),rows):
+		delta=palette_pixels[population[start:start+rows]]-source_pixels
+		errors=(delta*delta).sum(axis=2)
+		fitnesses[start:start+rows]=(np.sqrt(errors) if sqrt else errors).sum(axis=1)
+	return fitnesses
+
+def numpy_average_color(pixels):
+	return tuple(as_rgb(pixels).mean(axis=0).tolist())
+
+def numpy_block_averages(pixels,block_width,block_height):
+	pixels=np.asarray(pixels)[:,:,:3]
+	grid_width=pixels.shape[1]/block_width
+	grid_height=pixels.shape[0]/block_height
+	blocks=pixels[:grid_height*block_height,:grid_width*block_width].astype(np.float64)
+	return blocks.reshape(grid_height,block_height,grid_width,block_width,3).mean(axis=(1,3)).reshape(-1,3)
+
+def numpy_pairwise_distances(colors1,colors2):
+	colors1=as_rgb(colors1)
+	colors2=as_rgb(colors2)
+	#one channel at a time, so that only a single (m,n) array is alive
+	distances=np.zeros((len(colors1),len(colors2)),dtype=np.result_type(colors1,colors2))
+	for channel in xrange(3):
+		delta=colors1[:,channel,np.newaxis]-colors2[np.newaxis,:,channel]
+		distances+=delta*delta
+	return distances
+
+#numba backend: the numpy conversions stay in python, only the loops over the pixels are compiled
+
+if njit is not None:
+	@njit(cache=True)
+	def compiled_pixel_errors(source_pixels,palette_pixels):
+		errors=np.zeros(source_pixels.shape[0],dtype=source_pixels.dtype)
+		for n in range(source_pixels.shape[0]):
+			for channel in range(3):
+				delta=source_pixels[n,channel]-palette_pixels[n,channel]
+				errors[n]+=delta*delta
+		return errors
+
+	@njit(cache=True)
+	def compiled_swap_deltas(source_pixels,palette_pixels,errors,first,second):
+		deltas=np.empty(first.shape[0],dtype=errors.dtype)
+		for n in range(first.shape[0]):
+			i=first[n]
+			j=second[n]
+			delta=-errors[i]-errors[j]
+			for channel in range(3):
+				delta_i=source_pixels[i,channel]-palette_pixels[j,channel]
+				delta_j=source_pixels[j,channel]-palette_pixels[i,channel]
+				delta+=delta_i*delta_i+delta_j*delta_j
+			deltas[n]=delta
+		return deltas
+
+	@njit(cache=True)
+	def compiled_population_fitness(source_pixels,palette_pixels,population,sqrt):
+		fitnesses=np.zeros(population.shape[0])
+		for k in range(population.shape[0]):
+			for n in range(population.shape[1]):
+				j=population[k,n]
+				error=0.0
+				for channel in range(3):
+					delta=source_pixels[n,channel]-palette_pixels[j,channel]
+					error+=delta*delta
+				fitnesses[k]+=np.sqrt(error) if sqrt else error
+		return fitnesses
+
+	@njit(cache=True)
+	def compiled_block_averages(pixels,block_width,block_height):
+		grid_width=pixels.shape[1]//block_width
+		grid_height=pixels.shape[0]//block_height
+		averages=np.zeros((grid_width*grid_height,3))
+		for y in range(grid_height*block_height):
+			for x in range(grid_width*block_width):
+				n=(y//block_height)*grid_width+x//block_width
+				for channel in range(3):
+					averages[n,channel]+=pixels[y,x,channel]
+		return averages/(block_width*block_height)
+
+	@njit(cache=True)
+	def compiled_pairwise_distances(colors1,colors2):
+		distances=np.zeros((colors1.shape[0],colors2.shape[0]),dtype=colors1.dtype)
+		for m in range(colors1.shape[0]):
+			for n in range(colors2.shape[0]):
+				for channel in range(3):
+					delta=colors1[m,channel]-colors2[n,channel]
+					distances[m,n]+=delta*delta
+		return distances
+
+def numba_pixel_errors(source_pixels,palette_pixels):
+	return compiled_pixel_errors(as_rgb(source_pixels),as_rgb(palette_pixels))
+
+def numba_fitness_rgb(source_pixels,palette_pixels):
+	return float(numba_pixel_errors(source_pixels,palette_pixels).sum())
+
+def numba_swap_deltas(source_pixels,palette_pixels,errors,first,second):
+	return compiled_swap_deltas(as_rgb(source_pixels),as_rgb(palette_pixels),np.asarray(errors),np.asarray(first),np.asarray(second))
+
+def numba_population_fitness(source_pixels,palette_pixels,population,sqrt):
+	source_pixels=as_rgb(source_pixels)
+	palette_pixels=as_rgb(palette_pixels)
+	dtype=np.result_type(source_pixels,palette_pixels)
+	return compiled_population_fitness(source_pixels.astype(dtype),palette_pixels.astype(dtype),np.asarray(population),sqrt)
+
+def numba_block_averages(pixels,block_width,block_height):
+	return compiled_block_averages(np.asarray(pixels)[:,:,:3],block_width,block_height)
+
+def numba_pairwise_distances(colors1,colors2):
+	colors1=as_rgb(colors1)
+	colors2=as_rgb(colors2)
+	dtype=np.result_type(colors1,colors2)
+	return compiled_pairwise_distances(colors1.astype(dtype),colors2.astype(dtype))
+
+#kernels of each backend, by name; the average of a single colour list gains nothing from compilation
+backends={
+	"python":{"pixel_errors":python_pixel_errors,"fitness_rgb":python_fitness_rgb,"swap_deltas":python_swap_deltas,"population_fitness":python_population_fitness,
+		"average_color":python_average_color,"block_averages":python_block_averages,"pairwise_distances":python_pairwise_distances},
+	"numpy":{"pixel_errors":numpy_pixel_errors,"fitness_rgb":numpy_fitness_rgb,"swap_deltas":numpy_swap_deltas,"population_fitness":numpy_population_fitness,
+		"average_color":numpy_average_color,"block_averages":numpy_block_averages,"pairwise_distances":numpy_pairwise_distances},
+	"numba":{"pixel_errors":numba_pixel_errors,"fitness_rgb":numba_fitness_rgb,"swap_deltas":numba_swap_deltas,"population_fitness":numba_population_fitness,
+		"average_color":numpy_average_color,"block_averages":numba_block_averages,"pairwise_distances":numba_pairwise_distances}}
+
+#the kernels in use, set by set_backend
+active={"backend":None,"kernels":None,"reported":False}
+
+#selects the kernels of a backend, None picks numba when it is installed and numpy otherwise
+def set_backend(name=None):
+	if name is None:
+		name="numba" if njit is not None else "numpy"
+	if name=="numba" and njit is None:
+		raise ValueError("numba is not installed")
+	active["backend"]=name
+	active["kernels"]=backends[name]
+	return name
+
+#prints the backend in use, once per process
+def report_backend():
+	if not active["reported"]:
+		print "kernels: "+active["backend"]+(" (numba is not installed)" if njit is None else "")
+		active["reported"]=True
+	return active["backend"]
+
+#squared RGB difference at each position
+def pixel_errors(source_pixels,palette_pixels):
+	return active["kernels"]["pixel_errors"](source_pixels,palette_pixels)
+
+#sum of the squared RGB differences, the fitness of the morphing scripts
+def fitness_rgb(source_pixels,palette_pixels):
+	return active["kernels"]["fitness_rgb"](source_pixels,palette_pixels)
+
+#change in fitness of swapping the palette pixels at positions first[k] and second[k], for every k at once
+#errors are the pixel_errors of the current solution
+def swap_deltas(source_pixels,palette_pixels,errors,first,second):
+	return active["kernels"]["swap_deltas"](source_pixels,palette_pixels,errors,first,second)
+
+#fitness of every individual of a population at once, population is a (size,n) array of palette orders where
+#population[k,i] is the palette pixel placed at position i by individual k; with sqrt the square roots of the squared
+#differences are summed instead (the L*ab distance, when the pixels are L*ab colours)
+def population_fitness(source_pixels,palette_pixels,population,sqrt=False):
+	return active["kernels"]["population_fitness"](source_pixels,palette_pixels,population,sqrt)
+
+#average colour of a list of pixels, as an (r,g,b) tuple
+def average_color(pixels):
+	return active["kernels"]["average_color"](pixels)
+
+#average colour of each block_width x block_height block of a (rows,columns,3) image, row by row, as an (n,3) array
+#the incomplete blocks of the right and bottom edges are left out
+def block_averages(pixels,block_width,block_height):
+	return active["kernels"]["block_averages"](pixels,block_width,block_height)
+
+#squared RGB distance between every colour of colors1 and every colour of colors2, as an (m,n) array
+def pairwise_distances(colors1,colors2):
+	return active["kernels"]["pairwise_distances"](colors1,colors2)
+
+set_backend(os.environ.get("KERNELS_BACKEND"))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Precomputed RGB -> L*ab lookup table - shared by every colordiff_lab of the morphing and photomosaic scripts
+"""
+
+import os
+import numpy as np
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#where the table lives, it is built on first use (~100MB in float16, ~200MB in float32)
+LUT_PATH=os.environ.get("LAB_LUT_PATH",os.path.join(os.path.dirname(os.path.abspath(__file__)),"rgb_lab_lut.npy"))
+
+#same constants as colormath (sRGB working space, d65 reference white), so the values match convert_color
+RGB_TO_XYZ=np.array([[0.412424,0.357579,0.180464],
+					[0.212656,0.715158,0.0721856],
+					[0.0193324,0.119193,0.950444]])
+D65_WHITE=np.array([0.95047,1.00000,1.08883])
+CIE_E=216.0/24389.0
+
+#memory-mapped table, loaded once per process
+lut=None
+
+#converts an (n,3) array of 0-255 RGB values to L*ab, exactly as colormath does but for a whole array at once
+def convert_rgb_to_lab(pixels):
+	rgb=pixels/255.0
+	linear=np.where(rgb<=0.04045,rgb/12.92,((rgb+0.055)/1.055)**2.4)
+
+	xyz=linear.dot(RGB_TO_XYZ.T)/D65_WHITE
+	f=np.where(xyz>CIE_E,np.cbrt(xyz),7.787*xyz+16.0/116.0)
+
+	lab=np.empty(pixels.shape)
+	lab[:,0]=116.0*f[:,1]-16.0
+	lab[:,1]=500.0*(f[:,0]-f[:,1])
+	lab[:,2]=200.0*(f[:,1]-f[:,2])
+	return lab
+
+#builds the table for all the 2^24 sRGB colours, indexed by (r<<16)|(g<<8)|b
+#it is written in chunks to a temporary .npy file and then renamed, so an interrupted build never leaves a broken table
+def build_lab_lut(path=LUT_PATH,dtype=np.float16,chunk_size=1<<20):
+	tmp_path=path+".tmp.npy"
+	table=np.lib.format.open_memmap(tmp_path,mode="w+",dtype=dtype,shape=(1<<24,3))
+
+	for start in xrange(0,1<<24,chunk_size):
+		codes=np.arange(start,start+chunk_size)
+		pixels=np.column_stack(((codes>>16)&255,(codes>>8)&255,codes&255))
+		table[start:start+chunk_size]=convert_rgb_to_lab(pixels)
+
+	table.flush()
+	del table
+	os.rename(tmp_path,path)
+
+#memory-maps the table, building it first if it does not exist yet
+def load_lab_lut(path=LUT_PATH):
+	global lut
+	if lut is None:
+		if not os.path.exists(path):
+			print "building the RGB -> L*ab lookup table (only done once) ..."
+			build_lab_lut(path)
+		lut=np.load(path,mmap_mode="r")
+	return lut
+
+#L*ab values of an (n,3) array of RGB pixels, just an array lookup
+def rgb_to_lab(pixels):
+	pixels=np.asarray(pixels,dtype=np.int64)
+	codes=(pixels[...,0]<<16)|(pixels[...,1]<<8)|pixels[...,2]
+	return load_lab_lut()[codes].astype(np.float32)
+
+#calculate color difference of two pixels in the L*ab space (delta e cie1976)
+#less is better
+def colordiff_lab(pixel1,pixel2):
+	table=load_lab_lut()
+
+	lab_1=table[(int(round(pixel1[0]))<<16)|(int(round(pixel1[1]))<<8)|int(round(pixel1[2]))]
+	lab_2=table[(int(round(pixel2[0]))<<16)|(int(round(pixel2[1]))<<8)|int(round(pixel2[2]))]
+
+	delta_l=float(lab_1[0])-float(lab_2[0])
+	delta_a=float(lab_1[1])-float(lab_2[1])
+	delta_b=float(lab_1[2])-float(lab_2[2])
+	return (delta_l*delta_l+delta_a*delta_a+delta_b*delta_b)**0.5
+
+#delta e cie1976 between two (n,3) arrays of RGB pixels, position by position
+def colordiff_lab_array(pixels1,pixels2):
+	delta=rgb_to_lab(pixels1)-rgb_to_lab(pixels2)
+	return np.sqrt((delta*delta).sum(-1))
+
+if __name__ == '__main__':
+	print "building the RGB -> L*ab lookup table in "+LUT_PATH+" ..."
+	build_lab_lut(LUT_PATH)
+	print "done!"
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Morph animation - the frames of the transition from the palette image to its rearrangement, encoded in the background
+"""
+
+import struct
+from io import BytesIO
+from collections import deque
+from multiprocessing import Pool,cpu_count
+import numpy as np
+from PIL import Image
+from progress import make_progress,progress_update,progress_phase,progress_finish
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#the ith palette pixel starts at its own place in the palette image and ends at the position where new_palette_order
+#puts it, with its own colour or the colour of the source at that position
+#modes: "position" moves the pixels keeping their colour (palette image -> solver output), "color" leaves them at their
+#destination and fades their colour into the source colour (solver output -> source image), "both" does both at once
+#(palette image -> source image)
+def make_trajectories(source_pixels,palette_pixels,new_palette_order,columns,mode="position"):
+	assert mode in ("position","color","both"), "unknown mode: "+mode
+	source_pixels=np.asarray(source_pixels,dtype=np.uint8).reshape(-1,3)
+	palette_pixels=np.asarray(palette_pixels,dtype=np.uint8).reshape(-1,3)
+	new_palette_order=np.asarray(new_palette_order,dtype=np.int64)
+	positions=np.arange(len(new_palette_order))
+
+	#indexed by destination: the pixel placed at position i comes from position new_palette_order[i] of the palette
+	origins=new_palette_order if mode!="color" else positions
+	start_colors=palette_pixels[new_palette_order].astype(np.float32)
+	end_colors=source_pixels.astype(np.float32) if mode!="position" else start_colors
+	return {"rows":len(positions)/columns,"columns":columns,
+		"start_rows":(origins/columns).astype(np.float32),"start_columns":(origins%columns).astype(np.float32),
+		"end_rows":(positions/columns).astype(np.float32),"end_columns":(positions%columns).astype(np.float32),
+		"start_colors":start_colors,"end_colors":end_colors,"moves":mode!="color"}
+
+#smoothstep, the pixels accelerate out of the palette image and slow down into the result
+def ease(t):
+	return t*t*(3-2*t)
+
+#yields the n_frames frames of the trajectories as (rows,columns,3) uint8 arrays, the first and last frames included
+#frames are computed one at a time when asked for, only the previous one is kept: the moving pixels leave holes behind
+#them and the positions no pixel lands on in a frame keep their colour from the previous frame
+def frames(trajectories,n_frames):
+	rows,columns=trajectories["rows"],trajectories["columns"]
+	start_colors,end_colors=trajectories["start_colors"],trajectories["end_colors"]
+	previous=None
+
+	for f in xrange(n_frames):
+		t=ease(f/float(max(1,n_frames-1)))
+		colors=np.rint(start_colors+(end_colors-start_colors)*t).astype(np.uint8)
+
+		if trajectories["moves"]:
+			frame_rows=np.rint(trajectories["start_rows"]+(trajectories["end_rows"]-trajectories["start_rows"])*t).astype(np.int64)
+			frame_columns=np.rint(trajectories["start_columns"]+(trajectories["end_columns"]-trajectories["start_columns"])*t).astype(np.int64)
+			#a new array every frame, the previous one may still be waiting to be encoded
+			frame=np.zeros((rows,columns,3),dtype=np.uint8) if previous is None else previous.copy()
+			frame[frame_rows,frame_columns]=colors
+		else:
+			frame=colors.reshape(rows,columns,3)
+
+		previous=frame
+		yield frame
+
+#writes the frames as a PNG sequence (output is a pattern like "morph_%04d.png") or as an animated GIF (output ends
+#with .gif), the frames are encoded by a pool of n_workers processes while the next ones are generated
+#at most max_pending frames are waiting in the pool, so the memory used does not depend on the number of frames
+#duration is the time each frame is shown in milliseconds, loop the number of repetitions of the GIF (0 forever)
+def encode_frames(frames,output,n_workers=None,max_pending=None,duration=40,loop=0,progress=None):
+	if n_workers is None:
+		n_workers=cpu_count()
+	if max_pending is None:
+		max_pending=2*n_workers
+	gif=output.lower().endswith(".gif")
+
+	pool=Pool(n_workers)
+	pending=deque()
+	n_frames=0
+	f=open(output,"wb") if gif else None
+	try:
+		for frame in frames:
+			if gif:
+				if n_frames==0:
+					f.write(gif_header(frame.shape[1],frame.shape[0],loop))
+				pending.append(pool.apply_async(encode_gif_frame,(frame,duration)))
+			else:
+				pending.append(pool.apply_async(encode_png,(frame,output % n_frames)))
+			n_frames+=1
+
+			#frames are collected in order, waiting for the oldest one when the pool is full
+			while len(pending)>=max_pending:
+				write_encoded(pending.popleft().get(),f)
+				if progress is not None:
+					progress_update(progress,done=n_frames-len(pending))
+		while pending:
+			write_encoded(pending.popleft().get(),f)
+		if gif:
+			f.write(";")
+	finally:
+		pool.close()
+		pool.join()
+		if f is not None:
+			f.close()
+
+	if progress is not None:
+		progress_update(progress,done=n_frames)
+	return n_frames
+
+#the pngs are written by the workers, the gif frames are appended to the file in order by the parent
+def write_encoded(encoded,f):
+	if f is not None:
+		f.write(encoded)
+
+def encode_png(frame,path):
+	Image.fromarray(frame,"RGB").save(path)
+	return path
+
+#GIF89a header without a global colour table (every frame has its own), and the NETSCAPE2.0 loop extension
+def gif_header(width,height,loop):
+	return "GIF89a"+struct.pack("<HHBBB",width,height,0,0,0)+"!\xff\x0bNETSCAPE2.0\x03\x01"+struct.pack("<H",loop)+"\x00"
+
+#one frame of an animated GIF: its delay, image descriptor, local colour table (an adaptive palette of 256 colours)
+#and LZW data, cut out of the single frame GIF written by PIL for the quantized frame
+def encode_gif_frame(frame,duration):
+	buffer=BytesIO()
+	Image.fromarray(frame,"RGB").convert("P",palette=Image.ADAPTIVE,colors=256).save(buffer,"GIF")
+	data=buffer.getvalue()
+
+	flags=ord(data[10])
+	position=13
+	table=""
+	if flags&128:
+		table=data[position:position+(3<<((flags&7)+1))]
+		position+=len(table)
+	#skips the extensions before the image descriptor, each is a label and sub-blocks ended by an empty one
+	while data[position]=="!":
+		position+=2
+		while ord(data[position]):
+			position+=ord(data[position])+1
+		position+=1
+
+	assert data[position]==",", "unexpected GIF block"
+	local_flags=ord(data[position+9])
+	if table:
+		local_flags|=128|(flags&7)
+	descriptor=data[position:position+9]+chr(local_flags)
+	delay="!\xf9\x04\x00"+struct.pack("<H",int(duration/10))+"\x00\x00"
+	return delay+descriptor+table+data[position+10:-1]
+
+#renders the morph of palette_im into source_im given by new_palette_order, the final permutation of any solver
+#(new_palette_order[i] is the index of the palette pixel placed at the ith position)
+def animate(source_im,palette_im,new_palette_order,output,n_frames=60,mode="position",n_workers=None,duration=40,progress=None):
+	columns,rows=source_im.size
+	source_pixels=np.asarray(source_im.convert("RGB")).reshape(-1,3)
+	palette_pixels=np.asarray(palette_im.convert("RGB")).reshape(-1,3)
+	assert len(palette_pixels)==rows*columns, "source and palette must have the same number of pixels"
+	if progress is None:
+		progress=make_progress("animation",n_frames)
+
+	progress_phase(progress,"frames")
+	trajectories=make_trajectories(source_pixels,palette_pixels,new_palette_order,columns,mode)
+	n_frames=encode_frames(frames(trajectories,n_frames),output,n_workers,duration=duration,progress=progress)
+	progress_finish(progress)
+	return n_frames
+
+if __name__ == '__main__':
+	import batch_morph
+
+	source="images/american_gothic.png"
+	palette="images/mona_lisa.png"
+
+	#animation parameters
+	solver="sliced"		#any solver of batch_morph.solvers
+	params={}
+	n_frames=60
+	mode="position"		#"position", "color" or "both"
+	output=palette.split(".")[0]+"_morph.gif"	#or a PNG sequence pattern such as "morph_%04d.png"
+	n_workers=None		#encoding processes, one per core
+	duration=40			#milliseconds per frame
+
+	source_im=Image.open(source)
+	palette_im=Image.open(palette)
+	new_palette_order=batch_morph.solvers[solver](np.asarray(source_im.convert("RGB")),np.asarray(palette_im.convert("RGB")),params)
+	animate(source_im,palette_im,new_palette_order,output,n_frames,mode,n_workers,duration)
@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Out-of-core morphing - rank and histogram matching of images larger than the memory, through files on disk
+"""
+
+import os
+import time
+import zlib
+import struct
+import shutil
+import tempfile
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from source_palette_sort import rank_keys
+from histogram_palette import solve_transport,luminance
+from progress import make_progress,progress_update,progress_phase,progress_finish
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#every pass reads and writes the files in strips of strip_size pixels, so the memory used depends on the budget and not
+#on the size of the images: a strip of pixels costs about 128 bytes per pixel at its peak (the sort records, their
+#argsort and the hilbert keys), so the strips are budget/128 pixels long
+#the raw pixels, keys and sort records live in files of a temporary workspace, removed at the end
+#a record is a pair of int64 (key, payload): the sorts move the payloads and only look at the keys
+
+#bytes of memory per pixel of a strip
+strip_bytes=128
+
+#bytes per pixel of the PNG colour types decoded strip by strip, at 8 bits per sample: grey, RGB, palette, grey and
+#alpha, RGBA (the alpha is dropped like Image.convert("RGB") does)
+png_channels={0:1,2:3,3:1,4:2,6:4}
+
+#rearranges the pixels of palette_path into source_path and writes the result to new_filename as a PNG, row strip by
+#row strip, with at most about budget bytes of pixels in memory
+#method "rank" sorts both images by rank_key (see source_palette_sort.rank_keys), "histogram" solves the transport
+#between their colour histograms with bits per channel (see histogram_palette)
+#with order_path the permutation (new_palette_order[i] is the index of the palette pixel placed at the ith position) is
+#also saved there as a .npy file, which can be opened with np.load(order_path,mmap_mode="r")
+def search(source_path,palette_path,new_filename,method="rank",rank_key="hilbert",bits=4,budget=256<<20,order_path=None,workspace_dir=None,progress=None):
+	strip_size=max(4096,budget/strip_bytes)
+	columns,rows=Image.open(source_path).size
+	n_pixels=rows*columns
+	if progress is None:
+		progress=make_progress("out of core "+method,n_pixels)
+
+	workspace=tempfile.mkdtemp(prefix="out_of_core_",dir=workspace_dir)
+	start=time.time()
+	try:
+		progress_phase(progress,"decode")
+		source=raw_image(source_path,os.path.join(workspace,"source.rgb"),strip_size,budget)
+		palette=raw_image(palette_path,os.path.join(workspace,"palette.rgb"),strip_size,budget)
+		assert palette["rows"]*palette["columns"]==n_pixels, "source and palette must have the same number of pixels"
+
+		if method=="rank":
+			source_records,palette_records,transfers=rank_records(source,palette,rank_keys[rank_key],workspace,strip_size,progress)
+		else:
+			source_records,palette_records,transfers=histogram_records(source,palette,bits,workspace,strip_size,progress)
+
+		#the jth palette pixel of a transfer goes to the position of the jth source pixel, the pairs are then sorted by
+		#position so that the result can be written row by row
+		progress_phase(progress,"match")
+		pairs=match_records(source_records,palette_records,transfers,os.path.join(workspace,"pairs"),strip_size)
+		progress_phase(progress,"sort")
+		pairs=external_sort(pairs,n_pixels,bit_length(n_pixels-1),workspace,strip_size)
+
+		progress_phase(progress,"render")
+		fitness=write_result(pairs,source,new_filename,order_path,strip_size,progress)
+	finally:
+		shutil.rmtree(workspace)
+
+	print "out of core %s matching done in %.2fs" % (method,time.time()-start)
+	print "Fitness achieved: "+str(fitness)
+	progress_finish(progress)
+	return fitness
+
+def bit_length(value):
+	return max(1,int(value).bit_length())
+
+#the pixels of an image as a raw file of rows*columns*3 bytes: uncompressed RGB files (PPM, TIFF) are used in place,
+#8-bit non-interlaced PNG files are decompressed and unfiltered row strip by row strip (see png_strips)
+#other formats are decoded once by PIL, which holds the whole image at 4 bytes per pixel, so they are refused when that
+#is above budget bytes
+def raw_image(path,raw_path,strip_size,budget):
+	im=Image.open(path)
+	columns,rows=im.size
+	if im.mode=="RGB" and len(im.tile)==1:
+		decoder,box,offset,args=im.tile[0]
+		if decoder=="raw" and box==(0,0,columns,rows) and args[0]=="RGB" and args[1] in (0,3*columns) and args[2]==1:
+			return {"path":path,"offset":offset,"rows":rows,"columns":columns}
+
+	strip_rows=max(1,strip_size/columns)
+	if im.format=="PNG":
+		header=png_header(path)
+		if header["bit_depth"]==8 and header["interlace"]==0 and header["colour_type"] in png_channels:
+			with open(raw_path,"wb") as f:
+				for pixels in png_strips(path,header,strip_rows):
+					pixels.tofile(f)
+			return {"path":raw_path,"offset":0,"rows":rows,"columns":columns}
+
+	if 4*rows*columns>budget:
+		raise ValueError("%s (%dx%d %s) can only be decoded whole, which takes more than the budget of %d bytes: convert it to PPM, TIFF or an 8-bit non-interlaced PNG" % (path,columns,rows,im.format,budget))
+	im=im.convert("RGB")
+	with open(raw_path,"wb") as f:
+		for row in xrange(0,rows,strip_rows):
+			np.asarray(im.crop((0,row,columns,min(rows,row+strip_rows))),dtype=np.uint8).tofile(f)
+	del im
+	return {"path":raw_path,"offset":0,"rows":rows,"columns":columns}
+
+#size, bit depth, colour type and interlace method of a PNG file, from its IHDR chunk (always the first one)
+def png_header(path):
+	with open(path,"rb") as f:
+		f.seek(16)
+		columns,rows,bit_depth,colour_type,_,_,interlace=struct.unpack(">IIBBBBB",f.read(13))
+	return {"columns":columns,"rows":rows,"bit_depth":bit_depth,"colour_type":colour_type,"interlace":interlace}
+
+#the pixels of an 8-bit non-interlaced PNG as (rows,columns,3) uint8 strips of strip_rows rows, the inverse of the
+#writer below: the IDAT chunks are read in pieces and decompressed as one stream, never more than a strip at a time, and
+#the filtered rows of each strip are unfiltered by unfilter_strip
+def png_strips(path,header,strip_rows):
+	columns,rows=header["columns"],header["rows"]
+	row_bytes=1+columns*png_channels[header["colour_type"]]
+	strip_length=strip_rows*row_bytes
+	decompressor=zlib.decompressobj()
+	data=""
+	palette=None
+	previous=None
+	done=0
+	with open(path,"rb") as f:
+		f.seek(8)
+		while True:
+			chunk=f.read(8)
+			if len(chunk)<8:
+				raise ValueError("%s: the PNG ends before its IEND chunk" % path)
+			length,chunk_type=struct.unpack(">I4s",chunk)
+			if chunk_type=="IEND":
+				break
+			if chunk_type=="PLTE":
+				palette=f.read(length)
+			elif chunk_type=="IDAT":
+				left=length
+				while left:
+					piece=f.read(min(left,1<<20))
+					left-=len(piece)
+					while piece:
+						data+=decompressor.decompress(piece,strip_length)
+						piece=decompressor.unconsumed_tail
+						while len(data)>=strip_length:
+							pixels,previous=unfilter_strip(header,palette,previous,data[:strip_length])
+							data=data[strip_length:]
+							done+=strip_rows
+							yield pixels
+			else:
+				f.seek(length,1)
+			#the CRC
+			f.seek(4,1)
+
+	data+=decompressor.flush()
+	if done+len(data)/row_bytes!=rows or len(data)%row_bytes:
+		raise ValueError("%s: the image data does not have the %d rows of the header" % (path,rows))
+	if data:
+		yield unfilter_strip(header,palette,previous,data)[0]
+
+#unfilters consecutive filtered rows (each starting with its filter type) by decoding them with PIL as a PNG of their
+#own, stored without compression; the filters of the first row may refer to the row above, so the previous row is put
+#back in front of them unfiltered (filter type 0) and dropped from the result
+#returns the rows as a (rows,columns,3) uint8 array and the last one as it is stored in the PNG, for the next strip
+def unfilter_strip(header,palette,previous,data):
+	columns=header["columns"]
+	rows=len(data)/(1+columns*png_channels[header["colour_type"]])
+	if previous is not None:
+		data="\x00"+previous+data
+		rows+=1
+
+	png=BytesIO()
+	png.write("\x89PNG\r\n\x1a\n")
+	write_png_chunk(png,"IHDR",struct.pack(">IIBBBBB",columns,rows,8,header["colour_type"],0,0,0))
+	if palette is not None:
+		write_png_chunk(png,"PLTE",palette)
+	write_png_chunk(png,"IDAT",zlib.compress(data,0))
+	write_png_chunk(png,"IEND","")
+	png.seek(0)
+
+	im=Image.open(png)
+	im.load()
+	last=np.asarray(im)[-1].tobytes()
+	pixels=np.asarray(im.convert("RGB"),dtype=np.uint8)
+	if previous is not None:
+		pixels=pixels[1:]
+	return pixels,last
+
+#(count,3) uint8 copy of the pixels first to first+count of a raw image, through a memory map of just that window so
+#that the pages read do not stay mapped
+def read_pixels(raw,first,count):
+	window=np.memmap(raw["path"],dtype=np.uint8,mode="r",offset=raw["offset"]+3*first,shape=(count,3))
+	pixels=np.array(window)
+	del window
+	return pixels
+
+#reads count records starting at the first one
+def read_records(f,first,count):
+	f.seek(16*first)
+	return np.fromfile(f,dtype=np.int64,count=2*count).reshape(-1,2)
+
+#a sort key as a non-negative int64 that keeps the order of the values, floats are mapped through their bits
+def sortable(keys):
+	if keys.dtype.kind!="f":
+		return keys.astype(np.int64)
+	bits=keys.astype(np.float32).view(np.uint32).astype(np.int64)
+	return np.where(bits&0x80000000,0xffffffff-bits,bits|0x80000000)
+
+#rank matching: the records of each image are (key, payload) with the key of its pixel, sorted by key a single transfer
+#pairs the ith source pixel with the ith palette pixel, like source_palette_sort.rank_order (both sorts are stable)
+def rank_records(source,palette,key_func,workspace,strip_size,progress):
+	progress_phase(progress,"keys")
+	records=[]
+	for name,raw in (("source",source),("palette",palette)):
+		path=os.path.join(workspace,name+".records")
+		key_bits=write_records(raw,path,lambda pixels: sortable(key_func(pixels)),name=="palette",strip_size)
+		records.append((path,key_bits))
+
+	progress_phase(progress,"sort")
+	n_pixels=source["rows"]*source["columns"]
+	source_records=external_sort(records[0][0],n_pixels,records[0][1],workspace,strip_size)
+	palette_records=external_sort(records[1][0],n_pixels,records[1][1],workspace,strip_size)
+	return source_records,palette_records,[(0,0,n_pixels)]
+
+#histogram matching: the histograms are counted strip by strip, the transport between them is solved in memory (its size
+#is the number of colour bins) and the records are sorted by bin then luminance, like histogram_palette.expand_flows
+#returns the transfers as (first source record, first palette record, number of pixels)
+def histogram_records(source,palette,bits,workspace,strip_size,progress):
+	progress_phase(progress,"histograms")
+	source_counts,source_colors=histogram(source,bits,strip_size)
+	palette_counts,palette_colors=histogram(palette,bits,strip_size)
+	source_bins=np.flatnonzero(source_counts)
+	palette_bins=np.flatnonzero(palette_counts)
+	print "%d source bins, %d palette bins" % (len(source_bins),len(palette_bins))
+
+	progress_phase(progress,"transport")
+	flow_sources,flow_palettes,amounts=solve_transport(source_counts[source_bins],palette_counts[palette_bins],
+		source_colors[source_bins],palette_colors[palette_bins])
+
+	progress_phase(progress,"keys")
+	#the bin of a pixel in the high bits of its key and its luminance (at most 255000, 18 bits) in the low ones
+	key=lambda pixels: (bin_codes(pixels,bits)<<18)|luminance(pixels.astype(np.int64))
+	records=[]
+	for name,raw in (("source",source),("palette",palette)):
+		path=os.path.join(workspace,name+".records")
+		write_records(raw,path,key,name=="palette",strip_size)
+		records.append(path)
+
+	progress_phase(progress,"sort")
+	n_pixels=source["rows"]*source["columns"]
+	source_records=external_sort(records[0],n_pixels,3*bits+18,workspace,strip_size)
+	palette_records=external_sort(records[1],n_pixels,3*bits+18,workspace,strip_size)
+
+	#source bins are visited in increasing order and each one takes its palette bins by increasing luminance
+	transfers=np.lexsort((luminance(palette_colors[palette_bins])[flow_palettes],flow_sources))
+	palette_cursor=np.concatenate(([0],np.cumsum(palette_counts[palette_bins])[:-1]))
+	source_cursor=0
+	ranges=[]
+	for t in transfers:
+		amount=int(amounts[t])
+		ranges.append((source_cursor,int(palette_cursor[flow_palettes[t]]),amount))
+		source_cursor+=amount
+		palette_cursor[flow_palettes[t]]+=amount
+	return source_records,palette_records,ranges
+
+#colour bin of each pixel, keeping the bits most significant bits of each channel
+def bin_codes(pixels,bits):
+	pixels=pixels.astype(np.int64)
+	shift=8-bits
+	return ((pixels[:,0]>>shift)<<(2*bits))|((pixels[:,1]>>shift)<<bits)|(pixels[:,2]>>shift)
+
+#number of pixels and mean colour of every bin of the 2^(3*bits) colour bins, empty bins included
+def histogram(raw,bits,strip_size):
+	n_pixels=raw["rows"]*raw["columns"]
+	counts=np.zeros(1<<(3*bits),dtype=np.int64)
+	sums=np.zeros((1<<(3*bits),3))
+	for first in xrange(0,n_pixels,strip_size):
+		pixels=read_pixels(raw,first,min(strip_size,n_pixels-first))
+		codes=bin_codes(pixels,bits)
+		counts+=np.bincount(codes,minlength=len(counts))
+		for channel in xrange(3):
+			sums[:,channel]+=np.bincount(codes,weights=pixels[:,channel],minlength=len(counts))
+	return counts,sums/np.maximum(counts,1)[:,np.newaxis]
+
+#writes the records of an image, the key of each pixel and a payload: its position, or for the palette its index and
+#its colour packed as index<<24|rgb so that the result can be written without going back to the palette
+#returns the number of bits of the largest key
+def write_records(raw,path,key_func,palette,strip_size):
+	n_pixels=raw["rows"]*raw["columns"]
+	largest=0
+	with open(path,"wb") as f:
+		for first in xrange(0,n_pixels,strip_size):
+			pixels=read_pixels(raw,first,min(strip_size,n_pixels-first))
+			records=np.empty((len(pixels),2),dtype=np.int64)
+			records[:,0]=key_func(pixels)
+			records[:,1]=np.arange(first,first+len(pixels))
+			if palette:
+				records[:,1]=(records[:,1]<<24)|(pixels[:,0].astype(np.int64)<<16)|(pixels[:,1].astype(np.int64)<<8)|pixels[:,2]
+			largest=max(largest,int(records[:,0].max()))
+			records.tofile(f)
+	return bit_length(largest)
+
+#stable sort of the n records of path by their key of key_bits bits, returns the path of the sorted records
+#least significant digit radix sort on disk, 8 bits per pass: the counts of every digit are taken in one read of the
+#file, then each pass reads the records strip by strip, sorts each strip by the digit and appends every run of a digit
+#where that digit's records go, so a pass is one sequential read and at most 256 sequential streams of writes
+#passes whose digit is the same for every record are skipped
+def external_sort(path,n,key_bits,workspace,strip_size,digit_bits=8):
+	n_passes=(key_bits+digit_bits-1)/digit_bits
+	mask=(1<<digit_bits)-1
+	counts=np.zeros((n_passes,1<<digit_bits),dtype=np.int64)
+	with open(path,"rb") as f:
+		for first in xrange(0,n,strip_size):
+			keys=read_records(f,first,min(strip_size,n-first))[:,0]
+			for p in xrange(n_passes):
+				counts[p]+=np.bincount((keys>>(p*digit_bits))&mask,minlength=1<<digit_bits)
+
+	for p in xrange(n_passes):
+		if np.count_nonzero(counts[p])<=1:
+			continue
+		handle,sorted_path=tempfile.mkstemp(prefix="sort_",dir=workspace)
+		os.close(handle)
+		offsets=np.concatenate(([0],np.cumsum(counts[p])[:-1]))
+		with open(path,"rb") as f:
+			with open(sorted_path,"wb") as out:
+				out.truncate(16*n)
+				for first in xrange(0,n,strip_size):
+					records=read_records(f,first,min(strip_size,n-first))
+					digits=(records[:,0]>>(p*digit_bits))&mask
+					by_digit=np.argsort(digits,kind="mergesort")
+					records=records[by_digit]
+					strip_counts=np.bincount(digits,minlength=1<<digit_bits)
+					ends=np.cumsum(strip_counts)
+					for digit in np.flatnonzero(strip_counts):
+						out.seek(16*offsets[digit])
+						records[ends[digit]-strip_counts[digit]:ends[digit]].tofile(out)
+					offsets+=strip_counts
+		if path.startswith(workspace):
+			os.remove(path)
+		path=sorted_path
+	return path
+
+#pairs the sorted source and palette records of every transfer into (position, palette payload) records
+def match_records(source_path,palette_path,transfers,path,strip_size):
+	with open(source_path,"rb") as source,open(palette_path,"rb") as palette,open(path,"wb") as out:
+		for source_first,palette_first,amount in transfers:
+			for done in xrange(0,amount,strip_size):
+				count=min(strip_size,amount-done)
+				pairs=read_records(source,source_first+done,count)
+				pairs[:,0]=pairs[:,1]
+				pairs[:,1]=read_records(palette,palette_first+done,count)[:,1]
+				pairs.tofile(out)
+	return path
+
+#writes the result as a PNG row strip by row strip from the (position, palette payload) records sorted by position,
+#and the order to order_path if given, returns the fitness (sum of the squared RGB differences with the source)
+def write_result(pairs_path,source,new_filename,order_path,strip_size,progress):
+	rows,columns=source["rows"],source["columns"]
+	strip_rows=max(1,strip_size/columns)
+	fitness=0
+	order=None
+	if order_path is not None:
+		order=open(order_path,"wb")
+		np.lib.format.write_array_header_1_0(order,{"descr":np.dtype(np.int64).str,"fortran_order":False,"shape":(rows*columns,)})
+
+	writer=start_png(new_filename,columns,rows)
+	try:
+		with open(pairs_path,"rb") as f:
+			for row in xrange(0,rows,strip_rows):
+				count=(min(rows,row+strip_rows)-row)*columns
+				payloads=read_records(f,row*columns,count)[:,1]
+				pixels=np.empty((count,3),dtype=np.uint8)
+				for channel in xrange(3):
+					pixels[:,channel]=(payloads>>(8*(2-channel)))&255
+				write_png_rows(writer,pixels.reshape(-1,columns,3))
+				if order is not None:
+					(payloads>>24).tofile(order)
+
+				delta=read_pixels(source,row*columns,count).astype(np.int64)-pixels
+				fitness+=int((delta*delta).sum())
+				progress_update(progress,done=row*columns+count)
+	finally:
+		finish_png(writer)
+		if order is not None:
+			order.close()
+	return fitness
+
+#PNG writer fed with row strips: 8-bit RGB, no filtering, one IDAT chunk per strip of compressed data
+def start_png(path,columns,rows):
+	f=open(path,"wb")
+	f.write("\x89PNG\r\n\x1a\n")
+	write_png_chunk(f,"IHDR",struct.pack(">IIBBBBB",columns,rows,8,2,0,0,0))
+	return {"file":f,"compressor":zlib.compressobj(6)}
+
+#every row starts with its filter type, 0 (none)
+def write_png_rows(writer,pixels):
+	rows=np.zeros((pixels.shape[0],1+3*pixels.shape[1]),dtype=np.uint8)
+	rows[:,1:]=pixels.reshape(pixels.shape[0],-1)
+	data=writer["compressor"].compress(rows.tobytes())
+	if data:
+		write_png_chunk(writer["file"],"IDAT",data)
+
+def finish_png(writer):
+	write_png_chunk(writer["file"],"IDAT",writer["compressor"].flush())
+	write_png_chunk(writer["file"],"IEND","")
+	writer["file"].close()
+
+def write_png_chunk(f,chunk_type,data):
+	f.write(struct.pack(">I",len(data))+chunk_type+data+struct.pack(">I",zlib.crc32(chunk_type+data)&0xffffffff))
+
+if __name__ == '__main__':
+	source="images/american_gothic.png"
+	palette="images/mona_lisa.png"
+
+	#algorithm parameters
+	method="rank"		#"rank" or "histogram"
+	rank_key="hilbert"	#key of the rank method, see source_palette_sort.rank_keys
+	bits=4				#bits kept per channel by the histogram method
+	budget=256<<20		#bytes of pixels in memory, uncompressed inputs (PPM, TIFF) and 8-bit PNG are never loaded whole
+	new_filename=palette.split(".")[0]+"_rearranged.png"
+
+	search(source,palette,new_filename,method,rank_key,bits,budget)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Permutation state - a solution as a typed index array over an immutable palette, with an undo log since the best
+"""
+
+from array import array
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#the state of a search: order[i] is the index of the palette pixel (or photo) placed at position i, an array('i') of
+#4 bytes per position instead of a list of pixel tuples, modified in place by the moves
+#log holds (position, previous index) for every change since the last mark_best, so the best solution is the current
+#order with the log undone and never has to be copied while searching
+#a search that keeps changing the order without ever marking a best or rolling back would grow the log forever: past
+#one entry per position it is cheaper to keep a copy of the best order, and changes are no longer logged until the
+#next mark_best or rollback
+def make_state(order,fitness):
+	order=array('i',order)
+	return {"order":order,"fitness":fitness,"best_fitness":fitness,"log":[],"best":None,"log_limit":max(1,len(order))}
+
+#logs the previous index of position, or replaces the log by a copy of the best order once it is too long
+def log_change(state,position,index):
+	if state["best"] is not None:
+		return
+	log=state["log"]
+	log.append((position,index))
+	if len(log)>state["log_limit"]:
+		state["best"]=undo_log(state["order"],log)
+		del log[:]
+
+#places index at position, the previous one is logged
+def state_set(state,position,index):
+	order=state["order"]
+	log_change(state,position,order[position])
+	order[position]=index
+
+#swaps the indices at positions i and j
+def state_swap(state,i,j):
+	order=state["order"]
+	log_change(state,i,order[i])
+	log_change(state,j,order[j])
+	order[i],order[j]=order[j],order[i]
+
+#the current order becomes the best one, O(1): only the log (or the copy) is dropped
+def mark_best(state):
+	state["best_fitness"]=state["fitness"]
+	del state["log"][:]
+	state["best"]=None
+
+#undoes every change since the last mark_best, O(changes), returns the positions that changed
+def rollback(state):
+	order=state["order"]
+	if state["best"] is not None:
+		best=state["best"]
+		positions=set(position for position in xrange(len(order)) if order[position]!=best[position])
+		order[:]=best
+		state["best"]=None
+	else:
+		positions=set()
+		for position,index in reversed(state["log"]):
+			order[position]=index
+			positions.add(position)
+		del state["log"][:]
+	state["fitness"]=state["best_fitness"]
+	return positions
+
+#copy of the best order, for snapshots, checkpoints and the final image
+def best_order(state):
+	if state["best"] is not None:
+		return array('i',state["best"])
+	return undo_log(state["order"],state["log"])
+
+#copy of order with the changes of log undone
+def undo_log(order,log):
+	order=array('i',order)
+	for position,index in reversed(log):
+		order[position]=index
+	return order
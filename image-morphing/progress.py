@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Progress and throughput telemetry - rate-limited reports for the hot loops of the morphing and photomosaic scripts
+"""
+
+import sys
+import json
+import time
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#the progress of a run is a dict of counters, updated by the search and reported at most every interval seconds
+#total is the number of steps of the run (pixels, blocks, iterations) when it is known, for the percentage and the ETA
+#with log_path every report is also appended to that file as a JSON line
+def make_progress(name,total=None,interval=1.0,log_path=None):
+	now=time.time()
+	return {"name":name,"total":total,"interval":interval,"start":now,"last_report":now,
+		"done":0,"evaluations":0,"accepted":0,"rejected":0,"best":None,"history":[],
+		"phase":None,"phase_start":now,"phases":[],"log":open(log_path,"a") if log_path is not None else None}
+
+#adds to the counters and reports when the last report is older than the interval
+#hot loops should call it every few hundred steps with the counts accumulated in between, not on every step
+def progress_update(progress,done=None,evaluations=0,accepted=0,rejected=0,best=None):
+	if done is not None:
+		progress["done"]=done
+	progress["evaluations"]+=evaluations
+	progress["accepted"]+=accepted
+	progress["rejected"]+=rejected
+	if best is not None:
+		#numpy scalars are not JSON serializable
+		progress["best"]=best.item() if hasattr(best,"item") else best
+
+	now=time.time()
+	if now-progress["last_report"]>=progress["interval"]:
+		progress_report(progress,now)
+
+#prints one line with the counters, rates and ETA, and records the best fitness over time
+def progress_report(progress,now=None,event="progress"):
+	if now is None:
+		now=time.time()
+	progress["last_report"]=now
+	elapsed=now-progress["start"]
+
+	record={"event":event,"name":progress["name"],"phase":progress["phase"],"elapsed":round(elapsed,3),
+		"done":progress["done"],"total":progress["total"],"evaluations":progress["evaluations"],
+		"evaluations_per_second":round(progress["evaluations"]/elapsed,1) if elapsed>0 else None,
+		"accepted":progress["accepted"],"rejected":progress["rejected"],"best":progress["best"],"eta":None}
+
+	line=progress["name"]
+	if progress["phase"] is not None:
+		line+=" ["+progress["phase"]+"]"
+	if progress["total"]:
+		fraction=progress["done"]/float(progress["total"])
+		line+=" %.2f%%" % (fraction*100)
+		if fraction>0:
+			record["eta"]=round(elapsed*(1-fraction)/fraction,1)
+			line+=" eta %.0fs" % record["eta"]
+	if progress["evaluations"]:
+		line+=" evaluations %d (%.0f/s)" % (progress["evaluations"],record["evaluations_per_second"] or 0)
+	if progress["accepted"] or progress["rejected"]:
+		line+=" accepted %d rejected %d" % (progress["accepted"],progress["rejected"])
+	if progress["best"] is not None:
+		progress["history"].append((round(elapsed,3),progress["best"]))
+		line+=" best fitness "+str(progress["best"])
+	print line
+	sys.stdout.flush()
+
+	write_record(progress,record)
+
+#closes the current phase (if any) and starts a new one, e.g. "cost build", "search", "render"
+def progress_phase(progress,phase):
+	now=time.time()
+	if progress["phase"] is not None:
+		seconds=now-progress["phase_start"]
+		progress["phases"].append((progress["phase"],seconds))
+		print "%s [%s] done in %.2fs" % (progress["name"],progress["phase"],seconds)
+		write_record(progress,{"event":"phase","name":progress["name"],"phase":progress["phase"],"seconds":round(seconds,3)})
+	progress["phase"]=phase
+	progress["phase_start"]=now
+
+#closes the last phase, writes a last report and a summary with the time of each phase and the best fitness over time
+def progress_finish(progress):
+	progress_phase(progress,None)
+	progress_report(progress,event="final")
+	write_record(progress,{"event":"summary","name":progress["name"],"elapsed":round(time.time()-progress["start"],3),
+		"phases":progress["phases"],"history":progress["history"]})
+	if progress["log"] is not None:
+		progress["log"].close()
+		progress["log"]=None
+
+#appends a record to the JSON lines log
+def write_record(progress,record):
+	if progress["log"] is not None:
+		progress["log"].write(json.dumps(record)+"\n")
+		progress["log"].flush()
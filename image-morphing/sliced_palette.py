@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sliced optimal transport - Morphing an image into another with the same color palette - Just for fun
+"""
+
+import time
+import numpy as np
+from PIL import Image
+from scipy.spatial import cKDTree
+from lab_lut import rgb_to_lab
+from color_index import greedy_match
+from pyramid_palette import fitness,build_final_solution
+from progress import make_progress,progress_update,progress_phase,progress_finish
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#moves the source colours towards the palette colours one random direction at a time, then gives every position the
+#palette pixel closest to where its colour ended up
+#lab=True transports the L*ab coordinates instead of the RGB ones
+def search(source_im,palette_im,n_iterations,step,lab,new_filename,seed=None,progress=None):
+	columns,rows=source_im.size
+	source_pixels=np.asarray(source_im.convert("RGB")).reshape(-1,3)
+	palette_pixels=np.asarray(palette_im.convert("RGB")).reshape(-1,3)
+	assert len(palette_pixels)==rows*columns, "source and palette must have the same number of pixels"
+	if progress is None:
+		progress=make_progress("sliced",n_iterations)
+
+	start=time.time()
+	new_palette_order=sliced_order(source_pixels,palette_pixels,n_iterations,lab,step,seed=seed,progress=progress)
+	print "sliced transport solved in %.2fs" % (time.time()-start)
+
+	print "Fitness achieved: "+str(fitness(source_pixels.astype(np.int64),palette_pixels[new_palette_order].astype(np.int64)))
+	progress_phase(progress,"render")
+	build_final_solution(source_im,palette_im,new_palette_order,new_filename)
+	progress_finish(progress)
+
+#new_palette_order[i] is the index of the palette pixel placed at the ith position
+#each iteration projects the transported source colours and the palette colours on a random direction, sorts both
+#projections and moves the ith lowest source colour along the direction to the ith lowest palette projection
+#(the exact 1-D optimal transport), so an iteration is two sorts of n floats whatever the size of the image
+#the accumulated moves approximate the optimal transport of the source colours onto the palette colours, and are
+#snapped back to a permutation of the palette by a greedy nearest colour matching
+#each move is only a fraction step of the 1-D transport: with step=1 the first directions decide most of the map and
+#the result depends a lot on the seed, small steps average many directions (a gradient flow of the sliced distance)
+def sliced_order(source_pixels,palette_pixels,n_iterations=256,lab=False,step=0.1,seed=None,progress=None):
+	if lab:
+		source_colors=rgb_to_lab(source_pixels).astype(np.float32)
+		palette_colors=rgb_to_lab(palette_pixels).astype(np.float32)
+	else:
+		source_colors=np.asarray(source_pixels,dtype=np.float32)
+		palette_colors=np.asarray(palette_pixels,dtype=np.float32)
+
+	random_state=np.random.RandomState(seed)
+	if progress is not None:
+		progress_phase(progress,"transport")
+	transported=sliced_transport(source_colors,palette_colors,n_iterations,random_state,step,progress)
+
+	if progress is not None:
+		progress_phase(progress,"snap")
+	return snap_to_palette(transported,palette_colors,random_state)
+
+#transports a copy of the source colours onto the palette colours, one random direction per iteration
+#the directions are drawn as random orthonormal bases, so every three iterations cover the whole colour space
+def sliced_transport(source_colors,palette_colors,n_iterations,random_state,step=0.1,progress=None):
+	transported=source_colors.copy()
+	shift=np.empty(len(transported),dtype=np.float32)
+
+	for iteration in xrange(n_iterations):
+		if iteration%3==0:
+			basis,_=np.linalg.qr(random_state.normal(size=(3,3)))
+		direction=basis[:,iteration%3].astype(np.float32)
+
+		projection=transported.dot(direction)
+		ranks=np.argsort(projection)
+		shift[ranks]=np.sort(palette_colors.dot(direction))-projection[ranks]
+		transported+=step*shift[:,np.newaxis]*direction
+
+		if progress is not None:
+			progress_update(progress,done=iteration+1,evaluations=len(transported))
+
+	return transported
+
+#palette index of the colour closest to each transported colour, every palette colour being taken once
+#the positions are matched greedily in a random order, the greedy matching would otherwise favour the top of the image
+#a sequential greedy matching slows down on the last positions of a large image, whose neighbours are all taken, so
+#while more than exact_size positions are left the matching goes in vectorized rounds: every position asks for its k
+#nearest remaining colours, each colour is given to as many of the positions asking for it as it has pixels left, the
+#ones visited first, and the positions left over try again against the colours left over; the last exact_size
+#positions go through color_index.greedy_match
+#the rounds work on the distinct palette colours with the count of their pixels left, a flat palette is a handful of
+#points for the k-d tree instead of thousands of copies of the same one
+def snap_to_palette(transported,palette_colors,random_state,k=8,exact_size=1<<16):
+	priority=random_state.permutation(len(transported))
+	new_palette_order=np.empty(len(transported),dtype=np.int64)
+	positions=np.arange(len(transported))
+
+	keys=np.ascontiguousarray(palette_colors).view([("",palette_colors.dtype)]*3).ravel()
+	_,first,labels,counts=np.unique(keys,return_index=True,return_inverse=True,return_counts=True)
+	#the pixels of each distinct colour, handed out from next_pixel onwards
+	members=np.argsort(labels,kind="mergesort")
+	next_pixel=np.concatenate(([0],np.cumsum(counts)[:-1]))
+	colors=np.arange(len(first))
+
+	while len(positions)>exact_size:
+		n_candidates=min(k,len(colors))
+		_,candidates=cKDTree(palette_colors[first[colors]]).query(transported[positions],n_candidates)
+		candidates=colors[candidates.reshape(len(positions),n_candidates)]
+		matched=np.zeros(len(positions),dtype=bool)
+		for rank in xrange(n_candidates):
+			askers=np.flatnonzero(~matched&(counts[candidates[:,rank]]>0))
+			asked=candidates[askers,rank]
+			by_color=np.lexsort((priority[positions[askers]],asked))
+			asked=asked[by_color]
+			#place of each asker in the queue of its colour, the first counts[colour] ones get a pixel
+			group_starts=np.flatnonzero(np.concatenate(([True],asked[1:]!=asked[:-1])))
+			places=np.arange(len(asked))-np.repeat(group_starts,np.diff(np.append(group_starts,len(asked))))
+			won=places<counts[asked]
+			winners=askers[by_color[won]]
+
+			new_palette_order[positions[winners]]=members[next_pixel[asked[won]]+places[won]]
+			matched[winners]=True
+			given=np.bincount(asked[won],minlength=len(counts))
+			next_pixel+=given
+			counts-=given
+		positions=positions[~matched]
+		colors=colors[counts[colors]>0]
+
+	if len(positions):
+		visit=positions[np.argsort(priority[positions])]
+		left=np.concatenate([members[next_pixel[c]:next_pixel[c]+counts[c]] for c in colors])
+		new_palette_order[visit]=left[greedy_match(transported[visit],palette_colors[left])]
+	return new_palette_order
+
+if __name__ == '__main__':
+	sources=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
+	palettes=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
+	source=sources[0]
+	palette=palettes[2]
+
+	#algorithm parameters
+	source_im=Image.open(source)
+	palette_im=Image.open(palette)
+	n_iterations=256	#random directions, each one costs two sorts of n floats
+	step=0.1			#fraction of the 1-D transport applied per direction
+	lab=False			#transport the L*ab coordinates instead of the RGB ones
+	new_filename=palette.split(".")[0]+"_rearranged.png"
+
+	search(source_im,palette_im,n_iterations,step,lab,new_filename)
@@ -9,20 +9,26 @@ import random
 from math import log
 from copy import deepcopy
 from operator import itemgetter
+import numpy as np
 from PIL import Image
-from colormath.color_conversions import convert_color
-from colormath.color_objects import LabColor,sRGBColor
-from colormath.color_diff import delta_e_cie1976
+from lab_lut import colordiff_lab,rgb_to_lab
+from color_index import greedy_match
+from kernels import colordiff_rgb,average_color,report_backend
+from progress import make_progress,progress_update,progress_phase,progress_finish
 
 __author__ = 'Alexandre Pinto'
 __email__ = "alexandpinto@gmail.com"
 __date__='2014'
 
-def search(source_im,palette_im,colordiff,new_filename):
+#progress (see progress.make_progress) receives the rate-limited reports, one is created when it is not given
+def search(source_im,palette_im,colordiff,new_filename,progress=None):
 
 	columns=source_im.size[0]
 	rows=source_im.size[1]
 	size=columns*rows
+	if progress is None:
+		progress=make_progress("bf",size)
+	progress_phase(progress,"search")
 
 	#pixels
 	source_pixels=list(source_im.getdata())
@@ -35,7 +41,7 @@ def search(source_im,palette_im,colordiff,new_filename):
 
 
 	for i in xrange(size):
-		print "%.2f " % (i/float(size)*100)+"%"
+		progress_update(progress,done=i,evaluations=len(current_palete_order))
 		best_order=current_palete_order[0]
 		index=0
 		best_index=0
@@ -51,10 +57,39 @@ def search(source_im,palette_im,colordiff,new_filename):
 		del current_palete_order[best_index]
 		random.shuffle(current_palete_order)
 
+	progress_update(progress,done=size)
+	progress_phase(progress,"render")
 	build_final_solution(source_im,palette_im,new_palette_order,new_filename)
+	progress_finish(progress)
+
+#same greedy matching as search, but the closest remaining palette pixel is found with a k-d tree over the distinct
+#palette colours instead of a linear scan, each colour keeps a count of its pixels left (see color_index)
+def search_index(source_im,palette_im,colordiff,new_filename,progress=None):
+	if progress is None:
+		progress=make_progress("bf index",source_im.size[0]*source_im.size[1])
+	progress_phase(progress,"index build")
+
+	#pixels, as coordinates of the space the colour difference is measured in
+	source_pixels=list(source_im.getdata())
+	palette_pixels=list(palette_im.getdata())
+	if colordiff==colordiff_lab:
+		source_pixels=rgb_to_lab(source_pixels)
+		palette_pixels=rgb_to_lab(palette_pixels)
+	else:
+		source_pixels=[pixel[:3] for pixel in source_pixels]
+		palette_pixels=[pixel[:3] for pixel in palette_pixels]
+
+	progress_phase(progress,"search")
+	new_palette_order=greedy_match(source_pixels,palette_pixels,progress=lambda done,size: progress_update(progress,done=done))
+	progress_update(progress,done=len(new_palette_order))
+
+	progress_phase(progress,"render")
+	build_final_solution(source_im,palette_im,new_palette_order,new_filename)
+	progress_finish(progress)
 
 #generates the new palette with the same dimensions as the source but with its own colours
-def build_final_solution(source_im,palette_pixels,new_palette_order,new_filename):
+#new_palette_order[i] is the index of the palette pixel placed at the ith position
+def build_final_solution(source_im,palette_im,new_palette_order,new_filename):
 
 	source_size=source_im.size
 
@@ -66,49 +101,14 @@ def build_final_solution(source_im,palette_pixels,new_palette_order,new_filename
 
 	new_palette_pixels=[]
 	for n in new_palette_order:
-		new_palette_pixels+=[palette_pixels[new_palette_order[n]]]
+		new_palette_pixels+=[palette_pixels[n]]
 	
 	new_palette.putdata(new_palette_pixels)
 	new_palette.save(new_filename)
 
 #returns the average RGB color of a given image
 def avg_color(im):
-	avg_r=avg_g=avg_b=0.0
-	pixels=im.getdata()
-	size=len(pixels)
-	for p in pixels:
-		avg_r+=p[0]/float(size)
-		avg_g+=p[1]/float(size)
-		avg_b+=p[2]/float(size)
-
-	return (avg_r,avg_g,avg_b)
-
-#calculate color difference of two pixels in the RGB space
-#less is better
-def colordiff_rgb(pixel1,pixel2):
-
-	delta_red=pixel1[0]-pixel2[0]
-	delta_green=pixel1[1]-pixel2[1]
-	delta_blue=pixel1[2]-pixel2[2]
-
-	fit=delta_red**2+delta_green**2+delta_blue**2
-	return fit
-
-#http://python-colormath.readthedocs.org/en/latest/index.html
-#calculate color difference of two pixels in the L*ab space
-#less is better
-def colordiff_lab(pixel1,pixel2):
-
-	#convert rgb values to L*ab values
-	rgb_pixel_1=sRGBColor(pixel1[0],pixel1[1],pixel1[2],True)
-	lab_1= convert_color(rgb_pixel_1, LabColor)
-
-	rgb_pixel_2=sRGBColor(pixel2[0],pixel2[1],pixel2[2],True)
-	lab_2= convert_color(rgb_pixel_2, LabColor)
-
-	#calculate delta e
-	delta_e = delta_e_cie1976(lab_1, lab_2)
-	return delta_e
+	return average_color(np.asarray(im))
 
 if __name__ == '__main__':
 	sources=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
@@ -123,6 +123,11 @@ if __name__ == '__main__':
 	source_im=Image.open(source)
 	palette_im=Image.open(palette)
 	colordiff=colordiff_rgb
+	use_index=True		#k-d tree index instead of the O(n^2) linear scan
 	new_filename=palette.split(".")[0]+"_rearranged.png"
 
-	search(source_im,palette_im,colordiff,new_filename)
\ No newline at end of file
+	report_backend()
+	if use_index:
+		search_index(source_im,palette_im,colordiff,new_filename)
+	else:
+		search(source_im,palette_im,colordiff,new_filename)
\ No newline at end of file
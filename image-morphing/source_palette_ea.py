@@ -6,32 +6,58 @@ Genetic Algorithm - Morphing an image into another with the same color palette -
 """
 
 import random
+import ctypes
 from operator import itemgetter
+from multiprocessing import Pool,Process,Queue,Event
+from Queue import Empty
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
 from PIL import Image
-from colormath.color_diff import delta_e_cie1976
-from colormath.color_conversions import convert_color
-from colormath.color_objects import LabColor,sRGBColor
+from lab_lut import colordiff_lab_array,rgb_to_lab
+import kernels
+from anytime import make_budget,budget_exhausted,start_snapshot_writer,snapshot_due,submit_snapshot,stop_snapshot_writer
+from checkpoint import make_checkpointer,checkpoint_due,save_checkpoint,load_checkpoint
+from progress import make_progress,progress_update,progress_phase,progress_finish
 
 __author__ = 'Alexandre Pinto'
 __email__ = "alexandpinto@gmail.com"
 __date__='2014'
 
 #evolutionary algorithm: finding the best permutation of pixels that gives the best approximation to a given source image
-def ea(source_im,palette_im,n_generations,size_pop,selection,tournament_size,recombination_func,prob_cross,survivors,fitness_func,elite_size):
+#anytime: stops after n_generations (None for no limit), once deadline seconds have passed or when the best fitness
+#reaches target_fitness, with snapshot_interval the best-so-far image is written every snapshot_interval seconds
+#by a background thread
+#with checkpoint_path the population is saved there every checkpoint_interval seconds, and resumed from it if it exists
+#progress (see progress.make_progress) receives the rate-limited reports, one is created when it is not given
+def ea(source_im,palette_im,n_generations,size_pop,selection,tournament_size,recombination_func,prob_cross,survivors,fitness_func,elite_size,deadline=None,target_fitness=None,snapshot_interval=None,checkpoint_path=None,checkpoint_interval=600,progress=None):
+	if progress is None:
+		progress=make_progress("ea",n_generations)
+
+	checkpoint=load_checkpoint(checkpoint_path)
+	if checkpoint is not None:
+		population,j=resume_ea(checkpoint)
+	else:
+		progress_phase(progress,"initialization")
+		population = [[generate_palette(source_im,palette_im),0] for j in range(size_pop)]			#initialize population
+		population = [[indiv[0], fitness_func(source_im,indiv[0])] for indiv in population]			#evaluate population
 
-	print "initializing population"
-	population = [[generate_palette(source_im,palette_im),0] for j in range(size_pop)]			#initialize population
-	population = [[indiv[0], fitness_func(source_im,indiv[0])] for indiv in population]			#evaluate population
+		population.sort(key=itemgetter(1), reverse = False) # Minimizing
+		progress_update(progress,evaluations=size_pop,best=population[0][1])
+		j=0
+	checkpointer=make_checkpointer(checkpoint_path,checkpoint_interval)
 
-	print "sorting initial population\n\n"
-	population.sort(key=itemgetter(1), reverse = False) # Minimizing
+	budget=make_budget(deadline,target_fitness)
+	writer=None
+	if snapshot_interval is not None:
+		writer=start_snapshot_writer("best_palette.png",snapshot_interval,lambda im,path: im.save(path))
 
 	print "This may take a while ... have a break, have a kitkat \n"
-	for j in range(n_generations):
-		print "\n\ngeneration: "+str(j)
+	progress_phase(progress,"search")
+	while (n_generations is None or j<n_generations) and not budget_exhausted(budget,population[0][1]):
 		mate_pool=selection(population,tournament_size)
 
-		print "recombination ..."
 		offspring_pop=[]
 		for i in  range(0,size_pop-1,2):
 			cromo_1= mate_pool[i][0]
@@ -39,22 +65,44 @@ def ea(source_im,palette_im,n_generations,size_pop,selection,tournament_size,rec
 			offsprings = recombination_func(cromo_1,cromo_2,prob_cross)
 			offspring_pop.extend(offsprings)
 
-		print "evaluating offspring and sorting..."			
 		offspring_pop = [ [indiv[0], fitness_func(source_im,indiv[0])] for indiv in offspring_pop]	#evaluate new population
 		offspring_pop.sort(key=itemgetter(1), reverse = False)									#sorting,minimization
 
-		print "surviving ..."
 		population = survivors(population,offspring_pop,elite_size)
+		population.sort(key=itemgetter(1), reverse = False)					#survivors keep their fitness
 
-		print "evaluating final population and sorting ..."
-		population = [[indiv[0], fitness_func(source_im,indiv[0])] for indiv in population]
-		population.sort(key=itemgetter(1), reverse = False)
+		progress_update(progress,done=j+1,evaluations=len(offspring_pop),best=population[0][1])
 
-		print "current best fitness: "+str(population[0][1])
+		if snapshot_due(writer):
+			submit_snapshot(writer,population[0][0].copy())
+		j+=1
 
-	print "\n\ndone!"
+		if checkpoint_due(checkpointer):
+			checkpoint_ea(checkpointer,population,j)
+
+	stop_snapshot_writer(writer)
+	if checkpointer is not None:
+		checkpoint_ea(checkpointer,population,j)
+
+	progress_phase(progress,"render")
 	best=population[0][0]
 	best.save("best_palette.png");
+	progress_finish(progress)
+	return population[0]
+
+#saves the population of ea as one array of images, with their fitness, the generation and the random state
+def checkpoint_ea(checkpointer,population,generation):
+	save_checkpoint(checkpointer,{"population":np.array([np.asarray(indiv[0]) for indiv in population]),"fitnesses":np.array([indiv[1] for indiv in population])},
+		{"generation":generation,"random_state":random.getstate()})
+
+#restores the population saved by checkpoint_ea, returns it and the generation
+def resume_ea(checkpoint):
+	arrays,state=checkpoint
+	random.setstate(state["random_state"])
+	print "resuming from generation "+str(state["generation"])
+
+	population=[[Image.fromarray(np.array(arrays["population"][k])),float(arrays["fitnesses"][k])] for k in xrange(len(arrays["fitnesses"]))]
+	return population,state["generation"]
 
 #generates a new individual(palette) with the same dimensions as the source but with its own colours
 def generate_palette(source_im,palette_im):
@@ -87,20 +135,21 @@ def tournament(population,size):
     return pool[0]
 
 #uniform crossover
+#note: swapping pixels position-wise does not keep the palette, the permutation crossovers of the array engine do
 def uniform_cross(parent1_im,parent2_im,prob_cross):
 	parent1_pixels=list(parent1_im.getdata())
 	parent2_pixels=list(parent2_im.getdata())
 
-	if(random.random<prob_cross):
+	if(random.random()<prob_cross):
 		offspring1_pixels=[]
 		offspring2_pixels=[]
-		for i in xrange(len(parent1_im)):
+		for i in xrange(len(parent1_pixels)):
 			if(random.random()<0.5):
 				offspring1_pixels+=[parent1_pixels[i]]
 				offspring2_pixels+=[parent2_pixels[i]]
 			else:
-				offspring2_pixels+=[parent2_pixels[i]]
-				offspring1_pixels+=[parent1_pixels[i]]
+				offspring1_pixels+=[parent2_pixels[i]]
+				offspring2_pixels+=[parent1_pixels[i]]
 
 		offspring1_im=Image.new(parent1_im.mode,(parent1_im.size[0],parent1_im.size[1]))
 		offspring1_im.putdata(offspring1_pixels)
@@ -118,49 +167,423 @@ def survivors_elitism(parents,offspring,elite_size):
     new_population = parents[:comp_elite] + offspring[:size - comp_elite]
     return new_population
 
-#http://python-colormath.readthedocs.org/en/latest/index.html
 #calculate the fitness of an individual, based on the color differences in the L*ab space
 #the less the better
-#pros: better results, cons: very slow
+#pros: better results, the L*ab values come from the precomputed lookup table so it is no longer slow
 def fitness_lab(source_im,palette_im):
 	source_pixels=list(source_im.getdata())
 	palette_pixels=list(palette_im.getdata())
 
-	fit=0.0
-	for i in xrange(len(palette_pixels)):
-		#convert rgb values to L*ab values
-		rgb_pixel_source=sRGBColor(source_pixels[i][0],source_pixels[i][1],source_pixels[i][2],True)
-		lab_source= convert_color(rgb_pixel_source, LabColor)
-
-		rgb_pixel_palette=sRGBColor(palette_pixels[i][0],palette_pixels[i][1],palette_pixels[i][2],True)
-		lab_palette= convert_color(rgb_pixel_palette, LabColor)
-
-		#calculate delta e
-		delta_e = delta_e_cie1976(lab_source, lab_palette)
-
-		fit+=delta_e
-
-	return fit
+	return float(colordiff_lab_array(source_pixels,palette_pixels).sum())
 
 #rgb distance between two colors
-#pros: very fast 
+#pros: very fast, the sum runs in the kernels of kernels.py
 def fitness_rgb(source_im,palette_im):
-	source_pixels=list(source_im.getdata())
-	palette_pixels=list(palette_im.getdata())
-
-	fit=0.0
-	for i in xrange(len(palette_pixels)):
-		delta_red=source_pixels[i][0]-palette_pixels[i][0]
-		delta_green=source_pixels[i][1]-palette_pixels[i][1]
-		delta_blue=source_pixels[i][2]-palette_pixels[i][2]
+	return kernels.fitness_rgb(np.asarray(source_im),np.asarray(palette_im))
+
+#evolutionary algorithm on arrays: the population is one (size_pop,n_pixels) matrix of permutations of the palette pixels
+#and the source a fixed uint8 array, images are only built for the final best_palette.png
+#with n_workers>1 the fitness of each generation is computed by a pool of processes sharing the pixels in memory
+#initial_order (e.g. from source_palette_sort.rank_order) is seeded in the initial population
+#deadline, target_fitness, snapshot_interval, checkpoint_path, checkpoint_interval and progress work as in ea
+def ea_array(source_im,palette_im,n_generations,size_pop,tournament_size,recombination_func,prob_cross,mutation_func,prob_mut,fitness_func,elite_size,seed=None,n_workers=1,initial_order=None,deadline=None,target_fitness=None,snapshot_interval=None,checkpoint_path=None,checkpoint_interval=600,progress=None):
+	if progress is None:
+		progress=make_progress("ea",n_generations)
+	rng=np.random.RandomState(seed)
+	source_pixels=image_to_array(source_im)
+	palette_pixels=image_to_array(palette_im)
+
+	pool=None
+	writer=None
+	if n_workers>1:
+		pool,fitness_func=parallel_fitness(fitness_func,source_pixels,palette_pixels,size_pop,n_workers)
+
+	checkpoint=load_checkpoint(checkpoint_path)
+	try:
+		if checkpoint is not None:
+			population,fitnesses,j=resume_ea_array(checkpoint,rng)
+		else:
+			progress_phase(progress,"initialization")
+			population=np.array([rng.permutation(len(palette_pixels)) for j in xrange(size_pop)],dtype=np.int32)
+			if initial_order is not None:
+				population[0]=initial_order
+			fitnesses=fitness_func(source_pixels,palette_pixels,population)
+			population,fitnesses=sort_population(population,fitnesses)
+			progress_update(progress,evaluations=size_pop,best=fitnesses[0])
+			j=0
+		checkpointer=make_checkpointer(checkpoint_path,checkpoint_interval)
+
+		budget=make_budget(deadline,target_fitness)
+		if snapshot_interval is not None:
+			writer=start_snapshot_writer("best_palette.png",snapshot_interval,lambda order,path: build_image(source_im,palette_pixels[order]).save(path))
+
+		progress_phase(progress,"search")
+		while (n_generations is None or j<n_generations) and not budget_exhausted(budget,fitnesses[0]):
+			population,fitnesses=ea_generation(source_pixels,palette_pixels,population,fitnesses,tournament_size,recombination_func,prob_cross,mutation_func,prob_mut,fitness_func,elite_size,rng)
+			progress_update(progress,done=j+1,evaluations=size_pop-size_pop%2,best=fitnesses[0])
+
+			if snapshot_due(writer):
+				submit_snapshot(writer,population[0].copy())
+			j+=1
+
+			if checkpoint_due(checkpointer):
+				checkpoint_ea_array(checkpointer,population,fitnesses,j,rng)
+
+		if checkpointer is not None:
+			checkpoint_ea_array(checkpointer,population,fitnesses,j,rng)
+	finally:
+		stop_snapshot_writer(writer)
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+
+	progress_phase(progress,"render")
+	build_image(source_im,palette_pixels[population[0]]).save("best_palette.png")
+	progress_finish(progress)
+	return population,fitnesses
+
+#saves the population matrix of the array engine, its fitness, the generation and the state of rng
+def checkpoint_ea_array(checkpointer,population,fitnesses,generation,rng):
+	save_checkpoint(checkpointer,{"population":population,"fitnesses":fitnesses},{"generation":generation,"rng_state":rng.get_state()})
+
+#restores the state saved by checkpoint_ea_array into rng, the population stays memory-mapped until it is replaced
+#by the first generation
+def resume_ea_array(checkpoint,rng):
+	arrays,state=checkpoint
+	rng.set_state(state["rng_state"])
+	print "resuming from generation "+str(state["generation"])+": current best fitness: "+str(arrays["fitnesses"][0])
+	return arrays["population"],np.asarray(arrays["fitnesses"]),state["generation"]
+
+#island model: n_islands populations evolve in their own process with the array engine, and every migration_interval
+#generations the n_migrants best individuals of each island replace the worst ones of the next island on a ring
+#island i is seeded with seed+i and waits for its migrants, so a run is reproducible from the seed
+#deadline and target_fitness work as in ea, n_generations may be None: the islands stop together at a migration, one
+#interval after the budget of any of them is exhausted at the latest (at the first generation without migrants)
+#an island that dies takes the others down with it and the error is raised, instead of waiting for its result forever
+def ea_islands(source_im,palette_im,n_islands,n_generations,size_pop,tournament_size,recombination_func,prob_cross,mutation_func,prob_mut,fitness_func,elite_size,migration_interval,n_migrants,seed=0,deadline=None,target_fitness=None):
+	source_pixels=image_to_array(source_im)
+	palette_pixels=image_to_array(palette_im)
+	budget=make_budget(deadline,target_fitness)
+
+	#inboxes[i] receives the migrants of island i-1, the pixels are inherited by the forked islands
+	inboxes=[Queue() for i in xrange(n_islands)]
+	results=Queue()
+	stop_requested=Event()
+	islands=[Process(target=run_island,args=(i,source_pixels,palette_pixels,n_generations,size_pop,tournament_size,recombination_func,prob_cross,mutation_func,prob_mut,fitness_func,elite_size,migration_interval,n_migrants,seed+i,inboxes[i],inboxes[(i+1)%n_islands],results,budget,stop_requested)) for i in xrange(n_islands)]
+	for island in islands:
+		island.start()
+
+	best_fitnesses=[None]*n_islands
+	best=None
+	try:
+		for i in xrange(n_islands):
+			island,fitness,individual=wait_island(islands,best_fitnesses,results)
+			best_fitnesses[island]=fitness
+			if best is None or fitness<best[0]:
+				best=(fitness,individual)
+	finally:
+		#the others are blocked on the migrants of a dead island
+		for island in islands:
+			if island.is_alive() and None in best_fitnesses:
+				island.terminate()
+		for island in islands:
+			island.join()
 
-		fit+=delta_red**2+delta_green**2+delta_blue**2
-	return fit
-
-def check(palette, copy):
-    palette = sorted(Image.open(palette).convert('RGB').getdata())
-    copy = sorted(Image.open(copy).convert('RGB').getdata())
-    print 'Success' if copy == palette else 'Failed'
+	print "\n\ndone!"
+	for i in xrange(n_islands):
+		print "island "+str(i)+": best fitness: "+str(best_fitnesses[i])
+	build_image(source_im,palette_pixels[best[1]]).save("best_palette.png")
+	return best_fitnesses
+
+#next result of the islands, polled so that an island which died before reporting raises instead of blocking
+def wait_island(islands,best_fitnesses,results):
+	while True:
+		try:
+			return results.get(timeout=1)
+		except Empty:
+			for i in xrange(len(islands)):
+				if best_fitnesses[i] is None and not islands[i].is_alive() and results.empty():
+					raise RuntimeError("island "+str(i)+" exited with code "+str(islands[i].exitcode))
+
+#evolves one island and exchanges migrants with its neighbours, reports its best individual at the end
+#island 0 decides at each migration whether the islands stop there (its budget is exhausted or another island asked
+#for it through stop_requested) and the decision goes around the ring with the migrants: island 0 sends first and the
+#others receive before sending, so they all stop at the same migration and nobody waits for migrants that never come
+def run_island(island,source_pixels,palette_pixels,n_generations,size_pop,tournament_size,recombination_func,prob_cross,mutation_func,prob_mut,fitness_func,elite_size,migration_interval,n_migrants,seed,inbox,outbox,results,budget,stop_requested):
+	rng=np.random.RandomState(seed)
+	progress=make_progress("island "+str(island),n_generations)
+	migrating=n_migrants>0 and inbox is not outbox
+
+	population=np.array([rng.permutation(len(palette_pixels)) for j in xrange(size_pop)],dtype=np.int32)
+	fitnesses=fitness_func(source_pixels,palette_pixels,population)
+	population,fitnesses=sort_population(population,fitnesses)
+
+	j=0
+	stop=False
+	while (n_generations is None or j<n_generations) and not stop:
+		population,fitnesses=ea_generation(source_pixels,palette_pixels,population,fitnesses,tournament_size,recombination_func,prob_cross,mutation_func,prob_mut,fitness_func,elite_size,rng)
+		if budget_exhausted(budget,fitnesses[0]):
+			stop_requested.set()
+
+		if not migrating:
+			stop=stop_requested.is_set()
+		elif (j+1)%migration_interval==0:
+			emigrants=(population[:n_migrants].copy(),fitnesses[:n_migrants].copy())
+			if island==0:
+				stop=stop_requested.is_set()
+				outbox.put(emigrants+(stop,))
+				migrants,migrant_fitnesses,_=inbox.get()
+			else:
+				migrants,migrant_fitnesses,stop=inbox.get()
+				outbox.put(emigrants+(stop,))
+			population[-n_migrants:]=migrants
+			fitnesses[-n_migrants:]=migrant_fitnesses
+			population,fitnesses=sort_population(population,fitnesses)
+
+		j+=1
+		progress_update(progress,done=j,evaluations=size_pop-size_pop%2,best=fitnesses[0])
+
+	progress_finish(progress)
+	results.put((island,fitnesses[0],population[0]))
+
+#one generation of the array engine: tournament selection, recombination, mutation and elitism
+#the population must be sorted by fitness, the returned one is sorted too and its fitness is never recomputed
+def ea_generation(source_pixels,palette_pixels,population,fitnesses,tournament_size,recombination_func,prob_cross,mutation_func,prob_mut,fitness_func,elite_size,rng):
+	size_pop=len(population)
+	mate_pool=tournament_selection_array(size_pop,tournament_size,rng)
+
+	offspring_pop=np.empty((size_pop-size_pop%2,population.shape[1]),dtype=population.dtype)
+	for i in xrange(0,size_pop-1,2):
+		offspring_pop[i],offspring_pop[i+1]=recombination_func(population[mate_pool[i]],population[mate_pool[i+1]],prob_cross,rng)
+		mutation_func(offspring_pop[i],prob_mut,rng)
+		mutation_func(offspring_pop[i+1],prob_mut,rng)
+
+	offspring_fitnesses=fitness_func(source_pixels,palette_pixels,offspring_pop)
+	offspring_pop,offspring_fitnesses=sort_population(offspring_pop,offspring_fitnesses)
+
+	comp_elite=int(size_pop*elite_size)
+	population=np.concatenate((population[:comp_elite],offspring_pop[:size_pop-comp_elite]))
+	fitnesses=np.concatenate((fitnesses[:comp_elite],offspring_fitnesses[:size_pop-comp_elite]))
+	return sort_population(population,fitnesses)
+
+#shared memory views of a fitness worker, set once by init_fitness_worker
+worker_state={}
+
+#fitness evaluation in a pool of processes: the source, the palette and the individuals to evaluate live in shared memory,
+#so only row ranges and fitness values go through the pipes and no image is ever pickled
+#returns the pool and a function with the same signature as fitness_func
+def parallel_fitness(fitness_func,source_pixels,palette_pixels,size_pop,n_workers):
+	source_raw=RawArray(ctypes.c_uint8,source_pixels.size)
+	palette_raw=RawArray(ctypes.c_uint8,palette_pixels.size)
+	rows_raw=RawArray(ctypes.c_int32,size_pop*len(palette_pixels))
+	np.frombuffer(source_raw,dtype=np.uint8)[:]=source_pixels.ravel()
+	np.frombuffer(palette_raw,dtype=np.uint8)[:]=palette_pixels.ravel()
+	rows=np.frombuffer(rows_raw,dtype=np.int32).reshape(size_pop,len(palette_pixels))
+
+	pool=Pool(n_workers,init_fitness_worker,(fitness_func,source_raw,palette_raw,rows_raw,size_pop))
+
+	def evaluate(source_pixels,palette_pixels,population):
+		rows[:len(population)]=population
+		bounds=np.linspace(0,len(population),n_workers+1).astype(int).tolist()
+		return np.concatenate(pool.map(evaluate_rows,zip(bounds[:-1],bounds[1:])))
+
+	return pool,evaluate
+
+#wraps the shared buffers inherited from the parent process into numpy arrays
+def init_fitness_worker(fitness_func,source_raw,palette_raw,rows_raw,size_pop):
+	worker_state["fitness_func"]=fitness_func
+	worker_state["source_pixels"]=np.frombuffer(source_raw,dtype=np.uint8).reshape(-1,3)
+	worker_state["palette_pixels"]=np.frombuffer(palette_raw,dtype=np.uint8).reshape(-1,3)
+	worker_state["rows"]=np.frombuffer(rows_raw,dtype=np.int32).reshape(size_pop,-1)
+
+#fitness of the individuals stored in the rows [start,stop) of the shared buffer
+def evaluate_rows(bounds):
+	start,stop=bounds
+	return worker_state["fitness_func"](worker_state["source_pixels"],worker_state["palette_pixels"],worker_state["rows"][start:stop])
+
+#returns the pixels of an image as a (n,3) uint8 array
+def image_to_array(im):
+	return np.asarray(im.convert("RGB"),dtype=np.uint8).reshape(-1,3)
+
+#builds an image with the size of the source from an (n,3) array of pixels
+def build_image(source_im,pixels):
+	return Image.fromarray(pixels.reshape(source_im.size[1],source_im.size[0],3),"RGB")
+
+#sorts a population and its fitness, minimization
+def sort_population(population,fitnesses):
+	order=np.argsort(fitnesses,kind="mergesort")
+	return population[order],fitnesses[order]
+
+#Tournament Selection on a sorted population, the winner of a tournament is the contestant with the lowest row
+def tournament_selection_array(size_pop,t_size,rng):
+	return rng.randint(0,size_pop,(size_pop,t_size)).min(axis=1)
+
+#uniform order-based crossover: each child keeps the genes of one parent at a random half of the positions and
+#receives the remaining pixels in the order they appear in the other parent, so the children are still permutations
+def uniform_order_cross(parent1,parent2,prob_cross,rng):
+	if rng.random_sample()>=prob_cross:
+		return parent1.copy(),parent2.copy()
+
+	mask=rng.random_sample(len(parent1))<0.5
+	return fill_from(parent1,parent2,mask),fill_from(parent2,parent1,mask)
+
+#child with the genes of "keep" where mask is set, the other positions filled with the missing genes in the order of "other"
+def fill_from(keep,other,mask):
+	kept=np.zeros(len(keep),dtype=bool)
+	kept[keep[mask]]=True
+
+	child=keep.copy()
+	child[~mask]=other[~kept[other]]
+	return child
+
+#two random cut points a<b
+def cut_points(size,rng):
+	a,b=sorted(rng.randint(0,size+1,2))
+	while a==b:
+		a,b=sorted(rng.randint(0,size+1,2))
+	return a,b
+
+#partially mapped crossover (PMX)
+def pmx_cross(parent1,parent2,prob_cross,rng):
+	if rng.random_sample()>=prob_cross:
+		return parent1.copy(),parent2.copy()
+
+	a,b=cut_points(len(parent1),rng)
+	return pmx_child(parent1,parent2,a,b),pmx_child(parent2,parent1,a,b)
+
+#child with the segment [a,b) of "donor" and the other genes of "other", where a gene of "other" already in the segment
+#is replaced by following the mapping donor[i]->other[i] until it leaves the segment
+#the mapping chains are disjoint, so following all of them at once is linear in the segment length
+def pmx_child(donor,other,a,b):
+	size=len(donor)
+	in_segment=np.zeros(size,dtype=bool)
+	in_segment[donor[a:b]]=True
+	position_in_donor=np.empty(size,dtype=np.int64)
+	position_in_donor[donor]=np.arange(size)
+
+	child=other.copy()
+	child[a:b]=donor[a:b]
+
+	outside=np.concatenate((np.arange(a),np.arange(b,size)))
+	conflicts=outside[in_segment[other[outside]]]
+	genes=other[conflicts]
+	pending=np.ones(len(genes),dtype=bool)
+	while pending.any():
+		genes[pending]=other[position_in_donor[genes[pending]]]
+		pending[pending]=in_segment[genes[pending]]
+
+	child[conflicts]=genes
+	return child
+
+#order crossover (OX)
+def order_cross(parent1,parent2,prob_cross,rng):
+	if rng.random_sample()>=prob_cross:
+		return parent1.copy(),parent2.copy()
+
+	a,b=cut_points(len(parent1),rng)
+	return order_child(parent1,parent2,a,b),order_child(parent2,parent1,a,b)
+
+#child with the segment [a,b) of "donor", the free positions are filled from b onwards (wrapping around)
+#with the missing genes in the order they appear in "other" starting at b
+def order_child(donor,other,a,b):
+	size=len(donor)
+	in_segment=np.zeros(size,dtype=bool)
+	in_segment[donor[a:b]]=True
+
+	child=donor.copy()
+	genes=np.roll(other,-b)
+	child[(b+np.arange(size-(b-a)))%size]=genes[~in_segment[genes]]
+	return child
+
+#cycle crossover (CX): the positions are split in the cycles of the permutation that maps parent1 onto parent2,
+#children take alternate cycles from each parent so every gene stays at a position it had in one of the parents
+def cycle_cross(parent1,parent2,prob_cross,rng):
+	if rng.random_sample()>=prob_cross:
+		return parent1.copy(),parent2.copy()
+
+	size=len(parent1)
+	position_in_parent1=np.empty(size,dtype=np.int64)
+	position_in_parent1[parent1]=np.arange(size)
+
+	#position i is linked to the position where parent1 holds parent2[i], the cycles are the connected components
+	links=csr_matrix((np.ones(size),(np.arange(size),position_in_parent1[parent2])),shape=(size,size))
+	_,cycles=connected_components(links,directed=True,connection="weak")
+
+	odd=(cycles%2).astype(bool)
+	child1=parent1.copy()
+	child2=parent2.copy()
+	child1[odd]=parent2[odd]
+	child2[odd]=parent1[odd]
+	return child1,child2
+
+#edge recombination crossover (ERX), each child is built from the union of the ring adjacencies of both parents
+def edge_recombination_cross(parent1,parent2,prob_cross,rng):
+	if rng.random_sample()>=prob_cross:
+		return parent1.copy(),parent2.copy()
+
+	neighbours=edge_map(parent1,parent2)
+	child1=edge_child(neighbours,parent1[0],rng)
+	neighbours=edge_map(parent1,parent2)
+	child2=edge_child(neighbours,parent2[0],rng)
+	return child1,child2
+
+#neighbours of each gene in both parents seen as rings, as python lists of at most 4 distinct genes
+def edge_map(parent1,parent2):
+	size=len(parent1)
+	neighbours=np.empty((size,4),dtype=np.int64)
+	for k,parent in enumerate((parent1,parent2)):
+		neighbours[parent,2*k]=np.roll(parent,1)
+		neighbours[parent,2*k+1]=np.roll(parent,-1)
+
+	return [list(set(row)) for row in neighbours.tolist()]
+
+#walks the edge map: the next gene is the neighbour with the fewest remaining neighbours, or a random unused gene
+#when the current one has none left; unused genes are kept in a list with O(1) removal
+def edge_child(neighbours,gene,rng):
+	size=len(neighbours)
+	unused=range(size)
+	slot=range(size)
+	child=np.empty(size,dtype=np.int64)
+
+	for i in xrange(size):
+		child[i]=gene
+
+		last=unused.pop()
+		if last!=gene:
+			unused[slot[gene]]=last
+			slot[last]=slot[gene]
+
+		candidates=neighbours[gene]
+		for neighbour in candidates:
+			neighbours[neighbour].remove(gene)
+
+		if candidates:
+			fewest=min(len(neighbours[neighbour]) for neighbour in candidates)
+			ties=[neighbour for neighbour in candidates if len(neighbours[neighbour])==fewest]
+			gene=ties[rng.randint(len(ties))]
+		elif unused:
+			gene=unused[rng.randint(len(unused))]
+
+	return child
+
+#permutation crossovers of the array engine, by name
+crossovers={"uniform_order":uniform_order_cross,"pmx":pmx_cross,"order":order_cross,"cycle":cycle_cross,"edge":edge_recombination_cross}
+
+#swap mutation: each position takes part in a swap with probability prob_mut, in place
+def swap_mutation(individual,prob_mut,rng):
+	size=len(individual)
+	n_swaps=rng.binomial(size,prob_mut)
+	for i,j in zip(rng.randint(0,size,n_swaps),rng.randint(0,size,n_swaps)):
+		individual[i],individual[j]=individual[j],individual[i]
+
+#rgb distance for a whole population at once, through kernels.population_fitness so KERNELS_BACKEND applies
+#the pixels are converted once to the int32 arrays the kernels take as they are
+def fitness_rgb_batch(source_pixels,palette_pixels,population):
+	return kernels.population_fitness(source_pixels.astype(np.int32),palette_pixels.astype(np.int32),population)
+
+#L*ab distance for a whole population at once, the pixels are converted once through the lookup table
+def fitness_lab_batch(source_pixels,palette_pixels,population):
+	return kernels.population_fitness(rgb_to_lab(source_pixels),rgb_to_lab(palette_pixels),population,sqrt=True)
 
 if __name__ == '__main__':
 	source="american_gothic.png"
@@ -174,8 +597,22 @@ if __name__ == '__main__':
 	tournament_size=3
 	prob_cross=0.9
 	elite_size=0.05
-
-	ea(source_im,palette_im,n_generations,size_pop,tournament_selection,tournament_size,uniform_cross,prob_cross,survivors_elitism,fitness_rgb,elite_size)
+	use_arrays=True		#array-backed engine, the PIL one converts every individual back and forth
+	prob_mut=0.0005
+	crossover=crossovers["uniform_order"]		#permutation crossover of the array engine, see benchmark_crossover.py
+	seed=None
+	n_workers=1			#processes evaluating the fitness of the array engine
+	n_islands=1			#more than one runs the island model, one process per island
+	migration_interval=10
+	n_migrants=2
+
+	kernels.report_backend()
+	if n_islands>1:
+		ea_islands(source_im,palette_im,n_islands,n_generations,size_pop,tournament_size,crossover,prob_cross,swap_mutation,prob_mut,fitness_rgb_batch,elite_size,migration_interval,n_migrants,seed or 0)
+	elif use_arrays:
+		ea_array(source_im,palette_im,n_generations,size_pop,tournament_size,crossover,prob_cross,swap_mutation,prob_mut,fitness_rgb_batch,elite_size,seed,n_workers)
+	else:
+		ea(source_im,palette_im,n_generations,size_pop,tournament_selection,tournament_size,uniform_cross,prob_cross,survivors_elitism,fitness_rgb,elite_size)
 
 	
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Batched Simulated Annealing - Morphing an image into another with the same color palette - Just for fun
+"""
+
+import time
+import numpy as np
+from PIL import Image
+from source_palette_ea import image_to_array,build_image
+from kernels import pixel_errors,swap_deltas,report_backend
+from anytime import make_budget,budget_exhausted,start_snapshot_writer,snapshot_due,submit_snapshot,stop_snapshot_writer
+from checkpoint import make_checkpointer,checkpoint_due,save_checkpoint,load_checkpoint
+from progress import make_progress,progress_update,progress_phase,progress_finish
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#simulated annealing on a permutation of the palette: every step draws batch_size swaps between disjoint pairs of
+#positions, computes all their deltas at once and accepts each one under the Metropolis rule
+#the pairs never share a position, so the accepted swaps do not interfere and are applied together, exactly
+#the temperature falls geometrically from t_start to t_end over n_steps steps, or over deadline seconds when n_steps is
+#None, with t_start None it is estimated from the uphill deltas of the first batch and t_end defaults to t_start/1000
+#initial_order (e.g. from source_palette_sort.rank_order) starts the search from that permutation instead of a random one
+#deadline, target_fitness, snapshot_interval, checkpoint_path, checkpoint_interval and progress work as in
+#source_palette_ea.ea_array, returns the best order found and its fitness
+def sa(source_im,palette_im,n_steps,batch_size,t_start=None,t_end=None,seed=None,initial_order=None,deadline=None,target_fitness=None,snapshot_interval=None,checkpoint_path=None,checkpoint_interval=600,progress=None):
+	assert n_steps is not None or deadline is not None, "the temperature schedule needs n_steps or a deadline"
+	if progress is None:
+		progress=make_progress("sa",n_steps)
+	rng=np.random.RandomState(seed)
+	source_pixels=image_to_array(source_im).astype(np.int64)
+	palette_pixels=image_to_array(palette_im).astype(np.int64)
+	n_pixels=len(palette_pixels)
+	batch_size=min(batch_size,n_pixels/2)
+
+	checkpoint=load_checkpoint(checkpoint_path)
+	if checkpoint is not None:
+		order,best_order,best_fitness,t_start,t_end,step=resume_sa(checkpoint,rng)
+	else:
+		progress_phase(progress,"initialization")
+		order=rng.permutation(n_pixels) if initial_order is None else np.array(initial_order)
+		best_order=order.copy()
+		best_fitness=None
+		step=0
+
+	current=palette_pixels[order]
+	errors=pixel_errors(source_pixels,current)
+	current_fitness=errors.sum()
+	if best_fitness is None:
+		best_fitness=current_fitness
+	if t_start is None:
+		t_start=initial_temperature(source_pixels,current,errors,batch_size,rng)
+	if t_end is None:
+		t_end=t_start/1000.0
+
+	checkpointer=make_checkpointer(checkpoint_path,checkpoint_interval)
+	budget=make_budget(deadline,target_fitness)
+	writer=None
+	if snapshot_interval is not None:
+		writer=start_snapshot_writer("best_palette.png",snapshot_interval,lambda order,path: build_image(source_im,palette_pixels[order]).save(path))
+
+	progress_phase(progress,"search")
+	start=time.time()
+	try:
+		while (n_steps is None or step<n_steps) and not budget_exhausted(budget,best_fitness):
+			if n_steps is not None:
+				fraction=step/float(n_steps)
+			else:
+				fraction=min(1.0,(time.time()-start)/deadline)
+			temperature=t_start*(t_end/t_start)**fraction
+
+			i,j=disjoint_pairs(n_pixels,batch_size,rng)
+			delta=swap_deltas(source_pixels,current,errors,i,j)
+			#uphill moves pass with probability exp(-delta/T), downhill ones always
+			accepted=rng.random_sample(len(delta))<np.exp(-np.maximum(delta,0)/temperature)
+			i=i[accepted]
+			j=j[accepted]
+
+			order[i],order[j]=order[j],order[i]
+			current[i],current[j]=current[j],current[i]
+			errors[i]=pixel_errors(source_pixels[i],current[i])
+			errors[j]=pixel_errors(source_pixels[j],current[j])
+			current_fitness+=delta[accepted].sum()
+
+			if current_fitness<best_fitness:
+				best_fitness=current_fitness
+				best_order[:]=order
+			step+=1
+			progress_update(progress,done=step,evaluations=len(delta),accepted=len(i),rejected=len(delta)-len(i),best=best_fitness)
+
+			if snapshot_due(writer):
+				submit_snapshot(writer,best_order.copy())
+			if checkpoint_due(checkpointer):
+				checkpoint_sa(checkpointer,order,best_order,best_fitness,t_start,t_end,step,rng)
+
+		if checkpointer is not None:
+			checkpoint_sa(checkpointer,order,best_order,best_fitness,t_start,t_end,step,rng)
+	finally:
+		stop_snapshot_writer(writer)
+
+	progress_phase(progress,"render")
+	build_image(source_im,palette_pixels[best_order]).save("best_palette.png")
+	progress_finish(progress)
+	return best_order,best_fitness
+
+#saves the current and the best orders, the temperatures, the step and the state of rng
+#a deadline schedule starts over on resume, the temperature is a function of the time spent in this run
+def checkpoint_sa(checkpointer,order,best_order,best_fitness,t_start,t_end,step,rng):
+	save_checkpoint(checkpointer,{"order":order,"best_order":best_order},
+		{"best_fitness":best_fitness,"t_start":t_start,"t_end":t_end,"step":step,"rng_state":rng.get_state()})
+
+#restores the state saved by checkpoint_sa into rng
+def resume_sa(checkpoint,rng):
+	arrays,state=checkpoint
+	rng.set_state(state["rng_state"])
+	print "resuming from step "+str(state["step"])+": best fitness: "+str(state["best_fitness"])
+	return np.array(arrays["order"]),np.array(arrays["best_order"]),state["best_fitness"],state["t_start"],state["t_end"],state["step"]
+
+#up to batch_size pairs of positions (i[k],j[k]) where no position appears twice
+#positions are drawn with replacement and the pairs touching a repeated one are dropped, which only sorts the batch
+#instead of shuffling all the positions, with batch_size much smaller than the image few pairs are lost
+def disjoint_pairs(n_pixels,batch_size,rng):
+	positions=rng.randint(0,n_pixels,2*batch_size)
+	_,inverse,counts=np.unique(positions,return_inverse=True,return_counts=True)
+	unique=(counts[inverse]==1).reshape(-1,2).all(axis=1)
+	pairs=positions.reshape(-1,2)[unique]
+	return pairs[:,0],pairs[:,1]
+
+#temperature at which the median uphill move of a random batch is accepted with probability 1/2
+def initial_temperature(source_pixels,palette_pixels,errors,batch_size,rng):
+	i,j=disjoint_pairs(len(palette_pixels),batch_size,rng)
+	delta=swap_deltas(source_pixels,palette_pixels,errors,i,j)
+	uphill=delta[delta>0]
+	if len(uphill)==0:
+		return 1.0
+	return np.median(uphill)/np.log(2)
+
+if __name__ == '__main__':
+	source="american_gothic.png"
+	palette="spheres.png"
+
+	#algorithm parameters
+	source_im=Image.open(source)
+	palette_im=Image.open(palette)
+	n_steps=20000
+	batch_size=4096		#swaps proposed and scored together at every step
+	t_start=None		#estimated from the first batch
+	t_end=None
+	seed=None
+
+	report_backend()
+	sa(source_im,palette_im,n_steps,batch_size,t_start,t_end,seed)
@@ -9,25 +9,17 @@ import random
 from math import log
 from copy import deepcopy
 from operator import itemgetter
+import numpy as np
 from PIL import Image
-from colormath.color_diff import delta_e_cie1976
-from colormath.color_conversions import convert_color
-from colormath.color_objects import LabColor,sRGBColor
+from lab_lut import colordiff_lab,colordiff_lab_array,rgb_to_lab
+from kernels import colordiff_rgb
 
 __author__ = 'Alexandre Pinto'
 __email__ = "alexandpinto@gmail.com"
 __date__='2014'
 
-source_pixels=[]
-palette_pixels=[]
-
-
-## custom sort
-def comparator(x,y):
-	a=colordiff_lab(palette_pixels[x],source_pixels[x])
-	b=colordiff_lab(palette_pixels[y],source_pixels[y])
-	return int(a-b)
-
+#sorts the positions by the L*ab difference between the source and the palette pixel at that position
+#the difference is a key computed once per position, instead of twice per comparison
 def search(source_im,palette_im,new_filename):
 
 	columns=source_im.size[0]
@@ -35,20 +27,89 @@ def search(source_im,palette_im,new_filename):
 	size=columns*rows
 
 	#pixels
-	global source_pixels
-	global palette_pixels
 	source_pixels=list(source_im.getdata())
 	palette_pixels=list(palette_im.getdata())
+	diffs=colordiff_lab_array(source_pixels,palette_pixels).tolist()
 
 	#current and new order of pixels
 	new_palette_order=[i for i in xrange(size)]
 
-	new_palette_order.sort(comparator)
+	new_palette_order.sort(key=lambda x: diffs[x])
 
 	build_final_solution(source_im,palette_im,new_palette_order,new_filename)
 
+#rank matching: source and palette pixels are sorted independently by a key (luminance, L* or hilbert index)
+#and the ith darkest/lowest palette pixel goes to the position of the ith source pixel, O(n log n)
+#fast baseline for huge images, or initial solution for the ILS and EA solvers
+def search_rank(source_im,palette_im,key_func,new_filename):
+
+	source_pixels=np.asarray(source_im.convert("RGB")).reshape(-1,3)
+	palette_pixels=np.asarray(palette_im.convert("RGB")).reshape(-1,3)
+
+	new_palette_order=rank_order(source_pixels,palette_pixels,key_func)
+
+	build_final_solution(source_im,palette_im,new_palette_order.tolist(),new_filename)
+	return new_palette_order
+
+#new_palette_order[i] is the index of the palette pixel with the same key rank as the ith source pixel
+def rank_order(source_pixels,palette_pixels,key_func):
+	source_ranks=np.argsort(key_func(source_pixels),kind="mergesort")
+	palette_ranks=np.argsort(key_func(palette_pixels),kind="mergesort")
+
+	new_palette_order=np.empty(len(source_pixels),dtype=np.int64)
+	new_palette_order[source_ranks]=palette_ranks
+	return new_palette_order
+
+#perceived luminance of each pixel (ITU-R 601)
+def luminance_key(pixels):
+	pixels=pixels.astype(np.int64)
+	return 299*pixels[:,0]+587*pixels[:,1]+114*pixels[:,2]
+
+#L* of each pixel, from the precomputed lookup table
+def lightness_key(pixels):
+	return rgb_to_lab(pixels)[:,0]
+
+#index of each pixel along a 3-D hilbert curve over the RGB cube, close colours get close indexes
+#Skilling's transposed-index algorithm ("Programming the Hilbert curve", 2004), vectorized over all the pixels
+def hilbert_key(pixels,bits=8):
+	x=[pixels[:,k].astype(np.int64) for k in xrange(3)]
+
+	#inverse undo
+	q=1<<(bits-1)
+	while q>1:
+		p=q-1
+		for i in xrange(3):
+			invert=(x[i]&q)!=0
+			t=np.where(invert,0,(x[0]^x[i])&p)
+			x[0]=np.where(invert,x[0]^p,x[0]^t)
+			if i>0:
+				x[i]=x[i]^t
+		q>>=1
+
+	#gray encode
+	for i in xrange(1,3):
+		x[i]=x[i]^x[i-1]
+	t=np.zeros(len(pixels),dtype=np.int64)
+	q=1<<(bits-1)
+	while q>1:
+		t=np.where((x[2]&q)!=0,t^(q-1),t)
+		q>>=1
+	for i in xrange(3):
+		x[i]=x[i]^t
+
+	#interleave the transposed bits, most significant first
+	key=np.zeros(len(pixels),dtype=np.int64)
+	for bit in xrange(bits-1,-1,-1):
+		for i in xrange(3):
+			key=(key<<1)|((x[i]>>bit)&1)
+	return key
+
+#rank keys, by name
+rank_keys={"luminance":luminance_key,"lightness":lightness_key,"hilbert":hilbert_key}
+
 #generates the new palette with the same dimensions as the source but with its own colours
-def build_final_solution(source_im,palette_pixels,new_palette_order,new_filename):
+#new_palette_order[i] is the index of the palette pixel placed at the ith position
+def build_final_solution(source_im,palette_im,new_palette_order,new_filename):
 
 	source_size=source_im.size
 
@@ -60,38 +121,11 @@ def build_final_solution(source_im,palette_pixels,new_palette_order,new_filename
 
 	new_palette_pixels=[]
 	for n in new_palette_order:
-		new_palette_pixels+=[palette_pixels[new_palette_order[n]]]
+		new_palette_pixels+=[palette_pixels[n]]
 	
 	new_palette.putdata(new_palette_pixels)
 	new_palette.save(new_filename)
 
-#calculate color difference of two pixels in the RGB space
-#less is better
-def colordiff_rgb(pixel1,pixel2):
-
-	delta_red=pixel1[0]-pixel2[0]
-	delta_green=pixel1[1]-pixel2[1]
-	delta_blue=pixel1[2]-pixel2[2]
-
-	fit=delta_red**2+delta_green**2+delta_blue**2
-	return fit
-
-#http://python-colormath.readthedocs.org/en/latest/index.html
-#calculate color difference of two pixels in the L*ab space
-#less is better
-def colordiff_lab(pixel1,pixel2):
-
-	#convert rgb values to L*ab values
-	rgb_pixel_1=sRGBColor(pixel1[0],pixel1[1],pixel1[2],True)
-	lab_1= convert_color(rgb_pixel_1, LabColor)
-
-	rgb_pixel_2=sRGBColor(pixel2[0],pixel2[1],pixel2[2],True)
-	lab_2= convert_color(rgb_pixel_2, LabColor)
-
-	#calculate delta e
-	delta_e = delta_e_cie1976(lab_1, lab_2)
-	return delta_e
-
 if __name__ == '__main__':
 	sources=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
 	palettes=["images/american_gothic.png","images/spheres.png","images/mona_lisa.png","images/nature.png","images/starry_night.png","images/the_scream.png","images/mona_lisa_small.png","images/american_gothic_small.png"]
@@ -102,5 +136,9 @@ if __name__ == '__main__':
 	source_im=Image.open(source)
 	palette_im=Image.open(palette)
 	new_filename=palette.split(".")[0]+"_rearranged.png"
+	rank_key="hilbert"		#None sorts by L*ab difference, otherwise "luminance", "lightness" or "hilbert" rank matching
 
-	search(source_im,palette_im,new_filename)
\ No newline at end of file
+	if rank_key is None:
+		search(source_im,palette_im,new_filename)
+	else:
+		search_rank(source_im,palette_im,rank_keys[rank_key],new_filename)
\ No newline at end of file
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Utilities - small helpers shared by the morphing scripts
+"""
+
+from PIL import Image
+
+__author__ = 'Alexandre Pinto'
+__email__ = "alexandpinto@gmail.com"
+__date__='2014'
+
+#checks that the rearranged image uses exactly the colours of the palette, as many times each
+def check(palette, copy):
+    palette = sorted(Image.open(palette).convert('RGB').getdata())
+    copy = sorted(Image.open(copy).convert('RGB').getdata())
+    print 'Success' if copy == palette else 'Failed'
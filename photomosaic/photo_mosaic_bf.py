@@ -5,16 +5,23 @@
 Photomosaic - Just for fun
 """
 
+import os
+import sys
+import numpy as np
 from PIL import Image
-from colormath.color_objects import LabColor,sRGBColor
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie1976
+
+#the L*ab lookup table and the progress reports are shared with the image-morphing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"image-morphing"))
+from lab_lut import colordiff_lab
+from kernels import colordiff_rgb,fitness_rgb,average_color,block_averages,pairwise_distances,report_backend
+from progress import make_progress,progress_update,progress_phase,progress_finish
 
 __author__ = 'Alexandre Pinto'
 __email__ = "alexandpinto@gmail.com"
 __date__='2014'
 
-def build_photomosaic(mosaic_im,target_im,block_width,block_height,colordiff,new_filename):
+#progress (see progress.make_progress) receives the rate-limited reports, one is created when it is not given
+def build_photomosaic(mosaic_im,target_im,block_width,block_height,colordiff,new_filename,progress=None):
 
 	mosaic_width=mosaic_im.size[0]				#dimensions of the target image
 	mosaic_height=mosaic_im.size[1]
@@ -28,24 +35,35 @@ def build_photomosaic(mosaic_im,target_im,block_width,block_height,colordiff,new
 	target_nboxes=target_grid_width*target_grid_height
 	mosaic_nboxes=mosaic_grid_width*mosaic_grid_height
 
-	print "Computing the average color of each photo in the mosaic..."
+	if progress is None:
+		progress=make_progress("photomosaic bf",target_nboxes)
+
+	progress_phase(progress,"averages")
 	mosaic_color_averages=compute_block_avg(mosaic_im,block_width,block_height)
-	print "Computing the average color of each block in the target photo ..."
 	target_color_averages=compute_block_avg(target_im,block_width,block_height)
 
-	print "Computing photomosaic ..."
+	progress_phase(progress,"search")
 	photomosaic=[0]*target_nboxes
-	for n in xrange(target_nboxes):
-		print "%.2f " % (n/float(target_nboxes)*100)+"%"
-		for z in xrange(mosaic_nboxes):
-			current_diff=colordiff(target_color_averages[n],mosaic_color_averages[photomosaic[n]])
-			candidate_diff=colordiff(target_color_averages[n],mosaic_color_averages[z])
-
-			if(candidate_diff<current_diff):
-				photomosaic[n]=z
-
-	print "Building final image ..."
+	if colordiff is colordiff_rgb:
+		#the same scan for a chunk of blocks at once, argmin keeps the first closest photo like the loop below
+		rows=max(1,(1<<22)/mosaic_nboxes)
+		for n in xrange(0,target_nboxes,rows):
+			progress_update(progress,done=n,evaluations=rows*mosaic_nboxes)
+			photomosaic[n:n+rows]=pairwise_distances(target_color_averages[n:n+rows],mosaic_color_averages).argmin(axis=1).tolist()
+	else:
+		for n in xrange(target_nboxes):
+			progress_update(progress,done=n,evaluations=mosaic_nboxes)
+			for z in xrange(mosaic_nboxes):
+				current_diff=colordiff(target_color_averages[n],mosaic_color_averages[photomosaic[n]])
+				candidate_diff=colordiff(target_color_averages[n],mosaic_color_averages[z])
+
+				if(candidate_diff<current_diff):
+					photomosaic[n]=z
+
+	progress_update(progress,done=target_nboxes)
+	progress_phase(progress,"render")
 	build_final_solution(photomosaic,mosaic_im,target_nboxes,target_im,target_grid_width,block_height,block_width,new_filename)
+	progress_finish(progress)
 
 def build_initial_solution(target_nboxes,mosaic_nboxes):
 	candidate=[0]*target_nboxes
@@ -81,38 +99,15 @@ def get_grid_dimensions(im_width,im_height,block_width,block_height):
 
 #compute the fitness of given candidate solution
 def fitness(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes):
-	error=0.0
-	for i in xrange(target_nboxes):
-		error+=colordiff_rgb(mosaic_color_averages[candidate[i]],target_color_averages[i])
-	return error
+	return fitness_rgb([mosaic_color_averages[candidate[i]] for i in xrange(target_nboxes)],target_color_averages[:target_nboxes])
 
 #get a list of color averages, i.e, the average color of each block in the given image
 def compute_block_avg(im,block_height,block_width):
-
-	width=im.size[0]
-	height=im.size[1]
-
-	grid_width_dim=width/block_width					#dimension of the grid
-	grid_height_dim=height/block_height
-
-	nblocks=grid_width_dim*grid_height_dim				#number of blocks
-
-	avg_colors=[]
-	for i in xrange(nblocks):
-		avg_colors+=[avg_color(get_block(im,i,block_width,block_height))]
-	return avg_colors
+	return [tuple(color) for color in block_averages(np.asarray(im.convert("RGB")),block_height,block_width).tolist()]
 
 #returns the average RGB color of a given image
 def avg_color(im):
-	avg_r=avg_g=avg_b=0.0
-	pixels=im.getdata()
-	size=len(pixels)
-	for p in pixels:
-		avg_r+=p[0]/float(size)
-		avg_g+=p[1]/float(size)
-		avg_b+=p[2]/float(size)
-
-	return (avg_r,avg_g,avg_b)
+	return average_color(np.asarray(im.convert("RGB")))
 
 #get the nth block of the image
 def get_block(im,n,block_width,block_height):
@@ -129,33 +124,6 @@ def get_block(im,n,block_width,block_height):
 	return block_im
 
 
-#calculate color difference of two pixels in the RGB space
-#less is better
-def colordiff_rgb(pixel1,pixel2):
-
-	delta_red=pixel1[0]-pixel2[0]
-	delta_green=pixel1[1]-pixel2[1]
-	delta_blue=pixel1[2]-pixel2[2]
-
-	fit=delta_red**2+delta_green**2+delta_blue**2
-	return fit
-
-#http://python-colormath.readthedocs.org/en/latest/index.html
-#calculate color difference of two pixels in the L*ab space
-#less is better
-def colordiff_lab(pixel1,pixel2):
-
-	#convert rgb values to L*ab values
-	rgb_pixel_1=sRGBColor(pixel1[0],pixel1[1],pixel1[2],True)
-	lab_1= convert_color(rgb_pixel_1, LabColor)
-
-	rgb_pixel_2=sRGBColor(pixel2[0],pixel2[1],pixel2[2],True)
-	lab_2= convert_color(rgb_pixel_2, LabColor)
-
-	#calculate delta e
-	delta_e = delta_e_cie1976(lab_1, lab_2)
-	return delta_e
-
 
 if __name__ == '__main__':
 	mosaic="images/25745_avatars.png"
@@ -166,4 +134,5 @@ if __name__ == '__main__':
 	new_filename=target.split(".")[0]+"_photomosaic.png"
 	colordiff=colordiff_rgb
 
+	report_backend()
 	build_photomosaic(mosaic_im,target_im,48,48,colordiff,new_filename)
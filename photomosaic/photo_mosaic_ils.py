@@ -5,16 +5,32 @@
 Iterated Local Search - An alternative to build a photomosaic - Just for fun
 """
 
+import os
+import sys
 import random
-from copy import deepcopy
+from array import array
 from math import exp
+import numpy as np
 from PIL import Image
 
+#the anytime helpers are shared with the image-morphing scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"image-morphing"))
+from anytime import make_budget,budget_exhausted,start_snapshot_writer,snapshot_due,submit_snapshot,stop_snapshot_writer
+from checkpoint import make_checkpointer,checkpoint_due,save_checkpoint,load_checkpoint
+from progress import make_progress,progress_update,progress_phase,progress_finish
+from permutation import make_state,state_set,state_swap,mark_best,rollback
+from kernels import colordiff_rgb,fitness_rgb,average_color,block_averages,report_backend
+
 __author__ = 'Alexandre Pinto'
 __email__ = "alexandpinto@gmail.com"
 __date__='2014'
 
-def build_photomosaic_ils(mosaic_im,target_im,block_width,block_height,nsteps,niterations,nperturbations,acceptance_mode,new_filename):
+#anytime: stops after niterations (None for no limit), once deadline seconds have passed or when the fitness reaches
+#target_fitness, with snapshot_interval the best-so-far mosaic is written every snapshot_interval seconds by a
+#background thread
+#with checkpoint_path the search is saved there every checkpoint_interval seconds, and resumed from it if it exists
+#progress (see progress.make_progress) receives the rate-limited reports, one is created when it is not given
+def build_photomosaic_ils(mosaic_im,target_im,block_width,block_height,nsteps,niterations,nperturbations,acceptance_mode,new_filename,deadline=None,target_fitness=None,snapshot_interval=None,checkpoint_path=None,checkpoint_interval=600,progress=None):
 
 	mosaic_width=mosaic_im.size[0]				#dimensions of the target image
 	mosaic_height=mosaic_im.size[1]
@@ -28,27 +44,67 @@ def build_photomosaic_ils(mosaic_im,target_im,block_width,block_height,nsteps,ni
 	target_nboxes=target_grid_width*target_grid_height
 	mosaic_nboxes=mosaic_grid_width*mosaic_grid_height
 
-	print "Computing the average color of each photo in the mosaic..."
+	if progress is None:
+		progress=make_progress("photomosaic ils",niterations)
+
+	progress_phase(progress,"averages")
 	mosaic_color_averages=compute_block_avg(mosaic_im,block_width,block_height)
-	print "Computing the average color of each photo in the target photo ..."
 	target_color_averages=compute_block_avg(target_im,block_width,block_height)
 
-	print "Computing initial solution ..."
-	candidate=build_initial_solution(target_nboxes,mosaic_nboxes)
-
-	print "Applying a local search ..."
-	best,best_fitness=local_search(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes,nsteps)
-
-	print "Iterated local Search ..."
-	for i in xrange(niterations):
-		print "Progress: %.2f " % (i/float(niterations)*100)+"%"
+	checkpoint=load_checkpoint(checkpoint_path)
+	if checkpoint is not None:
+		best,best_fitness,elite,elite_fitness,i=resume_ils(checkpoint)
+	else:
+		progress_phase(progress,"initial local search")
+		candidate=build_initial_solution(target_nboxes,mosaic_nboxes)
+		best,best_fitness=local_search(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes,nsteps)
+
+		#with the random walk and annealing acceptances "best" is only the current solution, the best one found is kept apart
+		elite,elite_fitness=best,best_fitness
+		i=0
+	checkpointer=make_checkpointer(checkpoint_path,checkpoint_interval)
+
+	budget=make_budget(deadline,target_fitness)
+	writer=None
+	if snapshot_interval is not None:
+		writer=start_snapshot_writer(new_filename,snapshot_interval,lambda best,path: build_final_solution(best,mosaic_im,target_nboxes,target_im.copy(),target_grid_width,block_height,block_width,path))
+
+	progress_phase(progress,"search")
+	while (niterations is None or i<niterations) and not budget_exhausted(budget,elite_fitness):
 		candidate=perturbation(best,target_nboxes,mosaic_nboxes,nperturbations)
 		perturbed,perturbed_fitness=local_search(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes,nsteps)
 		best,best_fitness=acceptance(best,best_fitness,perturbed,perturbed_fitness,acceptance_mode)
-
-	print "Building final image ..."
-	build_final_solution(best,mosaic_im,target_nboxes,target_im,target_grid_width,block_height,block_width,new_filename)
-	print "Best fitness achieved: ",best_fitness
+		if best_fitness<elite_fitness:
+			elite,elite_fitness=best,best_fitness
+		#each local search tries nsteps other photos and nsteps swaps for every block
+		progress_update(progress,done=i+1,evaluations=2*nsteps*target_nboxes,best=elite_fitness)
+
+		if snapshot_due(writer):
+			submit_snapshot(writer,array('i',elite))
+		i+=1
+
+		if checkpoint_due(checkpointer):
+			checkpoint_ils(checkpointer,best,best_fitness,elite,elite_fitness,i)
+
+	stop_snapshot_writer(writer)
+	if checkpointer is not None:
+		checkpoint_ils(checkpointer,best,best_fitness,elite,elite_fitness,i)
+	progress_phase(progress,"render")
+	build_final_solution(elite,mosaic_im,target_nboxes,target_im,target_grid_width,block_height,block_width,new_filename)
+	progress_finish(progress)
+	return elite,elite_fitness
+
+#saves the current and the best solutions (photo of each block), their fitness, the iteration and the random state
+def checkpoint_ils(checkpointer,best,best_fitness,elite,elite_fitness,i):
+	save_checkpoint(checkpointer,{"best":np.array(best,dtype=np.int64),"elite":np.array(elite,dtype=np.int64)},
+		{"best_fitness":best_fitness,"elite_fitness":elite_fitness,"iteration":i,"random_state":random.getstate()})
+
+#restores the state saved by checkpoint_ils
+def resume_ils(checkpoint):
+	arrays,state=checkpoint
+	random.setstate(state["random_state"])
+	print "Resuming from iteration "+str(state["iteration"])+", best fitness: "+str(state["elite_fitness"])
+	return arrays["best"].tolist(),state["best_fitness"],arrays["elite"].tolist(),state["elite_fitness"],state["iteration"]
 
 def build_initial_solution(target_nboxes,mosaic_nboxes):
 	candidate=[0]*target_nboxes
@@ -77,42 +133,41 @@ def build_final_solution(best,mosaic_im,target_nboxes,target_im,target_grid_widt
 
 
 
+#the walk changes the photos of the candidate in place through an undo log (see permutation.make_state), the best
+#candidate visited is only marked and the walk is rolled back to it at the end, so nothing is copied per improvement
 def local_search(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes,nsteps):
 	
-	best=deepcopy(candidate)
-	best_fitness=fitness(best,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes)
+	state=make_state(candidate,fitness(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes))
+	candidate=state["order"]
 
 	#For each photo, tries to change it with another from the pool, saves it if it's a better candidate
 	#(e.g: change photo number 2 with 3,4,5,6,...) during nsteps
 	for i in xrange(target_nboxes):
 		# print "%.2f " % (i/float(target_nboxes)*100)+"%"
 		for j in xrange(nsteps):
-			candidate[i]=(candidate[i]+1)%mosaic_nboxes
+			state_set(state,i,(candidate[i]+1)%mosaic_nboxes)
 
-			candidate_fit=fitness(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes)
-			if(candidate_fit<best_fitness):
-				best=deepcopy(candidate)
-				best_fitness=candidate_fit
+			state["fitness"]=fitness(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes)
+			if(state["fitness"]<state["best_fitness"]):
+				mark_best(state)
 
 	#For each photo, swap it with the next one, then the other, and so on... (1<->2, 1<-3, ...) during nsteps
 	#saves it if it's a better candidate
 	for i in xrange(target_nboxes):
 		# print "%.2f " % (i/float(target_nboxes)*100)+"%"
 		for j in xrange(1,nsteps+1):
-			temp=candidate[i]
-			candidate[i]=candidate[(i+j)%target_nboxes]
-			candidate[(i+j)%target_nboxes]=temp
+			state_swap(state,i,(i+j)%target_nboxes)
 
-			candidate_fit=fitness(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes)
-			if(candidate_fit<best_fitness):
-				best=deepcopy(candidate)
-				best_fitness=candidate_fit
+			state["fitness"]=fitness(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes)
+			if(state["fitness"]<state["best_fitness"]):
+				mark_best(state)
 
-	return best,best_fitness
+	rollback(state)
+	return state["order"],state["best_fitness"]
 
 
 def perturbation(best,target_nboxes,mosaic_nboxes,nperturbations):
-	perturbed=deepcopy(best)
+	perturbed=array('i',best)
 
 	for i in xrange(nperturbations):
 		if random.random()<0.5: 
@@ -161,39 +216,19 @@ def get_grid_dimensions(im_width,im_height,block_width,block_height):
 	return grid_width,grid_height
 
 #compute the fitness of given candidate solution
+#the photos of the candidate are looked up in the array of averages and the sum runs in the kernels of kernels.py
 def fitness(candidate,mosaic_color_averages,mosaic_nboxes,target_color_averages,target_nboxes):
-	error=0.0
-	for i in xrange(target_nboxes):
-		error+=colordiff_rgb(mosaic_color_averages[candidate[i]],target_color_averages[i])
-	return error
+	if isinstance(candidate,array):
+		candidate=np.frombuffer(candidate,dtype=np.int32)
+	return fitness_rgb(mosaic_color_averages[np.asarray(candidate[:target_nboxes])],target_color_averages[:target_nboxes])
 
-#get a list of color averages, i.e, the average color of each block in the given image
+#get the color averages, i.e, the average color of each block in the given image, as an (nblocks,3) array
 def compute_block_avg(im,block_height,block_width):
-
-	width=im.size[0]
-	height=im.size[1]
-
-	grid_width_dim=width/block_width					#dimension of the grid
-	grid_height_dim=height/block_height
-
-	nblocks=grid_width_dim*grid_height_dim				#number of blocks
-
-	avg_colors=[]
-	for i in xrange(nblocks):
-		avg_colors+=[avg_color(get_block(im,i,block_width,block_height))]
-	return avg_colors
+	return block_averages(np.asarray(im.convert("RGB")),block_height,block_width)
 
 #returns the average color of a given image
 def avg_color(im):
-	avg_r=avg_g=avg_b=0.0
-	pixels=im.getdata()
-	size=len(pixels)
-	for p in pixels:
-		avg_r+=p[0]/float(size)
-		avg_g+=p[1]/float(size)
-		avg_b+=p[2]/float(size)
-
-	return (avg_r,avg_g,avg_b)
+	return average_color(np.asarray(im.convert("RGB")))
 
 #get the nth block of the image
 def get_block(im,n,block_width,block_height):
@@ -210,17 +245,6 @@ def get_block(im,n,block_width,block_height):
 	return block_im
 
 
-#calculate color difference of two pixels in the RGB space
-#the less the better
-def colordiff_rgb(pixel1,pixel2):
-
-	delta_red=pixel1[0]-pixel2[0]
-	delta_green=pixel1[1]-pixel2[1]
-	delta_blue=pixel1[2]-pixel2[2]
-
-	fit=delta_red**2+delta_green**2+delta_blue**2
-	return fit
-
 if __name__ == '__main__':
 	mosaic="images/25745_avatars.png"
 	target="images/lightbulb.png"
@@ -232,4 +256,5 @@ if __name__ == '__main__':
 	acceptance_mode=1
 	new_filename="photomosaic.png"
 
+	report_backend()
 	build_photomosaic_ils(mosaic_im,target_im,48,48,nsteps,niterations,nperturbations,acceptance_mode,new_filename)